@@ -1,32 +1,42 @@
 import json
+from datetime import datetime
 from functools import wraps
 from http import HTTPStatus
 
-from flask import request, Response
+from flask import request
 from flask_jwt_extended import jwt_required, get_jwt, verify_jwt_in_request, get_jwt_identity
 from flask_restx import Resource
 
+from backend.core.services.excursion_services.analytics_service import get_daily_booking_stats, \
+    parse_analytics_params
+from backend.core.services.excursion_services.cancellation_service import get_cancellation_job
 from backend.core.services.excursion_services.excursion_photo_service import get_photos_for_excursion, \
     add_photo_to_excursion, \
     delete_photo_from_excursion
 from backend.core.services.excursion_services.excursion_service import update_excursion, create_excursion, \
     get_excursion, get_all_excursions, \
-    delete_excursion
+    delete_excursion, serialize_excursions, serialize_excursion
 from backend.core.services.excursion_services.excursion_session_service import get_sessions_for_excursion, \
     create_excursion_session, \
-    update_excursion_session, delete_excursion_session
+    update_excursion_session, delete_excursion_session, serialize_sessions, bulk_create_excursion_sessions
 from backend.core.services.user_services.profile_service import get_user_info_response, update_user, register_user
 from . import admin_ns
 from ..core.messages import AuthMessages
 from ..core.models.excursion_models import Reservation
 from ..core.schemas.auth_schemas import login_model, change_password_model, user_model
-from ..core.schemas.excursion_schemas import excursion_model, session_model, session_patch_model
+from ..core.schemas.excursion_schemas import excursion_model, session_model, session_patch_model, \
+    session_bulk_model
 from ..core.services.news_service import add_photo_to_news, get_photos_for_news, delete_photo_from_news, \
     create_news_with_images, get_all_news, get_news_by_id, update_news, delete_news
+from ..core.services.export_service import EXPORT_FORMATS, export_response
+from ..core.services.pagination import parse_limit
+from ..core.services.reservation_export_service import EXPORTS, parse_export_filters, export_rows, \
+    export_sheet_title
+from ..core.services.scheduler_service import get_scheduler_status
 from ..core.services.reservation_service import delete_reservation_with_refund, get_all_reservations, \
-    get_reservation_by_id
+    get_reservation_by_id, list_reservations_page
 from ..core.services.user_services.auth_service import get_user_by_email, authenticate_user, change_password, \
-    get_all_users, delete_user
+    get_all_users, delete_user, list_users_page
 
 
 def admin_required(fn):
@@ -43,6 +53,12 @@ def admin_required(fn):
     return wrapper
 
 
+def _with_job_status_url(result, status):
+    if status == HTTPStatus.ACCEPTED:
+        result["status_url"] = f"/api/admin/cancellation-jobs/{result['job_id']}"
+    return result, status
+
+
 @admin_ns.route('/login')
 class AdminLogin(Resource):
     @admin_ns.expect(login_model)
@@ -88,11 +104,32 @@ class AdminUserList(Resource):
     @jwt_required()
     @admin_required
     @admin_ns.doc(
-        description="Получение списка всех пользователей с возможностью фильтрации по роли (только для администратора)")
-    @admin_ns.param('role', 'Фильтрация пользователей по роли')
+        description="Получение списка всех пользователей с возможностью фильтрации по роли (только для администратора)",
+        params={
+            'role': 'Фильтрация пользователей по роли',
+            'email': 'Начало email',
+            'sort': 'Сортировка: email, full_name, с «-» — по убыванию',
+            'limit': 'Размер страницы (включает постраничную выдачу, максимум 100)',
+            'cursor': 'Курсор следующей страницы из поля next_cursor предыдущего ответа'
+        }
+    )
     def get(self):
-        role_filter = request.args.get('role')
-        users = get_all_users(role_filter)
+        args = request.args
+        try:
+            if args.get('limit') or args.get('cursor'):
+                users, next_cursor, total, estimated = list_users_page(
+                    args.get('role'), args.get('email'), args.get('sort'), parse_limit(args.get('limit')),
+                    args.get('cursor')
+                )
+                return {
+                    "users": [get_user_info_response(u)[0] for u in users],
+                    "next_cursor": next_cursor,
+                    "total": total,
+                    "total_is_estimate": estimated
+                }, HTTPStatus.OK
+            users = get_all_users(args.get('role'), args.get('email'), args.get('sort'))
+        except ValueError as e:
+            return {"message": str(e)}, HTTPStatus.BAD_REQUEST
         user_list = [get_user_info_response(u)[0] for u in users]
         return user_list, HTTPStatus.OK
 
@@ -242,7 +279,7 @@ class AdminExcursionsResource(Resource):
     @admin_ns.doc(description="Получить все экскурсии (админ)")
     def get(self):
         excursions = get_all_excursions()
-        return {"excursions": [e.to_dict() for e in excursions]}, HTTPStatus.OK
+        return {"excursions": serialize_excursions(excursions)}, HTTPStatus.OK
 
     @admin_required
     @admin_ns.doc(
@@ -278,25 +315,20 @@ class AdminExcursionResource(Resource):
         excursion, error, status = update_excursion(excursion_id, data)
         if error:
             return error, status
-        return {"message": "Экскурсия обновлена", "excursion": excursion.to_dict()}, status
+        return {"message": "Экскурсия обновлена", "excursion": serialize_excursion(excursion)}, status
 
     @admin_required
     def get(self, excursion_id):
-        excursion = get_excursion(excursion_id)
+        excursion = get_excursion(excursion_id, profile="admin_full")
         if not excursion:
             return {"message": "Экскурсия не найдена"}, HTTPStatus.NOT_FOUND
-        return {"excursion": excursion.to_dict(include_related=True)}, HTTPStatus.OK
+        return {"excursion": serialize_excursion(excursion, include_related=True)}, HTTPStatus.OK
 
     @admin_required
+    @admin_ns.doc(description="Удаление экскурсии. При активных бронях — 202 и задание отмены (job_id)")
     def delete(self, excursion_id):
         admin = get_user_by_email(get_jwt_identity())
-        response = delete_excursion(excursion_id, admin, return_csv=True)
-
-        if isinstance(response, Response):
-            return response
-
-        result, status = response
-        return result, status
+        return _with_job_status_url(*delete_excursion(excursion_id, admin))
 
 
 @admin_ns.route('/excursions/<int:excursion_id>/sessions')
@@ -304,7 +336,7 @@ class AdminExcursionSessionsResource(Resource):
     @admin_required
     def get(self, excursion_id):
         sessions = get_sessions_for_excursion(excursion_id)
-        return [s.to_dict() for s in sessions], HTTPStatus.OK
+        return serialize_sessions(sessions), HTTPStatus.OK
 
     @admin_required
     @admin_ns.expect(session_model, validate=True)
@@ -316,6 +348,17 @@ class AdminExcursionSessionsResource(Resource):
         return session.to_dict(), status
 
 
+@admin_ns.route('/excursions/<int:excursion_id>/sessions/bulk')
+class AdminExcursionSessionsBulkResource(Resource):
+    @admin_required
+    @admin_ns.expect(session_bulk_model, validate=True)
+    @admin_ns.doc(description="Массовое создание сеансов списком или по правилу повторения одной транзакцией")
+    def post(self, excursion_id):
+        if not get_excursion(excursion_id):
+            return {"message": "Экскурсия не найдена"}, HTTPStatus.NOT_FOUND
+        return bulk_create_excursion_sessions(excursion_id, request.get_json())
+
+
 @admin_ns.route('/excursions/<int:excursion_id>/sessions/<int:session_id>')
 class AdminExcursionSessionResource(Resource):
     @admin_required
@@ -328,13 +371,9 @@ class AdminExcursionSessionResource(Resource):
         return session.to_dict(), status
 
     @admin_required
+    @admin_ns.doc(description="Удаление сессии. При активных бронях — 202 и задание отмены (job_id)")
     def delete(self, excursion_id, session_id):
-        response = delete_excursion_session(excursion_id, session_id, notify_resident=True)
-        if isinstance(response, Response):
-            return response
-
-        result, status = response
-        return result, status
+        return _with_job_status_url(*delete_excursion_session(excursion_id, session_id, notify_resident=True))
 
     @admin_required
     def get(self, excursion_id, session_id):
@@ -388,11 +427,68 @@ class AdminExcursionPhotoResource(Resource):
 @admin_ns.route('/reservations')
 class AdminReservationsResource(Resource):
     @admin_required
+    @admin_ns.doc(
+        description="Список броней с фильтрами; с limit или cursor — постранично",
+        params={
+            'status': 'active или cancelled',
+            'paid': 'true или false',
+            'session_id': 'ID сеанса',
+            'excursion_id': 'ID экскурсии',
+            'start_date': 'Начало периода по дате брони (ISO 8601)',
+            'end_date': 'Конец периода по дате брони (ISO 8601, включительно)',
+            'sort': 'Сортировка: booked_at, session_start, participants_count, с «-» — по убыванию '
+                    '(по умолчанию -booked_at)',
+            'limit': 'Размер страницы (включает постраничную выдачу, максимум 100)',
+            'cursor': 'Курсор следующей страницы из поля next_cursor предыдущего ответа'
+        }
+    )
     def get(self):
-        reservations_data = get_all_reservations()
+        args = request.args
+        try:
+            if args.get('limit') or args.get('cursor'):
+                reservations, next_cursor, total, estimated = list_reservations_page(
+                    args, args.get('sort'), parse_limit(args.get('limit')), args.get('cursor')
+                )
+                return {
+                    "reservations": [r.to_dict() for r in reservations],
+                    "next_cursor": next_cursor,
+                    "total": total,
+                    "total_is_estimate": estimated
+                }, HTTPStatus.OK
+            reservations_data = get_all_reservations(args, args.get('sort'))
+        except ValueError as e:
+            return {"message": str(e)}, HTTPStatus.BAD_REQUEST
         return {'reservations': reservations_data}, 200
 
 
+@admin_ns.route('/exports/<string:kind>')
+class AdminExportResource(Resource):
+    @admin_required
+    @admin_ns.doc(
+        description="Потоковая выгрузка: reservations, participants или payments",
+        params={
+            'format': 'csv (по умолчанию), xlsx или ndjson',
+            'start_date': 'Начало периода (ISO 8601): дата брони, сеанса или платежа',
+            'end_date': 'Конец периода (ISO 8601, включительно)',
+            'excursion_id': 'Только одна экскурсия',
+            'status': 'Брони: active, cancelled, paid, unpaid; участники: paid, unpaid; платежи: статус платежа'
+        }
+    )
+    def get(self, kind):
+        if kind not in EXPORTS:
+            return {"message": "Неизвестный вид выгрузки"}, HTTPStatus.NOT_FOUND
+        export_format = request.args.get('format') or 'csv'
+        if export_format not in EXPORT_FORMATS:
+            return {"message": "format должен быть csv, xlsx или ndjson"}, HTTPStatus.BAD_REQUEST
+        try:
+            filters = parse_export_filters(kind, request.args)
+        except ValueError as e:
+            return {"message": str(e)}, HTTPStatus.BAD_REQUEST
+        headers, keys, rows = export_rows(kind, filters)
+        return export_response(export_format, headers, rows, f"{kind}_{datetime.now():%Y%m%d_%H%M}", keys=keys,
+                               sheet_title=export_sheet_title(kind))
+
+
 @admin_ns.route('/reservations/<int:reservation_id>')
 class AdminReservationDetailResource(Resource):
     @admin_required
@@ -407,3 +503,43 @@ class AdminReservationDetailResource(Resource):
     def delete(self, reservation_id):
         success, message, status_code = delete_reservation_with_refund(reservation_id)
         return {"message": message}, status_code
+
+
+@admin_ns.route('/cancellation-jobs/<int:job_id>')
+class AdminCancellationJob(Resource):
+    @admin_required
+    @admin_ns.doc(description="Ход задания отмены: прогресс и результат возврата и уведомления по каждой брони")
+    def get(self, job_id):
+        job = get_cancellation_job(job_id)
+        if not job:
+            return {"message": "Задание не найдено"}, HTTPStatus.NOT_FOUND
+        return job.to_dict(), HTTPStatus.OK
+
+
+@admin_ns.route('/scheduler/jobs')
+class AdminSchedulerJobs(Resource):
+    @admin_required
+    @admin_ns.doc(description="Периодические задачи: последний запуск, длительность, последний успех и ошибка")
+    def get(self):
+        return get_scheduler_status(), HTTPStatus.OK
+
+
+@admin_ns.route('/analytics/daily')
+class AdminDailyAnalytics(Resource):
+    @admin_required
+    @admin_ns.doc(
+        description="Брони, отмены, оплаты и возвраты по дням из предрасчитанных сводок",
+        params={
+            'start_date': 'Первый день (ISO 8601)',
+            'end_date': 'Последний день (ISO 8601, включительно)',
+            'bucket': 'Группировка: day (по умолчанию), week или month',
+            'excursion_id': 'Только одна экскурсия'
+        }
+    )
+    def get(self):
+        try:
+            start, end, bucket = parse_analytics_params(request.args)
+        except ValueError as e:
+            return {"message": str(e)}, HTTPStatus.BAD_REQUEST
+        return get_daily_booking_stats(start, end, bucket,
+                                       excursion_id=request.args.get('excursion_id', type=int)), HTTPStatus.OK
@@ -1,7 +1,6 @@
 import os
 import sys
 
-from apscheduler.schedulers.background import BackgroundScheduler
 from flask import send_from_directory, render_template
 
 from backend.core import create_app, db
@@ -9,8 +8,14 @@ from backend.core.config import Config
 from backend.core.models.auth_models import Role
 from backend.core.models.excursion_models import Category, AgeCategory, FormatType
 from backend.core.scripts.clear_unpaid import cleanup_unpaid_reservations
+from backend.core.scripts.create_session_from_recurring import create_sessions_from_recurring
 from backend.core.scripts.create_superuser import create_superuser
 from backend.core.scripts.ensure_data import ensure_data_exists
+from backend.core.services.excursion_services.booking_rollup_service import backfill_booking_rollups
+from backend.core.services.excursion_services.excursion_search import ensure_title_search_index
+from backend.core.services.excursion_services.seat_service import reconcile_seat_counters
+from backend.core.services.excursion_services.excursion_summary_service import rebuild_excursion_summaries
+from backend.core.services.scheduler_service import start_scheduler
 
 
 def seed_reference_data():
@@ -41,21 +46,9 @@ def register_static_routes(app):
         return render_template('login.html', title="Вход в систему")
 
 
-def run_cleanup(app):
-    with app.app_context():
-        cleanup_unpaid_reservations()
-
-
 def main():
     app = create_app()
 
-    scheduler = BackgroundScheduler()
-    scheduler.add_job(func=lambda: run_cleanup(app), trigger="interval", minutes=5, )
-    scheduler.start()
-
-    import atexit
-    atexit.register(lambda: scheduler.shutdown())
-
     if len(sys.argv) > 1:
         cmd = sys.argv[1]
 
@@ -75,8 +68,40 @@ def main():
                 cleanup_unpaid_reservations()
             sys.exit(0)
 
+        elif cmd == "create_sessions_from_recurring":
+            days = int(sys.argv[2]) if len(sys.argv) > 2 else None
+            with app.app_context():
+                create_sessions_from_recurring(days=days)
+            sys.exit(0)
+
+        elif cmd == "reconcile_seats":
+            with app.app_context():
+                count = reconcile_seat_counters(allow_decrease=True)
+            print(f"Счётчики мест исправлены для {count} сеансов.")
+            sys.exit(0)
+
+        elif cmd == "rebuild_excursion_summaries":
+            with app.app_context():
+                count = rebuild_excursion_summaries()
+            print(f"Сводки пересчитаны для {count} экскурсий.")
+            sys.exit(0)
+
+        elif cmd == "backfill_booking_rollups":
+            with app.app_context():
+                count = backfill_booking_rollups()
+            print(f"Дневные сводки пересчитаны для {count} сеансов.")
+            sys.exit(0)
+
+        elif cmd == "ensure_search_index":
+            with app.app_context():
+                ensure_title_search_index()
+            print("Индекс поиска по названию создан.")
+            sys.exit(0)
+
     register_static_routes(app)
 
+    # только для сервера: разовая команда выше не должна становиться лидером и запускать фоновые задачи
+    start_scheduler(app)
     app.run(debug=True, use_reloader=True)
 
 
@@ -20,6 +20,9 @@ def create_app(testing=False):
     migrate.init_app(app, db)
 
     register_apps(app)
+    # шаблоны писем компилируются при старте, а не при первой отправке
+    from .services.email_templates import load_email_templates
+    load_email_templates()
     if testing:
         app.config["TESTING"] = True
         app.config["JWT_SECRET_KEY"] = "test-secret"
@@ -49,3 +49,77 @@ class Config:
     Configuration.secret_key = os.environ.get("YOOKASSA_SECRET_KEY")
 
     PRODUCTION = str_to_bool(os.getenv("PRODUCTION", "False"))
+
+    # Время жизни (в секундах) кэша справочников и диапазонов фильтров каталога
+    REFERENCE_CACHE_TTL = int(os.getenv("REFERENCE_CACHE_TTL", "300"))
+    EXCURSION_STATS_CACHE_TTL = int(os.getenv("EXCURSION_STATS_CACHE_TTL", "60"))
+    # Не чаще чем раз в столько секунд справочники перечитываются из-за неизвестного названия
+    REFERENCE_MISS_RELOAD_SECONDS = int(os.getenv("REFERENCE_MISS_RELOAD_SECONDS", "10"))
+
+    # Общий кэш ответов публичных эндпоинтов: memory | filesystem | redis | none
+    RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory")
+    RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "300"))
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "512"))
+    RESPONSE_CACHE_DIR = os.getenv("RESPONSE_CACHE_DIR", os.path.join(PROJECT_ROOT, "instance", "response_cache"))
+    RESPONSE_CACHE_REDIS_URL = os.getenv("RESPONSE_CACHE_REDIS_URL", "redis://localhost:6379/0")
+
+    # Сколько минут неоплаченная бронь удерживает места на сеансе
+    SEAT_HOLD_MINUTES = int(os.getenv("SEAT_HOLD_MINUTES", "15"))
+
+    # Очередь создания платежей YooKassa: параллельность диспетчера, попытки и аренда задания (в секундах)
+    PAYMENT_OUTBOX_POLL_SECONDS = int(os.getenv("PAYMENT_OUTBOX_POLL_SECONDS", "2"))
+    PAYMENT_OUTBOX_CONCURRENCY = int(os.getenv("PAYMENT_OUTBOX_CONCURRENCY", "4"))
+    PAYMENT_OUTBOX_MAX_ATTEMPTS = int(os.getenv("PAYMENT_OUTBOX_MAX_ATTEMPTS", "5"))
+    PAYMENT_OUTBOX_LEASE_SECONDS = int(os.getenv("PAYMENT_OUTBOX_LEASE_SECONDS", "60"))
+    # Через сколько секунд клиенту повторить запрос статуса оплаты, пока ссылка готовится (Retry-After)
+    PAYMENT_STATUS_RETRY_AFTER = int(os.getenv("PAYMENT_STATUS_RETRY_AFTER", "1"))
+
+    # Входящие события YooKassa: в режиме очереди обработчик только сохраняет событие и сразу отвечает 200,
+    # а применяет их фоновая задача пачками
+    WEBHOOK_QUEUE_MODE = str_to_bool(os.getenv("WEBHOOK_QUEUE_MODE", "False"))
+    WEBHOOK_POLL_SECONDS = int(os.getenv("WEBHOOK_POLL_SECONDS", "2"))
+    WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "100"))
+    WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "5"))
+
+    # Очередь писем: число потоков-отправителей (у каждого своё SMTP-соединение), размер пачки и повторы
+    EMAIL_POLL_SECONDS = int(os.getenv("EMAIL_POLL_SECONDS", "5"))
+    EMAIL_WORKERS = int(os.getenv("EMAIL_WORKERS", "2"))
+    EMAIL_BATCH_SIZE = int(os.getenv("EMAIL_BATCH_SIZE", "50"))
+    EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "6"))
+    EMAIL_LEASE_SECONDS = int(os.getenv("EMAIL_LEASE_SECONDS", "300"))
+
+    # Фоновые задания отмены при удалении сеансов и экскурсий
+    CANCELLATION_JOB_POLL_SECONDS = int(os.getenv("CANCELLATION_JOB_POLL_SECONDS", "5"))
+    CANCELLATION_JOB_LEASE_SECONDS = int(os.getenv("CANCELLATION_JOB_LEASE_SECONDS", "300"))
+
+    # Возвраты YooKassa: параллельность отправки, повторы с backoff, аренда отправки
+    # и через сколько перепроверять возврат, который YooKassa вернула в статусе pending (в секундах)
+    REFUND_POLL_SECONDS = int(os.getenv("REFUND_POLL_SECONDS", "30"))
+    REFUND_CONCURRENCY = int(os.getenv("REFUND_CONCURRENCY", "8"))
+    REFUND_MAX_ATTEMPTS = int(os.getenv("REFUND_MAX_ATTEMPTS", "6"))
+    REFUND_LEASE_SECONDS = int(os.getenv("REFUND_LEASE_SECONDS", "60"))
+    REFUND_RECHECK_SECONDS = int(os.getenv("REFUND_RECHECK_SECONDS", "300"))
+
+    # Очистка просроченных удержаний: сколько броней отменять за одну транзакцию
+    CLEANUP_BATCH_SIZE = int(os.getenv("CLEANUP_BATCH_SIZE", "500"))
+
+    # Фоновый планировщик: задачи выполняет один процесс-лидер среди всех воркеров и узлов.
+    # Лидер продлевает аренду каждые SCHEDULER_HEARTBEAT_SECONDS; если он упал,
+    # другой процесс перехватит лидерство через SCHEDULER_LEASE_SECONDS
+    SCHEDULER_ENABLED = str_to_bool(os.getenv("SCHEDULER_ENABLED", "True"))
+    SCHEDULER_HEARTBEAT_SECONDS = int(os.getenv("SCHEDULER_HEARTBEAT_SECONDS", "10"))
+    SCHEDULER_LEASE_SECONDS = int(os.getenv("SCHEDULER_LEASE_SECONDS", "30"))
+
+    # На сколько дней вперёд создавать сеансы по еженедельным расписаниям
+    RECURRING_SESSIONS_DAYS = int(os.getenv("RECURRING_SESSIONS_DAYS", "28"))
+
+    # Сколько сеансов можно создать одним запросом массового создания
+    BULK_SESSIONS_MAX = int(os.getenv("BULK_SESSIONS_MAX", "1000"))
+
+    # Дневные сводки бронирований: как часто пересчитывать изменённые сеансы и на сколько секунд
+    # перечитывать изменения до прошлой отметки (транзакции, зафиксированные позже своего updated_at)
+    BOOKING_ROLLUP_POLL_SECONDS = int(os.getenv("BOOKING_ROLLUP_POLL_SECONDS", "300"))
+    BOOKING_ROLLUP_OVERLAP_SECONDS = int(os.getenv("BOOKING_ROLLUP_OVERLAP_SECONDS", "120"))
+
+    # Списки в админке: до скольких строк (по оценке планировщика PostgreSQL) общее число считается точно
+    ADMIN_EXACT_COUNT_LIMIT = int(os.getenv("ADMIN_EXACT_COUNT_LIMIT", "10000"))
@@ -1,5 +1,14 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 
+
+def include_object(object, name, type_, reflected, compare_to):
+    # FTS5-таблица поиска по названию и её служебные таблицы создаются вручную,
+    # autogenerate не должен предлагать их удалить
+    if type_ == "table" and reflected and compare_to is None and name.startswith("excursions_fts"):
+        return False
+    return True
+
+
 db = SQLAlchemy()
-migrate = Migrate()
+migrate = Migrate(include_object=include_object)
@@ -36,6 +36,11 @@ class User(db.Model):
             lazy=True
     )
 
+    # список пользователей в админке: фильтр по роли с сортировкой и поиском по email
+    __table_args__ = (
+        db.Index('ix_users_role_email', 'role_id', 'email'),
+    )
+
     def __repr__(self):
         return f"<User {self.email}>"
 
@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from sqlalchemy import func
+from sqlalchemy import func, event, DDL
 
 from backend.core import db
 
@@ -97,39 +97,62 @@ class Excursion(db.Model):
 
     photos = db.relationship("ExcursionPhoto", back_populates="excursion", cascade="all, delete-orphan", lazy=True)
     sessions = db.relationship("ExcursionSession", back_populates="excursion", cascade="all, delete-orphan", lazy=True)
-    tags = db.relationship("Tag", secondary=excursion_tags, back_populates="excursions", lazy='subquery')
+    schedules = db.relationship("RecurringSchedule", back_populates="excursion", cascade="all, delete-orphan",
+                                lazy=True)
+    tags = db.relationship("Tag", secondary=excursion_tags, back_populates="excursions", lazy=True)
 
     creator = db.relationship("User", backref="excursions_created", foreign_keys=[created_by])
 
+    __table_args__ = (
+        db.Index(
+            'ix_excursions_title_trgm', 'title',
+            postgresql_using='gin',
+            postgresql_ops={'title': 'gin_trgm_ops'}
+        ).ddl_if(dialect='postgresql'),
+        # дневные сводки хранят id удалённых экскурсий, поэтому SQLite не должен выдавать их повторно
+        {'sqlite_autoincrement': True},
+    )
+
     def __str__(self):
         return f"Excursion(id={self.excursion_id}, title={self.title})"
 
-    def to_dict(self, include_related=False):
-        data = {
-            'excursion_id': self.excursion_id,
-            'title': self.title,
-            'description': self.description,
-            'duration': self.duration,
-            'category': self.category.to_dict() if self.category else None,
-            'format_type': self.format_type.to_dict() if self.format_type else None,
-            'age_category': self.age_category.to_dict() if self.age_category else None,
-            'created_by': self.creator.email if self.creator else None,
-            'is_active': self.is_active,
-            'place': self.place,
-            'conducted_by': self.conducted_by,
-            'working_hours': self.working_hours,
-            'contact_email': self.contact_email,
-            'iframe_url': self.iframe_url,
-            'telegram': self.telegram,
-            'vk': self.vk,
-            "distance_to_center": self.distance_to_center,
-            "time_to_nearest_stop": self.time_to_nearest_stop,
-            'photos': [photo.to_dict() for photo in self.photos],
-            'sessions': [
-                session.to_dict()
+    SERIALIZED_FIELDS = (
+        'excursion_id', 'title', 'description', 'duration', 'category', 'format_type', 'age_category',
+        'created_by', 'is_active', 'place', 'conducted_by', 'working_hours', 'contact_email', 'iframe_url',
+        'telegram', 'vk', 'distance_to_center', 'time_to_nearest_stop', 'photos', 'sessions', 'tags'
+    )
+
+    def to_dict(self, include_related=False, booked_counts=None, fields=None):
+        serializers = {
+            'excursion_id': lambda: self.excursion_id,
+            'title': lambda: self.title,
+            'description': lambda: self.description,
+            'duration': lambda: self.duration,
+            'category': lambda: self.category.to_dict() if self.category else None,
+            'format_type': lambda: self.format_type.to_dict() if self.format_type else None,
+            'age_category': lambda: self.age_category.to_dict() if self.age_category else None,
+            'created_by': lambda: self.creator.email if self.creator else None,
+            'is_active': lambda: self.is_active,
+            'place': lambda: self.place,
+            'conducted_by': lambda: self.conducted_by,
+            'working_hours': lambda: self.working_hours,
+            'contact_email': lambda: self.contact_email,
+            'iframe_url': lambda: self.iframe_url,
+            'telegram': lambda: self.telegram,
+            'vk': lambda: self.vk,
+            'distance_to_center': lambda: self.distance_to_center,
+            'time_to_nearest_stop': lambda: self.time_to_nearest_stop,
+            'photos': lambda: [photo.to_dict() for photo in self.photos],
+            'sessions': lambda: [
+                session.to_dict(booked_counts=booked_counts)
                 for session in sorted(self.sessions, key=lambda s: s.start_datetime)
             ],
-            'tags': [tag.to_dict() for tag in self.tags]
+            'tags': lambda: [tag.to_dict() for tag in self.tags]
+        }
+        data = {
+            name: serialize()
+            for name, serialize in serializers.items()
+            if fields is None or name in fields or name == 'excursion_id'
         }
         if include_related:
             data['reservations'] = [
@@ -141,6 +164,37 @@ class Excursion(db.Model):
         return data
 
 
+# Поиск по названию: на PostgreSQL — GIN-индекс pg_trgm (ILIKE),
+# на SQLite — FTS5-таблица с trigram-токенизатором, синхронизируемая триггерами
+EXCURSION_TITLE_FTS_TABLE = 'excursions_fts'
+
+EXCURSION_TITLE_SEARCH_DDL = {
+    'postgresql': [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX IF NOT EXISTS ix_excursions_title_trgm ON excursions USING gin (title gin_trgm_ops)",
+    ],
+    'sqlite': [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS excursions_fts USING fts5("
+        "title, content='excursions', content_rowid='excursion_id', tokenize='trigram')",
+        "CREATE TRIGGER IF NOT EXISTS excursions_fts_ai AFTER INSERT ON excursions BEGIN "
+        "INSERT INTO excursions_fts(rowid, title) VALUES (new.excursion_id, new.title); END",
+        "CREATE TRIGGER IF NOT EXISTS excursions_fts_ad AFTER DELETE ON excursions BEGIN "
+        "INSERT INTO excursions_fts(excursions_fts, rowid, title) VALUES ('delete', old.excursion_id, old.title); END",
+        "CREATE TRIGGER IF NOT EXISTS excursions_fts_au AFTER UPDATE OF title ON excursions BEGIN "
+        "INSERT INTO excursions_fts(excursions_fts, rowid, title) VALUES ('delete', old.excursion_id, old.title); "
+        "INSERT INTO excursions_fts(rowid, title) VALUES (new.excursion_id, new.title); END",
+        "INSERT INTO excursions_fts(excursions_fts) VALUES ('rebuild')",
+    ],
+}
+
+event.listen(
+    db.metadata, 'before_create',
+    DDL(EXCURSION_TITLE_SEARCH_DDL['postgresql'][0]).execute_if(dialect='postgresql')
+)
+for _statement in EXCURSION_TITLE_SEARCH_DDL['sqlite']:
+    event.listen(Excursion.__table__, 'after_create', DDL(_statement).execute_if(dialect='sqlite'))
+
+
 class ExcursionPhoto(db.Model):
     __tablename__ = 'excursion_photos'
 
@@ -176,8 +230,15 @@ class ExcursionSession(db.Model):
     start_datetime = db.Column(db.DateTime, nullable=False, default=datetime.now)
     max_participants = db.Column(db.Integer, nullable=False)
     cost = db.Column(db.Numeric(10, 2), nullable=False, default=0.00)
+    # места под активными (не отменёнными) бронями, включая ожидающие оплаты;
+    # меняется только атомарными UPDATE из seat_service
+    seats_reserved = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # расписание, по которому сеанс создан генератором; None — сеанс добавлен вручную
+    schedule_id = db.Column(db.Integer, db.ForeignKey('recurring_schedules.schedule_id', ondelete='SET NULL'),
+                            nullable=True)
 
     excursion = db.relationship("Excursion", back_populates="sessions")
+    schedule = db.relationship("RecurringSchedule")
     reservations = db.relationship(
         "Reservation",
         back_populates="session",
@@ -190,6 +251,19 @@ class ExcursionSession(db.Model):
         "confirm_deleted_rows": False
     }
 
+    __table_args__ = (
+        db.Index('ix_excursion_sessions_excursion_start', 'excursion_id', 'start_datetime'),
+        # генератор вставляет сеансы с ON CONFLICT DO NOTHING по этому индексу, поэтому параллельные
+        # запуски не создают дублей; вручную добавленные сеансы ограничение не затрагивает
+        db.Index(
+            'uq_excursion_sessions_generated', 'excursion_id', 'start_datetime', unique=True,
+            postgresql_where=db.text('schedule_id IS NOT NULL'),
+            sqlite_where=db.text('schedule_id IS NOT NULL')
+        ),
+        # дневные сводки и возвраты хранят id удалённых сеансов: как и у экскурсий, SQLite не выдаёт их повторно
+        {'sqlite_autoincrement': True},
+    )
+
     def __str__(self):
         return f"ExcursionSession(id={self.session_id}, excursion_id={self.excursion_id}, " \
                f"start_datetime={self.start_datetime}, max_participants={self.max_participants}, " \
@@ -203,8 +277,11 @@ class ExcursionSession(db.Model):
             is_cancelled=False
         ).scalar()
 
-    def to_dict(self):
-        booked = self.booked_count()
+    def to_dict(self, booked_counts=None):
+        if booked_counts is None:
+            booked = self.booked_count()
+        else:
+            booked = booked_counts.get(self.session_id, 0)
         return {
             'session_id': self.session_id,
             'start_datetime': self.start_datetime.isoformat(),
@@ -215,6 +292,47 @@ class ExcursionSession(db.Model):
         }
 
 
+class RecurringSchedule(db.Model):
+    """Еженедельное расписание экскурсии, по которому генератор создаёт сеансы на несколько недель вперёд."""
+    __tablename__ = 'recurring_schedules'
+
+    schedule_id = db.Column(db.Integer, primary_key=True)
+    excursion_id = db.Column(db.Integer, db.ForeignKey('excursions.excursion_id', ondelete='CASCADE'),
+                             nullable=False, index=True)
+    # 0 = воскресенье, ..., 6 = суббота
+    weekday = db.Column(db.Integer, nullable=False)
+    start_time = db.Column(db.Time, nullable=False)
+    max_participants = db.Column(db.Integer, nullable=False)
+    cost = db.Column(db.Numeric(10, 2), nullable=False, default=0.00)
+    # сколько сеансов создать всего, 0 — без ограничения; count_of_repeats — сколько уже создано
+    repeats = db.Column(db.Integer, nullable=False, default=0)
+    count_of_repeats = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+    excursion = db.relationship("Excursion", back_populates="schedules")
+
+    def __str__(self):
+        return (f"RecurringSchedule(id={self.schedule_id}, excursion_id={self.excursion_id}, "
+                f"weekday={self.weekday}, start_time={self.start_time})")
+
+    def to_dict(self):
+        return {
+            'schedule_id': self.schedule_id,
+            'excursion_id': self.excursion_id,
+            'weekday': self.weekday,
+            'start_time': self.start_time.strftime('%H:%M'),
+            'max_participants': self.max_participants,
+            'cost': str(self.cost),
+            'repeats': self.repeats,
+            'count_of_repeats': self.count_of_repeats,
+        }
+
+
+# условие действующего удержания мест; запросы используют тот же текст, чтобы планировщик
+# (особенно в SQLite) мог применить частичные индексы ниже
+PENDING_HOLD_CONDITION = 'NOT is_paid AND NOT is_cancelled'
+
+
 class Reservation(db.Model):
     __tablename__ = 'reservations'
 
@@ -230,10 +348,40 @@ class Reservation(db.Model):
     participants_count = db.Column(db.Integer, nullable=False, default=1)
     is_cancelled = db.Column(db.Boolean, default=False)
     is_paid = db.Column(db.Boolean, default=False)
+    # неоплаченная бронь удерживает места до этого момента, после оплаты — None
+    hold_expires_at = db.Column(db.DateTime, nullable=True)
+    # по updated_at фоновая задача находит изменённые брони для дневных сводок (booking_rollup_service)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now,
+                           server_default=db.func.current_timestamp(), index=True)
 
     session = db.relationship("ExcursionSession", back_populates="reservations")
     user = db.relationship("User", back_populates="reservations")
     payment = db.relationship("Payment", back_populates="reservation", uselist=False)
+    payment_job = db.relationship("PaymentOutbox", back_populates="reservation", uselist=False,
+                                  cascade="all, delete-orphan")
+
+    # частичные индексы содержат только действующие удержания мест, поэтому остаются маленькими
+    __table_args__ = (
+        db.Index(
+            'ix_reservations_pending_holds', 'hold_expires_at',
+            postgresql_where=db.text(PENDING_HOLD_CONDITION),
+            sqlite_where=db.text(PENDING_HOLD_CONDITION)
+        ),
+        db.Index(
+            'ix_reservations_session_pending_holds', 'session_id', 'hold_expires_at',
+            postgresql_where=db.text(PENDING_HOLD_CONDITION),
+            sqlite_where=db.text(PENDING_HOLD_CONDITION)
+        ),
+        # брони без hold_expires_at очистка находит по booked_at
+        db.Index(
+            'ix_reservations_pending_booked_at', 'booked_at',
+            postgresql_where=db.text(PENDING_HOLD_CONDITION),
+            sqlite_where=db.text(PENDING_HOLD_CONDITION)
+        ),
+        # постраничные списки броней в админке: сортировка по дате и фильтр по сеансу
+        db.Index('ix_reservations_booked_at_id', 'booked_at', 'reservation_id'),
+        db.Index('ix_reservations_session_booked_at', 'session_id', 'booked_at'),
+    )
 
     def __str__(self):
         return (f"Reservation(id={self.reservation_id}, session_id={self.session_id}, "
@@ -319,18 +467,99 @@ class Payment(db.Model):
     status = db.Column(db.String(50), nullable=False, default='pending')
     method = db.Column(db.String(50), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.now)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now,
+                           server_default=db.func.current_timestamp(), index=True)
 
     reservation = db.relationship("Reservation", back_populates="payment", uselist=False)
     session = db.relationship("ExcursionSession", back_populates="payments")
 
 
+class PaymentOutbox(db.Model):
+    """
+    Задание на создание платежа YooKassa. Пишется в одной транзакции с бронью,
+    а платёж создаёт фоновый диспетчер (payment_outbox_service), не веб-воркер.
+    """
+    __tablename__ = 'payment_outbox'
+
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    outbox_id = db.Column(db.Integer, primary_key=True)
+    reservation_id = db.Column(db.Integer, db.ForeignKey('reservations.reservation_id', ondelete='CASCADE'),
+                               nullable=False, unique=True)
+    status = db.Column(db.String(20), nullable=False, default=PENDING)
+    # ключ идемпотентности YooKassa: повтор после сбоя не создаст второй платёж
+    idempotence_key = db.Column(db.String(36), nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    locked_until = db.Column(db.DateTime, nullable=True)
+    payment_id = db.Column(db.String(100), nullable=True)
+    confirmation_url = db.Column(db.String(1024), nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now)
+
+    reservation = db.relationship("Reservation", back_populates="payment_job")
+
+    __table_args__ = (
+        db.Index('ix_payment_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+
+    def __str__(self):
+        return (f"PaymentOutbox(id={self.outbox_id}, reservation_id={self.reservation_id}, "
+                f"status={self.status}, attempts={self.attempts})")
+
+
+class RefundRequest(db.Model):
+    """
+    Возврат YooKassa с сохраняемым состоянием: requested -> submitted -> succeeded | failed.
+    Возвраты отправляет refund_service; повтор с тем же ключом идемпотентности не создаст второй возврат.
+    """
+    __tablename__ = 'refund_requests'
+
+    REQUESTED = 'requested'
+    SUBMITTED = 'submitted'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+
+    refund_request_id = db.Column(db.Integer, primary_key=True)
+    # ссылки без внешних ключей: бронь и платёж к моменту возврата могут быть уже удалены
+    payment_id = db.Column(db.String(100), nullable=False, index=True)
+    reservation_id = db.Column(db.Integer, nullable=True)
+    # сеанс возвращаемой брони: по нему возврат попадает в дневную сводку и после удаления сеанса
+    session_id = db.Column(db.Integer, nullable=True, index=True)
+    amount = db.Column(db.Numeric(10, 2), nullable=False)
+    currency = db.Column(db.String(10), nullable=False, default='RUB')
+    idempotence_key = db.Column(db.String(36), nullable=False, unique=True)
+    status = db.Column(db.String(20), nullable=False, default=REQUESTED)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    # для submitted — до какого момента отправка принадлежит воркеру (или когда перепроверить pending-возврат)
+    locked_until = db.Column(db.DateTime, nullable=True)
+    provider_refund_id = db.Column(db.String(100), nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now,
+                           index=True)
+
+    __table_args__ = (
+        db.Index('ix_refund_requests_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+
+    def __str__(self):
+        return (f"RefundRequest(id={self.refund_request_id}, payment_id={self.payment_id}, "
+                f"status={self.status}, attempts={self.attempts})")
+
+
 class Tag(db.Model):
     __tablename__ = 'tags'
 
     tag_id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), nullable=False, unique=True)
 
-    excursions = db.relationship("Excursion", secondary=excursion_tags, back_populates="tags", lazy='subquery')
+    excursions = db.relationship("Excursion", secondary=excursion_tags, back_populates="tags", lazy=True)
 
     def __str__(self):
         return f"Tag(id={self.tag_id}, name={self.name})"
@@ -340,3 +569,84 @@ class Tag(db.Model):
             'tag_id': self.tag_id,
             'name': self.name,
         }
+
+
+class ExcursionSummary(db.Model):
+    """Денормализованная сводка по экскурсии для фильтрации и сортировки каталога."""
+    __tablename__ = 'excursion_summaries'
+
+    excursion_id = db.Column(
+        db.Integer, db.ForeignKey('excursions.excursion_id', ondelete='CASCADE'), primary_key=True
+    )
+    is_active = db.Column(db.Boolean, nullable=False, default=True)
+    duration = db.Column(db.Integer, nullable=True)
+    distance_to_center = db.Column(db.Float, nullable=True)
+    time_to_nearest_stop = db.Column(db.Float, nullable=True)
+
+    # значения ниже считаются только по будущим сеансам на момент updated_at
+    next_session_at = db.Column(db.DateTime, nullable=True)
+    last_session_at = db.Column(db.DateTime, nullable=True)
+    min_cost = db.Column(db.Numeric(10, 2), nullable=True)
+    max_cost = db.Column(db.Numeric(10, 2), nullable=True)
+    total_capacity = db.Column(db.Integer, nullable=False, default=0)
+    booked_seats = db.Column(db.Integer, nullable=False, default=0)
+    # названия тегов в виде ",тег1,тег2," — точное совпадение ищется через LIKE '%,тег,%'
+    tag_names = db.Column(db.Text, nullable=False, default=',')
+
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+    __table_args__ = (
+        db.Index('ix_excursion_summaries_last_session_at', 'last_session_at'),
+        db.Index('ix_excursion_summaries_next_session_at', 'next_session_at'),
+        db.Index('ix_excursion_summaries_min_cost', 'min_cost'),
+        # max(updated_at) — версия каталога для ETag
+        db.Index('ix_excursion_summaries_updated_at', 'updated_at'),
+    )
+
+    def __str__(self):
+        return f"ExcursionSummary(excursion_id={self.excursion_id}, next_session_at={self.next_session_at})"
+
+
+class SessionDailyStats(db.Model):
+    """
+    Дневная сводка бронирований сеанса. Брони и отмены относятся ко дню бронирования, оплаты и возвраты —
+    ко дню создания платежа, а возвраты по RefundRequest — ко дню запроса возврата. Пересчитывается
+    booking_rollup_service по изменённым броням, платежам и возвратам; строки удалённого сеанса сохраняются.
+    """
+    __tablename__ = 'session_daily_stats'
+
+    session_id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    # без внешних ключей: строки удалённых сеансов остаются в истории
+    excursion_id = db.Column(db.Integer, nullable=False, index=True)
+    bookings = db.Column(db.Integer, nullable=False, default=0)
+    participants = db.Column(db.Integer, nullable=False, default=0)
+    cancellations = db.Column(db.Integer, nullable=False, default=0)
+    paid_amount = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    refunded_amount = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    # часть refunded_amount по статусу самих платежей: после удаления сеанса платежей уже нет,
+    # и к ней прибавляются только возвраты по RefundRequest
+    payment_refunded_amount = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+
+    def __str__(self):
+        return f"SessionDailyStats(session_id={self.session_id}, day={self.day})"
+
+
+class ExcursionDailyStats(db.Model):
+    """Дневная сводка бронирований экскурсии — сумма SessionDailyStats её сеансов."""
+    __tablename__ = 'excursion_daily_stats'
+
+    excursion_id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    bookings = db.Column(db.Integer, nullable=False, default=0)
+    participants = db.Column(db.Integer, nullable=False, default=0)
+    cancellations = db.Column(db.Integer, nullable=False, default=0)
+    paid_amount = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    refunded_amount = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_excursion_daily_stats_day', 'day'),
+    )
+
+    def __str__(self):
+        return f"ExcursionDailyStats(excursion_id={self.excursion_id}, day={self.day})"
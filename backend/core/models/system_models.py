@@ -0,0 +1,267 @@
+from datetime import datetime
+
+from backend.core import db
+
+
+class ResourceVersion(db.Model):
+    """Счётчик изменений публичного ресурса (новости) для ETag и условных GET-запросов."""
+    __tablename__ = 'resource_versions'
+
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+    def __str__(self):
+        return f"ResourceVersion(name={self.name}, version={self.version})"
+
+
+class WebhookEvent(db.Model):
+    """
+    Входящее уведомление платёжного провайдера. Уникальный dedup_key (событие + id объекта)
+    отсекает повторные доставки; в режиме очереди событие применяет фоновый обработчик.
+    """
+    __tablename__ = 'webhook_events'
+
+    RECEIVED = 'received'
+    PROCESSED = 'processed'
+    FAILED = 'failed'
+
+    webhook_event_id = db.Column(db.Integer, primary_key=True)
+    provider = db.Column(db.String(50), nullable=False)
+    dedup_key = db.Column(db.String(255), nullable=False, unique=True)
+    event_type = db.Column(db.String(100), nullable=False)
+    object_id = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.JSON, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default=RECEIVED)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    # после ошибки событие ждёт повтора с нарастающей паузой, а не берётся снова в том же проходе
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    last_error = db.Column(db.Text, nullable=True)
+    received_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    processed_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_webhook_events_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+
+    def __str__(self):
+        return f"WebhookEvent(id={self.webhook_event_id}, key={self.dedup_key}, status={self.status})"
+
+
+class EmailOutbox(db.Model):
+    """Письмо в очереди отправки. Отправляет фоновый обработчик (email_outbox_service) с повторами."""
+    __tablename__ = 'email_outbox'
+
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+
+    email_id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(255), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    body_html = db.Column(db.Text, nullable=True)
+    # [{"filename", "mimetype", "content" (base64)}]
+    attachments = db.Column(db.JSON, nullable=True)
+    status = db.Column(db.String(20), nullable=False, default=PENDING)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    locked_until = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_email_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+
+    def __str__(self):
+        return f"EmailOutbox(id={self.email_id}, recipient={self.recipient}, status={self.status})"
+
+
+class CancellationJob(db.Model):
+    """
+    Фоновая отмена броней удалённого сеанса или экскурсии: возвраты и письма участникам.
+    Сам сеанс удаляется сразу, а данные броней для возвратов и писем сохраняются в CancellationJobItem.
+    """
+    __tablename__ = 'cancellation_jobs'
+
+    SESSION = 'session'
+    EXCURSION = 'excursion'
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+
+    job_id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)
+    # ссылки без внешних ключей: сеанс и экскурсия к этому моменту уже удалены
+    excursion_id = db.Column(db.Integer, nullable=False)
+    session_id = db.Column(db.Integer, nullable=True)
+    excursion_title = db.Column(db.String(255), nullable=False)
+    requested_by = db.Column(db.Integer, db.ForeignKey('users.user_id', ondelete='SET NULL'), nullable=True)
+    # кому отправить CSV с отменёнными бронями, None — не отправлять
+    report_email = db.Column(db.String(255), nullable=True)
+    status = db.Column(db.String(20), nullable=False, default=PENDING)
+    locked_until = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    items = db.relationship("CancellationJobItem", back_populates="job", cascade="all, delete-orphan",
+                            order_by="CancellationJobItem.item_id")
+
+    __table_args__ = (
+        db.Index('ix_cancellation_jobs_status', 'status'),
+    )
+
+    def __str__(self):
+        return f"CancellationJob(id={self.job_id}, kind={self.kind}, status={self.status})"
+
+    def to_dict(self, include_items=True):
+        counts = {CancellationJobItem.PENDING: 0, CancellationJobItem.DONE: 0, CancellationJobItem.FAILED: 0}
+        for item in self.items:
+            counts[item.status] += 1
+        data = {
+            'job_id': self.job_id,
+            'kind': self.kind,
+            'excursion_id': self.excursion_id,
+            'session_id': self.session_id,
+            'excursion_title': self.excursion_title,
+            'status': self.status,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'progress': {
+                'total': len(self.items),
+                'done': counts[CancellationJobItem.DONE],
+                'failed': counts[CancellationJobItem.FAILED],
+                'pending': counts[CancellationJobItem.PENDING],
+            },
+        }
+        if include_items:
+            data['items'] = [item.to_dict() for item in self.items]
+        return data
+
+
+class CancellationJobItem(db.Model):
+    """Одна отменённая бронь внутри CancellationJob: снимок данных брони и результат возврата и уведомления."""
+    __tablename__ = 'cancellation_job_items'
+
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    item_id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('cancellation_jobs.job_id', ondelete='CASCADE'), nullable=False,
+                       index=True)
+    reservation_id = db.Column(db.Integer, nullable=False)
+    session_id = db.Column(db.Integer, nullable=False)
+    session_start = db.Column(db.DateTime, nullable=False)
+    email = db.Column(db.String(255), nullable=True)
+    full_name = db.Column(db.String(255), nullable=False)
+    # снимок Reservation.to_dict() для CSV-отчёта
+    snapshot = db.Column(db.JSON, nullable=False)
+    # None — бронь не была оплачена и возврат не нужен
+    refund_request_id = db.Column(db.Integer, db.ForeignKey('refund_requests.refund_request_id',
+                                                            ondelete='SET NULL'), nullable=True)
+    notified = db.Column(db.Boolean, nullable=False, default=False)
+    status = db.Column(db.String(20), nullable=False, default=PENDING)
+    error = db.Column(db.Text, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now)
+
+    job = db.relationship("CancellationJob", back_populates="items")
+    refund = db.relationship("RefundRequest")
+
+    @property
+    def refund_status(self):
+        return self.refund.status if self.refund else 'not_required'
+
+    def to_dict(self):
+        return {
+            'reservation_id': self.reservation_id,
+            'session_id': self.session_id,
+            'email': self.email,
+            'full_name': self.full_name,
+            'refund_status': self.refund_status,
+            'refund_error': self.refund.last_error if self.refund else None,
+            'notified': self.notified,
+            'status': self.status,
+            'error': self.error,
+        }
+
+
+class SchedulerLease(db.Model):
+    """
+    Аренда лидерства фонового планировщика: периодические задачи выполняет только процесс-держатель.
+    Используется на SQLite; на PostgreSQL лидерство держится advisory-блокировкой.
+    """
+    __tablename__ = 'scheduler_leases'
+
+    name = db.Column(db.String(50), primary_key=True)
+    holder = db.Column(db.String(255), nullable=False)
+    locked_until = db.Column(db.DateTime, nullable=False)
+    acquired_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+    def __str__(self):
+        return f"SchedulerLease(name={self.name}, holder={self.holder}, locked_until={self.locked_until})"
+
+
+class RollupWatermark(db.Model):
+    """Отметка, до которой изменения исходных таблиц уже учтены в сводке: следующий пересчёт читает только новее."""
+    __tablename__ = 'rollup_watermarks'
+
+    name = db.Column(db.String(50), primary_key=True)
+    processed_until = db.Column(db.DateTime, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now)
+
+    def __str__(self):
+        return f"RollupWatermark(name={self.name}, processed_until={self.processed_until})"
+
+
+class RollupChange(db.Model):
+    """
+    Сеанс, удалённый сам или чья бронь или платёж удалены: по updated_at удаление не найти, поэтому его записывает
+    unit of work, а задача пересчёта дневных сводок забирает и удаляет эти записи.
+    """
+    __tablename__ = 'rollup_changes'
+
+    change_id = db.Column(db.Integer, primary_key=True)
+    # без внешнего ключа: сеанс может быть удалён той же транзакцией
+    session_id = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+    def __str__(self):
+        return f"RollupChange(id={self.change_id}, session_id={self.session_id})"
+
+
+class ScheduledJobState(db.Model):
+    """Состояние периодической задачи: кто и когда запускал её последним, длительность и последний успех."""
+    __tablename__ = 'scheduled_job_states'
+
+    name = db.Column(db.String(100), primary_key=True)
+    last_holder = db.Column(db.String(255), nullable=True)
+    last_started_at = db.Column(db.DateTime, nullable=True)
+    last_finished_at = db.Column(db.DateTime, nullable=True)
+    last_success_at = db.Column(db.DateTime, nullable=True)
+    last_duration_ms = db.Column(db.Integer, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    run_count = db.Column(db.Integer, nullable=False, default=0)
+    failure_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __str__(self):
+        return f"ScheduledJobState(name={self.name}, last_success_at={self.last_success_at})"
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'last_holder': self.last_holder,
+            'last_started_at': self.last_started_at.isoformat() if self.last_started_at else None,
+            'last_finished_at': self.last_finished_at.isoformat() if self.last_finished_at else None,
+            'last_success_at': self.last_success_at.isoformat() if self.last_success_at else None,
+            'last_duration_ms': self.last_duration_ms,
+            'last_error': self.last_error,
+            'run_count': self.run_count,
+            'failure_count': self.failure_count,
+        }
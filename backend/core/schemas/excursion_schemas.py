@@ -82,6 +82,24 @@ session_patch_model = api.model('ExcursionSessionPatch', {
     'max_participants': fields.Integer(description='Максимальное количество участников', example=20),
     'cost': fields.Float(description='Стоимость участия в рублях', example=500)
 })
+session_bulk_model = api.model('ExcursionSessionsBulk', {
+    'sessions': fields.List(fields.Nested(api.model('SessionBulkItem', {
+        'start_datetime': fields.String(required=True, description='Дата и время начала в формате ISO 8601'),
+        'max_participants': fields.Integer(required=True, description='Максимальное количество участников'),
+        'cost': fields.Float(description='Стоимость участия в рублях'),
+    }))),
+    'recurrence': fields.Nested(api.model('SessionRecurrence', {
+        'weekdays': fields.List(fields.Integer, required=True, description='Дни недели, 0 — воскресенье'),
+        'start_time': fields.String(required=True, description='Время начала', example='11:00'),
+        'date_from': fields.String(required=True, description='Первый день', example='2025-06-01'),
+        'date_to': fields.String(required=True, description='Последний день', example='2025-08-31'),
+        'max_participants': fields.Integer(required=True, description='Максимальное количество участников'),
+        'cost': fields.Float(description='Стоимость участия в рублях'),
+    }), skip_none=True),
+    'on_conflict': fields.String(enum=['error', 'skip', 'update'], default='error',
+                                 description='Что делать с сеансами на уже занятое время'),
+})
+
 photo_model = api.model('Photo', {
     'photo_id': fields.Integer(readonly=True, description='ID фото'),
     'filename': fields.String(description='Имя файла'),
@@ -1,22 +1,27 @@
 # backend/cleanup_reservations.py
-from datetime import datetime, timedelta
+from datetime import datetime
+
+from flask import current_app
 
 from backend.core import db, create_app
-from backend.core.models.excursion_models import Reservation
+from backend.core.services.excursion_services.seat_service import expire_seat_holds
 
 
 def cleanup_unpaid_reservations():
-    threshold = datetime.now() - timedelta(minutes=15)
-    unpaid_old = Reservation.query.filter(
-        ~Reservation.is_paid,
-        Reservation.booked_at < threshold,
-        ~Reservation.is_cancelled
-    ).all()
-
-    for reservation in unpaid_old:
-        db.session.delete(reservation)
-    db.session.commit()
-    print(f"Удалено {len(unpaid_old)} неоплаченных броней старше 15 минут.")
+    # срок удержания хранится в каждой брони (hold_expires_at, SEAT_HOLD_MINUTES);
+    # брони отменяются пачками по CLEANUP_BATCH_SIZE, каждая пачка — в своей короткой транзакции
+    batch_size = current_app.config["CLEANUP_BATCH_SIZE"]
+    now = datetime.now()
+    total = 0
+    while True:
+        expired = expire_seat_holds(now=now, limit=batch_size)
+        db.session.commit()
+        total += expired
+        if expired < batch_size:
+            break
+    if total:
+        print(f"Отменено {total} неоплаченных броней с истёкшим удержанием мест.")
+    return total
 
 
 if __name__ == "__main__":
@@ -0,0 +1,154 @@
+import base64
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import current_app
+from flask_mail import Message
+from sqlalchemy import and_, or_, select, update
+
+from backend.core import db, mail
+from backend.core.models.system_models import EmailOutbox
+
+
+def queue_email(subject, recipient, body, body_html=None, attachments=None):
+    """
+    Ставит письмо в очередь в текущей транзакции: оно уйдёт, только если транзакция зафиксируется.
+    attachments — кортежи (имя, содержимое) или (имя, содержимое, mimetype).
+    """
+    stored_attachments = []
+    for attachment in attachments or ():
+        if isinstance(attachment, tuple) and len(attachment) == 3:
+            filename, content, mimetype = attachment
+        elif isinstance(attachment, tuple) and len(attachment) == 2:
+            filename, content = attachment
+            mimetype = "text/csv; charset=utf-8"
+        else:
+            print(f"Некорректный формат вложения: {attachment}")
+            continue
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        stored_attachments.append({
+            "filename": filename,
+            "mimetype": mimetype,
+            "content": base64.b64encode(content).decode("ascii")
+        })
+
+    email = EmailOutbox(
+        recipient=recipient,
+        subject=subject,
+        body=body,
+        body_html=body_html,
+        attachments=stored_attachments or None,
+        status=EmailOutbox.PENDING
+    )
+    db.session.add(email)
+    return email
+
+
+def _claimable(now):
+    # письма в sending с истёкшей арендой остались от упавшего обработчика
+    return or_(
+        and_(EmailOutbox.status == EmailOutbox.PENDING, EmailOutbox.next_attempt_at <= now),
+        and_(EmailOutbox.status == EmailOutbox.SENDING, EmailOutbox.locked_until < now)
+    )
+
+
+def claim_emails(limit, now=None):
+    now = now or datetime.now()
+    lease = timedelta(seconds=current_app.config["EMAIL_LEASE_SECONDS"])
+    candidates = db.session.execute(
+        select(EmailOutbox.email_id)
+        .where(_claimable(now))
+        .order_by(EmailOutbox.next_attempt_at)
+        .limit(limit)
+    ).scalars().all()
+
+    claimed = []
+    for email_id in candidates:
+        result = db.session.execute(
+            update(EmailOutbox)
+            .where(EmailOutbox.email_id == email_id, _claimable(now))
+            .values(status=EmailOutbox.SENDING, locked_until=now + lease, attempts=EmailOutbox.attempts + 1)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 1:
+            claimed.append(email_id)
+    db.session.commit()
+    return claimed
+
+
+def _build_message(email):
+    message = Message(subject=email.subject, recipients=[email.recipient], body=email.body, html=email.body_html)
+    for attachment in email.attachments or ():
+        message.attach(attachment["filename"], attachment["mimetype"], base64.b64decode(attachment["content"]))
+    return message
+
+
+def _close(connection):
+    try:
+        connection.__exit__(None, None, None)
+    except Exception:
+        pass
+
+
+def _deliver_chunk(app, email_ids):
+    """Отправляет письма через одно SMTP-соединение; после ошибки следующее письмо открывает новое."""
+    with app.app_context():
+        emails = EmailOutbox.query.filter(EmailOutbox.email_id.in_(email_ids)).order_by(EmailOutbox.email_id).all()
+        messages = [(email, _build_message(email)) for email in emails]
+        # на время SMTP-обмена транзакция не держится
+        db.session.commit()
+
+        delivered, failed = [], []
+        connection = None
+        try:
+            for email, message in messages:
+                try:
+                    if connection is None:
+                        connection = mail.connect().__enter__()
+                    connection.send(message)
+                    delivered.append(email)
+                except Exception as e:
+                    print(f"Ошибка при отправке email {email.email_id}: {e}")
+                    failed.append((email, str(e)[:1000]))
+                    if connection is not None:
+                        _close(connection)
+                        connection = None
+        finally:
+            if connection is not None:
+                _close(connection)
+
+        now = datetime.now()
+        max_attempts = app.config["EMAIL_MAX_ATTEMPTS"]
+        for email in delivered:
+            email.status = EmailOutbox.SENT
+            email.sent_at = now
+            email.locked_until = None
+            email.last_error = None
+        for email, error in failed:
+            email.last_error = error
+            email.locked_until = None
+            if email.attempts >= max_attempts:
+                email.status = EmailOutbox.FAILED
+            else:
+                email.status = EmailOutbox.PENDING
+                email.next_attempt_at = now + timedelta(seconds=min(30 * 2 ** (email.attempts - 1), 3600))
+        db.session.commit()
+        return len(delivered)
+
+
+def deliver_queued_emails(app):
+    """
+    Отправляет очередь писем пулом из EMAIL_WORKERS потоков: каждый поток отправляет свою часть пачки
+    через одно SMTP-соединение вместо отдельного соединения на письмо.
+    """
+    workers = app.config["EMAIL_WORKERS"]
+    delivered = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            with app.app_context():
+                claimed = claim_emails(app.config["EMAIL_BATCH_SIZE"])
+            if not claimed:
+                return delivered
+            chunks = [claimed[i::workers] for i in range(workers) if claimed[i::workers]]
+            delivered += sum(pool.map(lambda chunk: _deliver_chunk(app, chunk), chunks))
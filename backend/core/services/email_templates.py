@@ -0,0 +1,64 @@
+import os
+from functools import lru_cache
+
+from jinja2 import Environment, FileSystemLoader, StrictUndefined, select_autoescape
+
+from backend.core.config import Config
+
+EMAIL_TEMPLATE_FOLDER = os.path.join(Config.TEMPLATE_FOLDER, 'emails')
+
+# тема письма для каждого шаблона; тексты лежат в templates/emails/<имя>.txt и <имя>.html
+EMAIL_SUBJECTS = {
+    "reservation_confirmation": "Подтверждение бронирования экскурсии",
+    "reservation_cancellation": "Бронирование аннулировано",
+    "reservation_refund": "Ваше бронирование отменено — возврат средств",
+    "session_cancellation": "Отмена экскурсионной сессии",
+    "session_deletion": "Список отменённых бронирований по удалённой сессии",
+    "excursion_deletion": "Удалена экскурсия и отменены сессии",
+    "password_reset": "Сброс пароля",
+}
+
+
+def _format_datetime(value, fmt='%d.%m.%Y %H:%M'):
+    return value.strftime(fmt) if value else 'неизвестно'
+
+
+@lru_cache(maxsize=None)
+def load_email_templates():
+    """
+    Компилирует все шаблоны писем один раз на процесс. Окружение не зависит от контекста приложения,
+    поэтому рендер можно выполнять в фоновых потоках.
+    """
+    env = Environment(
+        loader=FileSystemLoader(EMAIL_TEMPLATE_FOLDER),
+        autoescape=select_autoescape(['html']),
+        undefined=StrictUndefined,
+        trim_blocks=True,
+        lstrip_blocks=True,
+        auto_reload=False
+    )
+    env.filters['dt'] = _format_datetime
+    return {
+        name: (env.get_template(f"{name}.txt"), env.get_template(f"{name}.html"))
+        for name in EMAIL_SUBJECTS
+    }
+
+
+def render_email(name, context):
+    """
+    Возвращает (тема, текст, html). context — обычный словарь значений:
+    ORM-объекты в шаблон не передаются, чтобы рендер не обращался к ленивым атрибутам.
+    """
+    text_template, html_template = load_email_templates()[name]
+    return EMAIL_SUBJECTS[name], text_template.render(context), html_template.render(context)
+
+
+def render_email_bulk(name, contexts, shared=None):
+    """Рендерит один шаблон для многих получателей; shared — общие для всех писем значения."""
+    text_template, html_template = load_email_templates()[name]
+    subject = EMAIL_SUBJECTS[name]
+    rendered = []
+    for context in contexts:
+        values = {**shared, **context} if shared else context
+        rendered.append((subject, text_template.render(values), html_template.render(values)))
+    return rendered
@@ -0,0 +1,182 @@
+from datetime import datetime, time
+
+from sqlalchemy import Date, case, cast, func, select
+
+from backend.core import db
+from backend.core.models.excursion_models import Excursion, ExcursionDailyStats, ExcursionSession, Reservation
+
+BUCKETS = ("day", "week", "month")
+
+
+def parse_analytics_params(args):
+    """start_date, end_date (ISO, включительно) и bucket из параметров запроса; ValueError при ошибке."""
+    try:
+        start = datetime.fromisoformat(args['start_date']) if args.get('start_date') else None
+        end = datetime.fromisoformat(args['end_date']) if args.get('end_date') else None
+    except ValueError:
+        raise ValueError("Неверный формат start_date или end_date")
+    if end is not None and end.time() == time.min:
+        # дата без времени — весь последний день
+        end = datetime.combine(end.date(), time.max)
+    bucket = args.get('bucket') or None
+    if bucket is not None and bucket not in BUCKETS:
+        raise ValueError("bucket должен быть day, week или month")
+    return start, end, bucket
+
+
+def _bucket_expression(bucket, column):
+    if db.engine.dialect.name == "postgresql":
+        return cast(func.date_trunc(bucket, column), Date)
+    if bucket == "day":
+        return func.date(column)
+    if bucket == "week":
+        # понедельник недели
+        return func.date(column, "-6 days", "weekday 1")
+    return func.date(column, "start of month")
+
+
+def _session_filter(resident_id, start, end):
+    conditions = [Excursion.created_by == resident_id]
+    if start is not None:
+        conditions.append(ExcursionSession.start_datetime >= start)
+    if end is not None:
+        conditions.append(ExcursionSession.start_datetime <= end)
+    return conditions
+
+
+def _aggregates(resident_id, start, end, key):
+    """
+    Подзапросы по сеансам и по броням, сгруппированные по key (экскурсия или период):
+    отдельная группировка не даёт соединению сеансов с бронями умножить вместимость.
+    """
+    sessions = (
+        select(key.label("key"),
+               func.count(ExcursionSession.session_id).label("session_count"),
+               func.sum(ExcursionSession.max_participants).label("capacity"))
+        .join(Excursion, Excursion.excursion_id == ExcursionSession.excursion_id)
+        .where(*_session_filter(resident_id, start, end))
+        .group_by(key)
+        .subquery()
+    )
+    active = Reservation.is_cancelled.is_(False)
+    reservations = (
+        select(key.label("key"),
+               func.count(Reservation.reservation_id).label("reservations"),
+               func.sum(case((Reservation.is_cancelled.is_(True), 1), else_=0)).label("cancelled"),
+               func.sum(case((active, Reservation.participants_count), else_=0)).label("participants"),
+               func.sum(case((active & Reservation.is_paid.is_(True),
+                              Reservation.participants_count * ExcursionSession.cost), else_=0)).label("revenue"))
+        .join(ExcursionSession, ExcursionSession.session_id == Reservation.session_id)
+        .join(Excursion, Excursion.excursion_id == ExcursionSession.excursion_id)
+        .where(*_session_filter(resident_id, start, end))
+        .group_by(key)
+        .subquery()
+    )
+    return sessions, reservations
+
+
+def _metrics(row):
+    capacity = int(row.capacity or 0)
+    participants = int(row.participants or 0)
+    reservations = int(row.reservations or 0)
+    cancelled = int(row.cancelled or 0)
+    return {
+        "session_count": int(row.session_count or 0),
+        "total_participants": participants,
+        "capacity": capacity,
+        "reservations": reservations,
+        "cancelled_reservations": cancelled,
+        "revenue": float(row.revenue or 0),
+        "fill_rate": round(participants / capacity, 4) if capacity else 0.0,
+        "cancellation_rate": round(cancelled / reservations, 4) if reservations else 0.0,
+    }
+
+
+def _series(resident_id, start, end, bucket):
+    key = _bucket_expression(bucket, ExcursionSession.start_datetime)
+    sessions, reservations = _aggregates(resident_id, start, end, key)
+    rows = db.session.execute(
+        select(sessions.c.key, sessions.c.session_count, sessions.c.capacity, reservations.c.reservations,
+               reservations.c.cancelled, reservations.c.participants, reservations.c.revenue)
+        .outerjoin(reservations, reservations.c.key == sessions.c.key)
+        .order_by(sessions.c.key)
+    ).all()
+    return [dict(period=str(row.key), **_metrics(row)) for row in rows]
+
+
+def get_resident_excursion_analytics(resident_id, start=None, end=None, bucket=None):
+    """
+    Аналитика резидента по сеансам в периоде [start, end]: сеансы, участники, выручка оплаченных броней,
+    заполняемость и доля отмен по экскурсиям и итогом. Один запрос, с bucket — ещё один для динамики по периодам.
+    """
+    sessions, reservations = _aggregates(resident_id, start, end, ExcursionSession.excursion_id)
+    rows = db.session.execute(
+        select(Excursion.excursion_id, Excursion.title, sessions.c.session_count, sessions.c.capacity,
+               reservations.c.reservations, reservations.c.cancelled, reservations.c.participants,
+               reservations.c.revenue)
+        .outerjoin(sessions, sessions.c.key == Excursion.excursion_id)
+        .outerjoin(reservations, reservations.c.key == Excursion.excursion_id)
+        .where(Excursion.created_by == resident_id)
+        .order_by(Excursion.excursion_id)
+    ).all()
+
+    if not rows:
+        return {"message": "У вас пока нет экскурсий", "stats": []}
+
+    details = [dict(excursion_id=row.excursion_id, title=row.title, **_metrics(row)) for row in rows]
+    totals = {name: sum(item[name] for item in details)
+              for name in ("session_count", "total_participants", "capacity", "reservations",
+                           "cancelled_reservations", "revenue")}
+    most_popular = max(details, key=lambda item: item["total_participants"])
+
+    result = {
+        "total_excursions": len(details),
+        "total_visitors": totals["total_participants"],
+        "total_sessions": totals["session_count"],
+        "total_revenue": totals["revenue"],
+        "fill_rate": round(totals["total_participants"] / totals["capacity"], 4) if totals["capacity"] else 0.0,
+        "cancellation_rate": round(totals["cancelled_reservations"] / totals["reservations"], 4)
+        if totals["reservations"] else 0.0,
+        "most_popular_excursion": {
+            "title": most_popular["title"],
+            "total_participants": most_popular["total_participants"]
+        } if most_popular["total_participants"] else None,
+        "details": details
+    }
+    if bucket:
+        result["bucket"] = bucket
+        result["series"] = _series(resident_id, start, end, bucket)
+    return result
+
+
+def get_daily_booking_stats(start=None, end=None, bucket=None, resident_id=None, excursion_id=None):
+    """
+    Динамика бронирований, отмен, оплат и возвратов по дням из сводок excursion_daily_stats
+    (booking_rollup_service), без чтения истории броней. resident_id ограничивает выборку его экскурсиями.
+    """
+    bucket = bucket or "day"
+    key = _bucket_expression(bucket, ExcursionDailyStats.day)
+    metrics = ("bookings", "participants", "cancellations", "paid_amount", "refunded_amount")
+    query = select(key.label("period"), *[func.sum(getattr(ExcursionDailyStats, name)).label(name)
+                                          for name in metrics])
+    if resident_id is not None:
+        query = query.join(Excursion, Excursion.excursion_id == ExcursionDailyStats.excursion_id) \
+            .where(Excursion.created_by == resident_id)
+    if excursion_id is not None:
+        query = query.where(ExcursionDailyStats.excursion_id == excursion_id)
+    if start is not None:
+        query = query.where(ExcursionDailyStats.day >= start.date())
+    if end is not None:
+        query = query.where(ExcursionDailyStats.day <= end.date())
+    rows = db.session.execute(query.group_by(key).order_by(key)).all()
+
+    series = [{
+        "period": str(row.period),
+        "bookings": int(row.bookings or 0),
+        "participants": int(row.participants or 0),
+        "cancellations": int(row.cancellations or 0),
+        "paid_amount": float(row.paid_amount or 0),
+        "refunded_amount": float(row.refunded_amount or 0),
+    } for row in rows]
+    totals = {name: sum(item[name] for item in series) for name in metrics}
+    return {"bucket": bucket, "totals": totals, "series": series}
@@ -0,0 +1,246 @@
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, case, delete, event, exists, func, insert, select
+from sqlalchemy.orm import Session
+
+from backend.core import db
+from backend.core.models.excursion_models import ExcursionDailyStats, ExcursionSession, Payment, RefundRequest, \
+    Reservation, SessionDailyStats
+from backend.core.models.system_models import RollupChange, RollupWatermark
+
+ROLLUP_NAME = "booking_daily_stats"
+PAID_STATUSES = ('succeeded', 'refund_pending', 'refunded')
+METRICS = ('bookings', 'participants', 'cancellations', 'paid_amount', 'refunded_amount')
+
+_CHUNK_SIZE = 500
+# сеансы, чья сводка уже пересчитана перед удалением в текущей транзакции
+_RECOMPUTED = "booking_rollup_recomputed"
+
+
+def _chunks(ids):
+    ids = sorted(ids)
+    for start in range(0, len(ids), _CHUNK_SIZE):
+        yield ids[start:start + _CHUNK_SIZE]
+
+
+def _as_date(value):
+    # SQLite возвращает date() строкой
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _empty_row(session_id, excursion_id, day):
+    return dict({name: 0 for name in METRICS}, session_id=session_id, excursion_id=excursion_id, day=day,
+                payment_refunded_amount=0)
+
+
+def _live_rows(excursions):
+    """Строки существующих сеансов по их броням и платежам; excursions — {session_id: excursion_id}."""
+    session_ids = list(excursions)
+    booked_day = func.date(Reservation.booked_at)
+    active = Reservation.is_cancelled.is_(False)
+    reservations = db.session.execute(
+        select(Reservation.session_id, booked_day.label("day"),
+               func.count(Reservation.reservation_id).label("bookings"),
+               func.sum(case((active, Reservation.participants_count), else_=0)).label("participants"),
+               func.sum(case((Reservation.is_cancelled.is_(True), 1), else_=0)).label("cancellations"))
+        .where(Reservation.session_id.in_(session_ids))
+        .group_by(Reservation.session_id, booked_day)
+    ).all()
+
+    paid_day = func.date(Payment.created_at)
+    # возврат, прошедший через RefundRequest, учитывается по нему, а не по статусу платежа
+    refunded_by_request = exists().where(RefundRequest.payment_id == Payment.payment_id,
+                                         RefundRequest.status == RefundRequest.SUCCEEDED)
+    payments = db.session.execute(
+        select(Payment.session_id, paid_day.label("day"),
+               func.sum(case((Payment.status.in_(PAID_STATUSES), Payment.amount), else_=0)).label("paid_amount"),
+               func.sum(case((and_(Payment.status == 'refunded', ~refunded_by_request), Payment.amount),
+                             else_=0)).label("payment_refunded_amount"))
+        .where(Payment.session_id.in_(session_ids), Payment.created_at.is_not(None))
+        .group_by(Payment.session_id, paid_day)
+    ).all()
+
+    rows = {}
+    for source in (reservations, payments):
+        for row in source:
+            key = (row.session_id, _as_date(row.day))
+            target = rows.setdefault(key, _empty_row(row.session_id, excursions[row.session_id], key[1]))
+            for name, value in row._mapping.items():
+                if name not in ('session_id', 'day'):
+                    target[name] = value or 0
+    return rows
+
+
+def _kept_rows(session_ids):
+    """Строки удалённых сеансов: брони и оплаты остаются такими, какими были при удалении."""
+    rows = db.session.execute(
+        select(SessionDailyStats.__table__).where(SessionDailyStats.session_id.in_(session_ids))
+    ).mappings()
+    return {(row['session_id'], row['day']): dict(row) for row in rows}
+
+
+def _session_rows(session_ids):
+    excursions = dict(db.session.execute(
+        select(ExcursionSession.session_id, ExcursionSession.excursion_id)
+        .where(ExcursionSession.session_id.in_(session_ids))
+    ).all())
+    rows = _live_rows(excursions) if excursions else {}
+    deleted = [session_id for session_id in session_ids if session_id not in excursions]
+    if deleted:
+        kept = _kept_rows(deleted)
+        rows.update(kept)
+        excursions.update((row['session_id'], row['excursion_id']) for row in kept.values())
+    for row in rows.values():
+        row['refunded_amount'] = row['payment_refunded_amount']
+
+    # RefundRequest переживает удаление сеанса и его платежей, поэтому возвраты считаются по нему
+    requested_day = func.date(RefundRequest.created_at)
+    refunds = db.session.execute(
+        select(RefundRequest.session_id, requested_day.label("day"), func.sum(RefundRequest.amount).label("amount"))
+        .where(RefundRequest.session_id.in_(session_ids), RefundRequest.status == RefundRequest.SUCCEEDED)
+        .group_by(RefundRequest.session_id, requested_day)
+    ).all()
+    for row in refunds:
+        if row.session_id not in excursions:
+            # удалённый сеанс без строк в сводке: экскурсию уже не определить
+            continue
+        key = (row.session_id, _as_date(row.day))
+        target = rows.setdefault(key, _empty_row(row.session_id, excursions[row.session_id], key[1]))
+        target['refunded_amount'] += row.amount
+    return list(rows.values())
+
+
+def _recompute_sessions(session_ids):
+    """Пересчитывает дневные сводки сеансов целиком; возвращает затронутые экскурсии."""
+    excursion_ids = set()
+    for chunk in _chunks(session_ids):
+        excursion_ids.update(db.session.execute(
+            select(SessionDailyStats.excursion_id).where(SessionDailyStats.session_id.in_(chunk)).distinct()
+        ).scalars())
+        # строки удалённых сеансов читаются из самой сводки, поэтому до её очистки
+        rows = _session_rows(chunk)
+        db.session.execute(delete(SessionDailyStats).where(SessionDailyStats.session_id.in_(chunk)))
+        if rows:
+            db.session.execute(insert(SessionDailyStats), rows)
+        excursion_ids.update(row['excursion_id'] for row in rows)
+    return excursion_ids
+
+
+def _recompute_excursions(excursion_ids):
+    for chunk in _chunks(excursion_ids):
+        db.session.execute(delete(ExcursionDailyStats).where(ExcursionDailyStats.excursion_id.in_(chunk)))
+        db.session.execute(
+            insert(ExcursionDailyStats).from_select(
+                ['excursion_id', 'day', *METRICS],
+                select(SessionDailyStats.excursion_id, SessionDailyStats.day,
+                       *[func.sum(getattr(SessionDailyStats, name)) for name in METRICS])
+                .where(SessionDailyStats.excursion_id.in_(chunk))
+                .group_by(SessionDailyStats.excursion_id, SessionDailyStats.day)
+            )
+        )
+
+
+def _save_watermark(processed_until):
+    watermark = db.session.get(RollupWatermark, ROLLUP_NAME)
+    if watermark is None:
+        db.session.add(RollupWatermark(name=ROLLUP_NAME, processed_until=processed_until))
+    else:
+        watermark.processed_until = processed_until
+
+
+def _pending_changes():
+    return db.session.execute(select(RollupChange.change_id, RollupChange.session_id)).all()
+
+
+def _forget_changes(changes):
+    # удаляются только прочитанные записи: записанные параллельной транзакцией заберёт следующий запуск
+    for chunk in _chunks([change.change_id for change in changes]):
+        db.session.execute(delete(RollupChange).where(RollupChange.change_id.in_(chunk)))
+
+
+def refresh_booking_rollups(now=None):
+    """
+    Пересчитывает дневные сводки только для сеансов, чьи брони, платежи или возвраты изменились после отметки
+    прошлого запуска, и для сеансов из журнала удалений RollupChange. Отметка сдвигается назад
+    на BOOKING_ROLLUP_OVERLAP_SECONDS, чтобы не пропустить транзакции, зафиксированные позже своего updated_at.
+    Возвращает число сеансов.
+    """
+    now = now or datetime.now()
+    watermark = db.session.get(RollupWatermark, ROLLUP_NAME)
+    if watermark is None:
+        return backfill_booking_rollups(now)
+    since = watermark.processed_until - timedelta(seconds=current_app.config["BOOKING_ROLLUP_OVERLAP_SECONDS"])
+
+    changes = _pending_changes()
+    session_ids = {change.session_id for change in changes}
+    session_ids.update(db.session.execute(
+        select(Reservation.session_id).where(Reservation.updated_at > since).distinct()
+    ).scalars())
+    session_ids.update(db.session.execute(
+        select(Payment.session_id).where(Payment.updated_at > since, Payment.session_id.is_not(None)).distinct()
+    ).scalars())
+    session_ids.update(db.session.execute(
+        select(RefundRequest.session_id)
+        .where(RefundRequest.updated_at > since, RefundRequest.session_id.is_not(None))
+        .distinct()
+    ).scalars())
+
+    _recompute_excursions(_recompute_sessions(session_ids))
+    _forget_changes(changes)
+    _save_watermark(now)
+    db.session.commit()
+    return len(session_ids)
+
+
+def backfill_booking_rollups(now=None):
+    """
+    Полностью пересобирает дневные сводки по всей истории броней, платежей и возвратов; строки удалённых
+    сеансов сохраняются. Возвращает число сеансов.
+    """
+    now = now or datetime.now()
+    changes = _pending_changes()
+    session_ids = set(db.session.execute(select(Reservation.session_id).distinct()).scalars())
+    session_ids.update(db.session.execute(
+        select(Payment.session_id).where(Payment.session_id.is_not(None)).distinct()
+    ).scalars())
+    session_ids.update(db.session.execute(
+        select(RefundRequest.session_id).where(RefundRequest.session_id.is_not(None)).distinct()
+    ).scalars())
+    session_ids.update(db.session.execute(select(SessionDailyStats.session_id).distinct()).scalars())
+
+    excursion_ids = _recompute_sessions(session_ids)
+    excursion_ids.update(db.session.execute(select(ExcursionDailyStats.excursion_id).distinct()).scalars())
+    _recompute_excursions(excursion_ids)
+    _forget_changes(changes)
+    _save_watermark(now)
+    db.session.commit()
+    return len(session_ids)
+
+
+# Удаление брони или платежа не оставляет updated_at, по которому его нашёл бы пересчёт, поэтому сеанс
+# записывается в журнал RollupChange той же транзакцией. Перед первым таким удалением в транзакции сводка
+# сеанса пересчитывается, пока его брони и платежи ещё в базе: если следом удаляется и сам сеанс
+# (задание отмены удаляет платежи раньше него), его строки остаются историей, где меняются только возвраты
+
+@event.listens_for(Session, "before_flush")
+def _record_deleted_bookings(session, flush_context, instances):
+    session_ids = {obj.session_id for obj in session.deleted
+                   if isinstance(obj, (ExcursionSession, Reservation, Payment)) and obj.session_id is not None}
+    if not session_ids:
+        return
+    recomputed = session.info.setdefault(_RECOMPUTED, set())
+    if session_ids - recomputed:
+        _recompute_sessions(session_ids - recomputed)
+        recomputed.update(session_ids)
+    session.add_all([RollupChange(session_id=session_id) for session_id in session_ids])
+
+
+@event.listens_for(Session, "after_commit")
+def _forget_recomputed_sessions(session):
+    session.info.pop(_RECOMPUTED, None)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_recomputed_sessions_on_rollback(session):
+    session.info.pop(_RECOMPUTED, None)
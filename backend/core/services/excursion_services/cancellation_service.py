@@ -0,0 +1,180 @@
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, func, or_, select, update
+
+from backend.core import db
+from backend.core.models.excursion_models import RefundRequest
+from backend.core.models.system_models import CancellationJob, CancellationJobItem
+from backend.core.services.email_service import send_bulk_emails, send_session_deletion_email, \
+    send_excursion_deletion_email
+from backend.core.services.refund_service import request_refund, submit_refunds
+from backend.core.services.utilits import generate_reservations_csv
+
+
+def _needs_refund(reservation, session):
+    return bool(reservation.is_paid and reservation.payment and session.cost > 0
+                and reservation.payment.status == "succeeded")
+
+
+def create_cancellation_job(kind, excursion, sessions, requester, report_email=None):
+    """
+    Записывает задание на возвраты и письма по активным броням сеансов в текущей транзакции.
+    Вызывающий код удаляет сеансы или экскурсию в той же транзакции: данные броней, нужные заданию,
+    сохраняются в снимках CancellationJobItem.
+    """
+    job = CancellationJob(
+        kind=kind,
+        excursion_id=excursion.excursion_id,
+        session_id=sessions[0].session_id if kind == CancellationJob.SESSION else None,
+        excursion_title=excursion.title,
+        requested_by=requester.user_id if requester else None,
+        report_email=report_email,
+        status=CancellationJob.PENDING
+    )
+    for session in sessions:
+        for reservation in session.reservations:
+            if reservation.is_cancelled:
+                continue
+            refund = None
+            if _needs_refund(reservation, session):
+                refund = request_refund(reservation.payment.payment_id, reservation.payment.amount,
+                                        reservation.payment.currency, reservation_id=reservation.reservation_id,
+                                        session_id=session.session_id)
+            job.items.append(CancellationJobItem(
+                reservation_id=reservation.reservation_id,
+                session_id=session.session_id,
+                session_start=session.start_datetime,
+                email=reservation.email or (reservation.user.email if reservation.user else None),
+                full_name=reservation.full_name,
+                snapshot=reservation.to_dict(),
+                refund=refund
+            ))
+            if reservation.payment:
+                db.session.delete(reservation.payment)
+    db.session.add(job)
+    return job
+
+
+def _claimable(now):
+    return or_(
+        CancellationJob.status == CancellationJob.PENDING,
+        and_(CancellationJob.status == CancellationJob.RUNNING, CancellationJob.locked_until < now)
+    )
+
+
+def claim_cancellation_job(now=None):
+    now = now or datetime.now()
+    lease = timedelta(seconds=current_app.config["CANCELLATION_JOB_LEASE_SECONDS"])
+    candidates = db.session.execute(
+        select(CancellationJob.job_id).where(_claimable(now)).order_by(CancellationJob.job_id).limit(5)
+    ).scalars().all()
+    for job_id in candidates:
+        result = db.session.execute(
+            update(CancellationJob)
+            .where(CancellationJob.job_id == job_id, _claimable(now))
+            .values(status=CancellationJob.RUNNING, locked_until=now + lease,
+                    started_at=func.coalesce(CancellationJob.started_at, now))
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 1:
+            db.session.commit()
+            return job_id
+    db.session.commit()
+    return None
+
+
+def _notify_participants(job):
+    """
+    Ставит письма участникам обработанных броней в очередь одной рассылкой. Письма фиксируются
+    в одной транзакции с флагами notified, поэтому повтор задания не отправит их дважды.
+    """
+    items = [item for item in job.items
+             if item.status != CancellationJobItem.PENDING and item.email and not item.notified]
+    if not items:
+        return
+    send_bulk_emails(
+        "session_cancellation",
+        [(item.email, {
+            "full_name": item.full_name,
+            "session_id": item.session_id,
+            "session_start": item.session_start,
+            "refund_expected": item.refund_status != 'not_required'
+        }) for item in items],
+        shared={"title": job.excursion_title},
+        commit=False
+    )
+    for item in items:
+        item.notified = True
+
+
+def _renew_lease(job_id):
+    # аренда продлевается после каждого возврата, чтобы долгое задание не забрал другой воркер
+    lease = timedelta(seconds=current_app.config["CANCELLATION_JOB_LEASE_SECONDS"])
+    db.session.execute(
+        update(CancellationJob)
+        .where(CancellationJob.job_id == job_id)
+        .values(locked_until=datetime.now() + lease)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+
+def _finish_job(job_id):
+    """
+    Подводит итог по броням, рассылает письма и отчёт. Возвраты, отложенные после ошибок
+    или ещё не подтверждённые YooKassa, задание не ждёт — их доводит фоновый dispatch_refunds.
+    """
+    job = db.session.get(CancellationJob, job_id)
+    for item in job.items:
+        if item.status != CancellationJobItem.PENDING:
+            continue
+        if item.refund is not None and item.refund.status == RefundRequest.FAILED:
+            item.status = CancellationJobItem.FAILED
+            item.error = f"Ошибка возврата: {item.refund.last_error}"
+        else:
+            item.status = CancellationJobItem.DONE
+
+    _notify_participants(job)
+    if job.report_email and job.items:
+        csv_data = generate_reservations_csv([item.snapshot for item in job.items])
+        if job.kind == CancellationJob.SESSION:
+            send_session_deletion_email(job.report_email, job.excursion_title, job.session_id, csv_data)
+        else:
+            send_excursion_deletion_email(job.report_email, job.excursion_title, csv_data)
+
+    job.status = CancellationJob.DONE
+    job.finished_at = datetime.now()
+    job.locked_until = None
+    db.session.commit()
+
+
+def run_cancellation_jobs(app):
+    """
+    Выполняет задания отмены по одному: возвраты задания отправляются параллельно через refund_service
+    (уже завершённые при повторном запуске пропускаются), письма участникам уходят одной рассылкой.
+    """
+    finished = 0
+    while True:
+        with app.app_context():
+            job_id = claim_cancellation_job()
+            if job_id is None:
+                return finished
+            job = db.session.get(CancellationJob, job_id)
+            refund_ids = [item.refund_request_id for item in job.items
+                          if item.status == CancellationJobItem.PENDING and item.refund_request_id]
+            db.session.commit()
+
+        submit_refunds(app, refund_ids, on_done=lambda: _renew_lease(job_id))
+
+        with app.app_context():
+            _finish_job(job_id)
+        finished += 1
+
+
+def get_cancellation_job(job_id, requester=None):
+    """requester ограничивает доступ заданиями, созданными этим пользователем (для резидентов)."""
+    job = db.session.get(CancellationJob, job_id)
+    if not job or (requester is not None and job.requested_by != requester.user_id):
+        return None
+    return job
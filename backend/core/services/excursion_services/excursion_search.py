@@ -0,0 +1,65 @@
+import sqlite3
+
+from sqlalchemy import event, func, inspect, literal_column, select, table, text
+from sqlalchemy.engine import Engine
+
+from backend.core import db
+from backend.core.models.excursion_models import Excursion, EXCURSION_TITLE_FTS_TABLE, EXCURSION_TITLE_SEARCH_DDL
+
+# trigram-токенизатор не находит подстроки короче трёх символов
+MIN_FTS_TERM_LENGTH = 3
+
+_fts_available = {}
+
+
+@event.listens_for(Engine, "connect")
+def _register_sqlite_functions(dbapi_connection, connection_record):
+    # встроенный lower() в SQLite понижает регистр только у ASCII, кириллицу оставляет как есть
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.create_function(
+            "unicode_lower", 1, lambda value: value.lower() if value is not None else None, deterministic=True
+        )
+
+
+def escape_like(term):
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _has_title_fts(engine):
+    key = str(engine.url)
+    if key not in _fts_available:
+        _fts_available[key] = inspect(engine).has_table(EXCURSION_TITLE_FTS_TABLE)
+    return _fts_available[key]
+
+
+def apply_title_search(query, title):
+    term = (title or "").strip()
+    if not term:
+        return query
+
+    dialect = db.engine.dialect.name
+
+    if dialect == "postgresql":
+        return query.filter(Excursion.title.ilike(f"%{escape_like(term)}%", escape="\\"))
+
+    if dialect == "sqlite" and len(term) >= MIN_FTS_TERM_LENGTH and _has_title_fts(db.engine):
+        phrase = '"' + term.replace('"', '""') + '"'
+        fts = table(EXCURSION_TITLE_FTS_TABLE)
+        matched_ids = (
+            select(literal_column("rowid"))
+            .select_from(fts)
+            .where(literal_column(EXCURSION_TITLE_FTS_TABLE).op("MATCH")(phrase))
+        )
+        return query.filter(Excursion.excursion_id.in_(matched_ids))
+
+    lower = func.unicode_lower if dialect == "sqlite" else func.lower
+    return query.filter(lower(Excursion.title).like(f"%{escape_like(term.lower())}%", escape="\\"))
+
+
+def ensure_title_search_index():
+    statements = EXCURSION_TITLE_SEARCH_DDL.get(db.engine.dialect.name, [])
+    with db.engine.begin() as connection:
+        for statement in statements:
+            connection.execute(text(statement))
+    _fts_available.pop(str(db.engine.url), None)
+    return len(statements)
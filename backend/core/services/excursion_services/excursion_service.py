@@ -1,87 +1,180 @@
 from datetime import datetime
 from http import HTTPStatus
-from urllib.parse import quote
 
-from flask import make_response
-from sqlalchemy import func, desc, asc
-from sqlalchemy.orm import aliased
+from sqlalchemy import or_
+from sqlalchemy.orm import joinedload, selectinload, defer
 
 from backend.core import db
 from backend.core.models.excursion_models import Excursion, Category, FormatType, AgeCategory, Tag, Reservation, \
-    ExcursionSession
-from backend.core.services.email_service import send_excursion_deletion_email
+    ExcursionSession, ExcursionSummary
+from backend.core.models.system_models import CancellationJob
+from backend.core.services.excursion_services.cancellation_service import create_cancellation_job
 from backend.core.services.excursion_services.excursion_photo_service import process_photos, add_photos
+from backend.core.services.excursion_services.excursion_search import apply_title_search, escape_like
+from backend.core.services.pagination import SortKey, paginate_keyset
 from backend.core.services.excursion_services.excursion_session_service import clear_sessions_and_schedules, \
-    add_sessions, delete_excursion_session
+    add_sessions, get_booked_counts
+from backend.core.services.reference_cache import get_reference_id
 from backend.core.services.user_services.auth_service import get_user_by_email
-from backend.core.services.utilits import get_model_by_name, generate_reservations_csv, remove_file_if_exists
+from backend.core.services.utilits import remove_file_if_exists
 
 
-def get_excursion(excursion_id, resident_id=None):
-    query = Excursion.query.filter_by(excursion_id=excursion_id)
+_REFERENCE_FIELDS = (
+    ("category", "category"),
+    ("format_type", "format_type"),
+    ("age_category", "age_category"),
+    ("creator", "created_by"),
+)
+
+_REFERENCE_OPTIONS = tuple(joinedload(getattr(Excursion, relationship)) for relationship, _ in _REFERENCE_FIELDS)
+
+# крупные текстовые колонки, которые не нужны карточкам каталога
+_DEFERRABLE_COLUMNS = ("description", "iframe_url")
+
+
+def _sessions_loader(sessions_after=None):
+    if sessions_after is None:
+        return selectinload(Excursion.sessions)
+    return selectinload(Excursion.sessions.and_(ExcursionSession.start_datetime > sessions_after))
+
+
+def _card_options(sessions_after=None, fields=None):
+    if fields is None:
+        return _REFERENCE_OPTIONS + (
+            selectinload(Excursion.photos),
+            _sessions_loader(sessions_after),
+            selectinload(Excursion.tags),
+        )
+
+    options = [
+        joinedload(getattr(Excursion, relationship))
+        for relationship, field in _REFERENCE_FIELDS
+        if field in fields
+    ]
+    if "photos" in fields:
+        options.append(selectinload(Excursion.photos))
+    if "sessions" in fields:
+        options.append(_sessions_loader(sessions_after))
+    if "tags" in fields:
+        options.append(selectinload(Excursion.tags))
+    options.extend(defer(getattr(Excursion, column)) for column in _DEFERRABLE_COLUMNS if column not in fields)
+    return tuple(options)
+
+
+def _admin_full_options(sessions_after=None, fields=None):
+    return _REFERENCE_OPTIONS + (
+        selectinload(Excursion.photos),
+        selectinload(Excursion.tags),
+        _sessions_loader(sessions_after)
+        .selectinload(ExcursionSession.reservations)
+        .options(joinedload(Reservation.payment), joinedload(Reservation.user)),
+    )
+
+
+# Наборы опций загрузки под то, что сериализует каждый эндпоинт:
+# catalog_card — публичный каталог, detail — карточка экскурсии,
+# admin_full — карточка вместе с бронированиями (include_related=True)
+EXCURSION_LOAD_PROFILES = {
+    "catalog_card": _card_options,
+    "detail": _card_options,
+    "admin_full": _admin_full_options,
+}
+
+
+def apply_load_profile(query, profile, sessions_after=None, fields=None):
+    if profile is None:
+        return query
+    query = query.options(*EXCURSION_LOAD_PROFILES[profile](sessions_after, fields))
+    if sessions_after is not None:
+        # отфильтрованная коллекция сессий не должна смешиваться с уже загруженной в сессии ORM
+        query = query.execution_options(populate_existing=True)
+    return query
+
+
+def get_excursion(excursion_id, resident_id=None, profile="detail", sessions_after=None):
+    query = apply_load_profile(Excursion.query, profile, sessions_after).filter_by(excursion_id=excursion_id)
     if resident_id is not None:
         query = query.filter_by(created_by=resident_id)
     return query.first()
 
 
-def get_all_excursions():
-    return Excursion.query.all()
+def get_all_excursions(profile="detail"):
+    return apply_load_profile(Excursion.query, profile).all()
+
 
+def get_excursions_for_resident(resident_id, profile="detail"):
+    return apply_load_profile(Excursion.query, profile).filter_by(created_by=resident_id).all()
 
-def get_excursions_for_resident(resident_id):
-    return Excursion.query.filter_by(created_by=resident_id).all()
+
+def serialize_excursions(excursions, include_related=False, fields=None):
+    booked_counts = {}
+    if fields is None or "sessions" in fields:
+        booked_counts = get_booked_counts(
+            session.session_id
+            for excursion in excursions
+            for session in excursion.sessions
+        )
+    return [
+        excursion.to_dict(include_related=include_related, booked_counts=booked_counts, fields=fields)
+        for excursion in excursions
+    ]
 
 
-def delete_excursion(excursion_id, resident, return_csv=False):
+def parse_excursion_fields(raw_fields):
+    if not raw_fields:
+        return None
+    fields = {f.strip() for f in raw_fields.split(",") if f.strip()}
+    unknown = fields - set(Excursion.SERIALIZED_FIELDS)
+    if unknown:
+        raise ValueError(f"Неизвестные поля: {', '.join(sorted(unknown))}")
+    return fields
+
+
+def serialize_excursion(excursion, include_related=False):
+    return serialize_excursions([excursion], include_related=include_related)[0]
+
+
+def delete_excursion(excursion_id, resident):
+    """
+    Удаляет экскурсию со всеми сеансами одной транзакцией. Возвраты и письма по активным броням
+    выполняет фоновое задание отмены, а отчёт с отменёнными бронями приходит письмом, когда оно завершится.
+    """
     excursion = Excursion.query.filter_by(excursion_id=excursion_id).first()
     if not excursion:
         return {"message": "Экскурсия не найдена"}, HTTPStatus.NOT_FOUND
 
-    all_reservations = []
     sessions = excursion.sessions[:]
-
-    for session in sessions:
-        result, status = delete_excursion_session(excursion_id, session.session_id, notify_resident=False)
-        if status >= 400:
-            db.session.rollback()
-            return {
-                "message": f"Ошибка при удалении сессии ID {session.session_id}: {result.get('message', '')}"
-            }, status
-        all_reservations.extend(result.get("cancelled_reservations", []))
+    has_active = any(not r.is_cancelled for session in sessions for r in session.reservations)
+    photo_paths = [photo.photo_url for photo in excursion.photos]
 
     try:
-        for photo in excursion.photos:
-            remove_file_if_exists(photo.photo_url)
-            db.session.delete(photo)
+        job = None
+        if has_active:
+            job = create_cancellation_job(CancellationJob.EXCURSION, excursion, sessions, resident,
+                                          report_email=resident.email if resident else None)
         db.session.delete(excursion)
         db.session.commit()
     except Exception as e:
         db.session.rollback()
         return {"message": f"Ошибка при удалении экскурсии: {str(e)}"}, HTTPStatus.INTERNAL_SERVER_ERROR
 
-    if all_reservations:
-        csv_data = generate_reservations_csv(all_reservations)
-
-        send_excursion_deletion_email(resident, excursion, csv_data)
+    for photo_path in photo_paths:
+        remove_file_if_exists(photo_path)
 
-        if return_csv:
-            response = make_response(csv_data)
-            filename = f"отменённые_бронирования_экскурсия_{excursion.excursion_id}.csv"
-            encoded_filename = quote(filename)
-            response.headers["Content-Disposition"] = f"attachment; filename*=UTF-8''{encoded_filename}"
-            response.headers["Content-Type"] = "text/csv; charset=utf-8"
-            return response
-
-    return {"message": "Экскурсия и все связанные сессии удалены"}, HTTPStatus.NO_CONTENT
+    if job is None:
+        return {"message": "Экскурсия и все связанные сессии удалены"}, HTTPStatus.NO_CONTENT
+    return {
+        "message": "Экскурсия удалена, возвраты и уведомления участникам выполняются в фоне",
+        "job_id": job.job_id
+    }, HTTPStatus.ACCEPTED
 
 
 def create_excursion(data, email, files):
     try:
-        category = get_model_by_name(Category, "category_name", data.get("category"), "Категория не найдена")
-        format_type = get_model_by_name(FormatType, "format_type_name", data.get("format_type"),
-                                        "Формат мероприятия не найден")
-        age_category = get_model_by_name(AgeCategory, "age_category_name", data.get("age_category"),
-                                         "Возрастная категория не найдена")
+        category_id = get_reference_id("categories", data.get("category"), "Категория не найдена")
+        format_type_id = get_reference_id("format_types", data.get("format_type"), "Формат мероприятия не найден")
+        age_category_id = get_reference_id("age_categories", data.get("age_category"),
+                                           "Возрастная категория не найдена")
 
         if not data.get("place"):
             return None, {"message": "Место проведения обязательно"}, HTTPStatus.BAD_REQUEST
@@ -92,9 +185,9 @@ def create_excursion(data, email, files):
             title=data.get("title"),
             description=data.get("description"),
             duration=data.get("duration"),
-            category_id=category.category_id,
-            format_type_id=format_type.format_type_id,
-            age_category_id=age_category.age_category_id,
+            category_id=category_id,
+            format_type_id=format_type_id,
+            age_category_id=age_category_id,
             place=data["place"],
             conducted_by=data.get("conducted_by"),
             is_active=data.get("is_active", True),
@@ -146,24 +239,21 @@ def update_excursion(excursion_id, data):
         if field in data:
             setattr(excursion, field, data[field])
 
-    if 'category' in data:
-        category = Category.query.filter_by(category_name=data['category']).first()
-        if not category:
-            return None, {"message": f"Категория '{data['category']}' не найдена"}, HTTPStatus.BAD_REQUEST
-        excursion.category = category
-
-    if 'format_type' in data:
-        format_type = FormatType.query.filter_by(format_type_name=data['format_type']).first()
-        if not format_type:
-            return None, {"message": f"Формат '{data['format_type']}' не найден"}, HTTPStatus.BAD_REQUEST
-        excursion.format_type = format_type
-
-    if 'age_category' in data:
-        age_category = AgeCategory.query.filter_by(age_category_name=data['age_category']).first()
-        if not age_category:
-            return None, {
-                "message": f"Возрастная категория '{data['age_category']}' не найдена"}, HTTPStatus.BAD_REQUEST
-        excursion.age_category = age_category
+    try:
+        if 'category' in data:
+            excursion.category_id = get_reference_id(
+                "categories", data['category'], f"Категория '{data['category']}' не найдена"
+            )
+        if 'format_type' in data:
+            excursion.format_type_id = get_reference_id(
+                "format_types", data['format_type'], f"Формат '{data['format_type']}' не найден"
+            )
+        if 'age_category' in data:
+            excursion.age_category_id = get_reference_id(
+                "age_categories", data['age_category'], f"Возрастная категория '{data['age_category']}' не найдена"
+            )
+    except ValueError as ve:
+        return None, {"message": str(ve)}, HTTPStatus.BAD_REQUEST
 
     try:
         db.session.commit()
@@ -196,23 +286,42 @@ def verify_resident_owns_excursion(resident_id, excursion_id):
     return excursion, None, None
 
 
-def list_excursions(filters, sort_key):
-    now = datetime.now()
+def _catalog_sort_keys(sort_key):
+    sort_keys = []
+    signature = []
+    columns = Excursion.__table__.columns
 
-    session_alias = aliased(ExcursionSession)
+    for field in [s.strip() for s in (sort_key or "").split(",") if s.strip()]:
+        is_desc = field.startswith("-")
+        field_name = field.lstrip("-")
 
-    subquery = (
-        db.session.query(
-            session_alias.excursion_id,
-            func.min(session_alias.cost).label("min_cost"),
-            func.min(session_alias.start_datetime).label("min_date")
-        )
-        .filter(session_alias.start_datetime > now)
-        .group_by(session_alias.excursion_id)
-        .subquery()
-    )
+        if field_name == "price":
+            sort_keys.append(SortKey(ExcursionSummary.min_cost, is_desc))
+        elif field_name == "time":
+            sort_keys.append(SortKey(ExcursionSummary.next_session_at, is_desc))
+        elif field_name in columns:
+            column = columns[field_name]
+            sort_keys.append(SortKey(getattr(Excursion, field_name), is_desc, nullable=column.nullable))
+        else:
+            continue
+        signature.append(field)
+
+    # уникальный ключ в конце делает порядок детерминированным для курсора
+    sort_keys.append(SortKey(Excursion.excursion_id))
+    return sort_keys, ",".join(signature)
+
+
+def _build_catalog_query(filters, sort_key, profile, fields=None):
+    now = datetime.now()
 
-    query = Excursion.query.join(subquery, Excursion.excursion_id == subquery.c.excursion_id)
+    # цены, даты и прочие числовые фильтры читаются из сводки, а не агрегируются по сеансам на каждый запрос;
+    # last_session_at > now точно отражает наличие будущих сеансов даже до планового пересчёта сводки
+    query = apply_load_profile(Excursion.query, profile, sessions_after=now, fields=fields).join(
+        ExcursionSummary, Excursion.excursion_id == ExcursionSummary.excursion_id
+    ).filter(ExcursionSummary.last_session_at > now)
+
+    if title := filters.get("title"):
+        query = apply_title_search(query, title)
 
     if category := filters.get("category"):
         category_list = [c.strip() for c in category.split(",") if c.strip()]
@@ -232,150 +341,88 @@ def list_excursions(filters, sort_key):
     if tags := filters.get("tags"):
         tag_list = [tag.strip() for tag in tags.split(",") if tag.strip()]
         if tag_list:
-            query = query.filter(Excursion.tags.any(Tag.name.in_(tag_list)))
+            query = query.filter(or_(*[
+                ExcursionSummary.tag_names.like(f"%,{escape_like(tag)},%", escape="\\") for tag in tag_list
+            ]))
 
     try:
         if min_duration := filters.get("min_duration"):
-            query = query.filter(Excursion.duration >= int(min_duration))
+            query = query.filter(ExcursionSummary.duration >= int(min_duration))
     except ValueError:
         pass
     try:
         if max_duration := filters.get("max_duration"):
-            query = query.filter(Excursion.duration <= int(max_duration))
+            query = query.filter(ExcursionSummary.duration <= int(max_duration))
     except ValueError:
         pass
 
     try:
         if min_center_distance := filters.get("min_distance_to_center"):
-            query = query.filter(Excursion.distance_to_center >= float(min_center_distance))
+            query = query.filter(ExcursionSummary.distance_to_center >= float(min_center_distance))
     except ValueError:
         pass
     try:
         if max_center_distance := filters.get("max_distance_to_center"):
-            query = query.filter(Excursion.distance_to_center <= float(max_center_distance))
+            query = query.filter(ExcursionSummary.distance_to_center <= float(max_center_distance))
     except ValueError:
         pass
 
     try:
         if min_type_to_stop := filters.get("min_distance_to_stop"):
-            query = query.filter(Excursion.time_to_nearest_stop >= float(min_type_to_stop))
+            query = query.filter(ExcursionSummary.time_to_nearest_stop >= float(min_type_to_stop))
     except ValueError:
         pass
     try:
         if max_type_to_stop := filters.get("max_distance_to_stop"):
-            query = query.filter(Excursion.time_to_nearest_stop <= float(max_type_to_stop))
+            query = query.filter(ExcursionSummary.time_to_nearest_stop <= float(max_type_to_stop))
     except ValueError:
         pass
 
     try:
         if min_price := filters.get("min_price"):
-            query = query.filter(subquery.c.min_cost >= float(min_price))
+            query = query.filter(ExcursionSummary.min_cost >= float(min_price))
     except ValueError:
         pass
     try:
         if max_price := filters.get("max_price"):
-            query = query.filter(subquery.c.min_cost <= float(max_price))
+            query = query.filter(ExcursionSummary.min_cost <= float(max_price))
     except ValueError:
         pass
 
     try:
         if start_date := filters.get("start_date"):
             start_dt = datetime.fromisoformat(start_date)
-            query = query.filter(subquery.c.min_date >= start_dt)
+            query = query.filter(ExcursionSummary.next_session_at >= start_dt)
     except ValueError:
         pass
     try:
         if end_date := filters.get("end_date"):
             end_dt = datetime.fromisoformat(end_date)
-            query = query.filter(subquery.c.min_date <= end_dt)
+            query = query.filter(ExcursionSummary.next_session_at <= end_dt)
     except ValueError:
         pass
 
-    if sort_key:
-        sort_fields = [s.strip() for s in sort_key.split(",") if s.strip()]
-        order_criteria = []
-        for field in sort_fields:
-            is_desc = field.startswith("-")
-            field_name = field.lstrip("-")
-
-            if field_name == "price":
-                order = desc(subquery.c.min_cost) if is_desc else asc(subquery.c.min_cost)
-                order_criteria.append(order)
-            elif field_name == "time":
-                order = desc(subquery.c.min_date) if is_desc else asc(subquery.c.min_date)
-                order_criteria.append(order)
-            elif hasattr(Excursion, field_name):
-                column = getattr(Excursion, field_name)
-                order = desc(column) if is_desc else asc(column)
-                order_criteria.append(order)
-
-        if order_criteria:
-            query = query.order_by(*order_criteria)
-    excursions = query.all()
-
-    if title := filters.get("title"):
-        clean_title = title.strip().lower()
-        excursions = [
-            excursion for excursion in excursions
-            if clean_title in excursion.title.lower()
-        ]
-
-    for excursion in excursions:
-        excursion.sessions = [s for s in excursion.sessions if s.start_datetime > now]
-
-    return excursions
+    sort_keys, sort_signature = _catalog_sort_keys(sort_key)
+    return query, sort_keys, sort_signature
 
 
-def get_resident_excursion_analytics(resident_id):
-    excursions = db.session.query(Excursion).filter_by(created_by=resident_id).all()
+def list_excursions(filters, sort_key, profile="catalog_card", fields=None):
+    query, sort_keys, _ = _build_catalog_query(filters, sort_key, profile, fields)
+    return query.order_by(*[clause for key in sort_keys for clause in key.order_by()]).all()
 
-    if not excursions:
-        return {"message": "У вас пока нет экскурсий", "stats": []}
 
-    result = []
-    total_visitors = 0
-    most_popular = None
-    max_participants = 0
-
-    for excursion in excursions:
-        session_count = len(excursion.sessions)
-        excursion_total_participants = db.session.query(
-            func.coalesce(func.sum(Reservation.participants_count), 0)
-        ).join(ExcursionSession).filter(
-            ExcursionSession.excursion_id == excursion.excursion_id,
-            ~Reservation.is_cancelled
-        ).scalar()
-
-        if excursion_total_participants > max_participants:
-            most_popular = excursion
-            max_participants = excursion_total_participants
-
-        total_visitors += excursion_total_participants
-
-        result.append({
-            "excursion_id": excursion.excursion_id,
-            "title": excursion.title,
-            "session_count": session_count,
-            "total_participants": excursion_total_participants,
-        })
-
-    return {
-        "total_excursions": len(excursions),
-        "total_visitors": total_visitors,
-        "most_popular_excursion": {
-            "title": most_popular.title,
-            "total_participants": max_participants
-        } if most_popular else None,
-        "details": result
-    }
+def list_excursions_page(filters, sort_key, limit, cursor=None, profile="catalog_card", fields=None):
+    query, sort_keys, sort_signature = _build_catalog_query(filters, sort_key, profile, fields)
+    return paginate_keyset(query, sort_keys, sort_signature, limit, cursor)
 
 
 def get_detailed_excursion_with_reservations(excursion):
-    result = excursion.to_dict()
+    booked_counts = get_booked_counts(s.session_id for s in excursion.sessions)
+    result = excursion.to_dict(booked_counts=booked_counts)
     result['sessions'] = []
 
     for session in excursion.sessions:
-        session_data = session.to_dict()
+        session_data = session.to_dict(booked_counts=booked_counts)
         session_data['reservations'] = []
 
         for reservation in session.reservations:
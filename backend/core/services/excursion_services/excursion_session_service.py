@@ -1,20 +1,23 @@
-from datetime import datetime
+from datetime import datetime, time
 from http import HTTPStatus
-from urllib.parse import quote
 
-from flask import make_response
+from flask import current_app
 from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import func, select, update
 
 from backend.core import db
-from backend.core.models.excursion_models import ExcursionSession
-from backend.core.services.email_service import send_session_cancellation_email, send_session_deletion_email
+from backend.core.models.excursion_models import Excursion, ExcursionSession, Reservation
+from backend.core.models.system_models import CancellationJob
+from backend.core.services.excursion_services.cancellation_service import create_cancellation_job
+from backend.core.services.excursion_services.excursion_summary_service import mark_excursion_summaries_stale
+from backend.core.services.excursion_services.recurring_session_service import insert_sessions, \
+    weekly_occurrence_count, weekly_occurrences
 from backend.core.services.user_services.auth_service import get_user_by_email
-from backend.core.services.utilits import generate_reservations_csv
-from backend.core.services.yookassa_service import refund_yookassa_payment
 
 
 def clear_sessions_and_schedules(excursion):
     ExcursionSession.query.filter_by(excursion_id=excursion.excursion_id).delete()
+    mark_excursion_summaries_stale([excursion.excursion_id])
 
 
 def add_sessions(excursion, sessions):
@@ -32,6 +35,27 @@ def get_sessions_for_excursion(excursion_id):
     return ExcursionSession.query.filter_by(excursion_id=excursion_id).all()
 
 
+def get_booked_counts(session_ids):
+    session_ids = list(set(session_ids))
+    if not session_ids:
+        return {}
+
+    rows = db.session.query(
+        Reservation.session_id,
+        func.coalesce(func.sum(Reservation.participants_count), 0)
+    ).filter(
+        Reservation.session_id.in_(session_ids),
+        Reservation.is_cancelled.is_(False)
+    ).group_by(Reservation.session_id).all()
+
+    return {session_id: booked for session_id, booked in rows}
+
+
+def serialize_sessions(sessions):
+    booked_counts = get_booked_counts(s.session_id for s in sessions)
+    return [s.to_dict(booked_counts=booked_counts) for s in sessions]
+
+
 def create_excursion_session(excursion_id, data):
     try:
         start_dt = datetime.fromisoformat(data['start_datetime'])
@@ -53,6 +77,139 @@ def create_excursion_session(excursion_id, data):
         return None, {"message": f"Ошибка при создании сессии: {str(e)}"}, HTTPStatus.INTERNAL_SERVER_ERROR
 
 
+def _bulk_limit_message():
+    return f"За один запрос можно создать не больше {current_app.config['BULK_SESSIONS_MAX']} сеансов"
+
+
+def _expand_recurrence(rule, limit):
+    """
+    Сеансы правила повторения: по дням недели weekdays (0 = воскресенье) в start_time с date_from по date_to.
+    Число сеансов считается заранее, и правило больше limit отклоняется без построения дат.
+    """
+    try:
+        first_day = datetime.fromisoformat(rule['date_from']).date()
+        last_day = datetime.fromisoformat(rule['date_to']).date()
+        start_time = time.fromisoformat(rule['start_time'])
+        weekdays = set(rule['weekdays'])
+    except (KeyError, TypeError, ValueError):
+        return None, "Правило повторения должно содержать weekdays, start_time, date_from и date_to"
+    if not weekdays or any(not isinstance(day, int) or not 0 <= day <= 6 for day in weekdays):
+        return None, "weekdays — дни недели от 0 (воскресенье) до 6"
+    if last_day < first_day:
+        return None, "date_to раньше date_from"
+    if sum(weekly_occurrence_count(weekday, first_day, last_day) for weekday in weekdays) > limit:
+        return None, _bulk_limit_message()
+    specs = []
+    for weekday in weekdays:
+        if not weekly_occurrence_count(weekday, first_day, last_day):
+            continue
+        specs.extend({'start_datetime': start, 'max_participants': rule.get('max_participants'),
+                      'cost': rule.get('cost')}
+                     for start in weekly_occurrences(weekday, start_time, first_day, last_day))
+    return specs, None
+
+
+def _validate_session_specs(specs):
+    rows, errors, starts = [], [], set()
+    for index, spec in enumerate(specs):
+        start = spec.get('start_datetime')
+        if isinstance(start, str):
+            try:
+                start = datetime.fromisoformat(start)
+            except ValueError:
+                start = None
+        max_participants, cost = spec.get('max_participants'), spec.get('cost') or 0
+        if not isinstance(start, datetime):
+            errors.append({"index": index, "message": "Неверный или отсутствует start_datetime"})
+        elif start in starts:
+            errors.append({"index": index, "message": f"Сеанс {start.isoformat()} указан дважды"})
+        elif not isinstance(max_participants, int) or max_participants < 1:
+            errors.append({"index": index, "message": "max_participants должен быть положительным числом"})
+        elif not isinstance(cost, (int, float)) or cost < 0:
+            errors.append({"index": index, "message": "Стоимость должна быть неотрицательным числом"})
+        else:
+            starts.add(start)
+            rows.append({'start_datetime': start, 'max_participants': max_participants, 'cost': cost})
+    return rows, errors
+
+
+def bulk_create_excursion_sessions(excursion_id, data):
+    """
+    Создаёт сеансы списком sessions и/или по правилу повторения recurrence одной транзакцией.
+    Сеансы на уже занятое время: on_conflict=error (по умолчанию) — 409 без изменений,
+    skip — пропускаются, update — у существующих сеансов меняются max_participants и cost.
+    У сеансов, созданных вручную, нет уникального индекса по времени, поэтому запросы по одной экскурсии
+    выполняются по очереди под блокировкой её строки (SELECT ... FOR UPDATE; SQLite блокировку игнорирует).
+    """
+    on_conflict = data.get('on_conflict') or 'error'
+    if on_conflict not in ('error', 'skip', 'update'):
+        return {"message": "on_conflict должен быть error, skip или update"}, HTTPStatus.BAD_REQUEST
+
+    limit = current_app.config["BULK_SESSIONS_MAX"]
+    specs = list(data.get('sessions') or [])
+    if len(specs) > limit:
+        return {"message": _bulk_limit_message()}, HTTPStatus.BAD_REQUEST
+    if data.get('recurrence'):
+        generated, error = _expand_recurrence(data['recurrence'], limit - len(specs))
+        if error:
+            return {"message": error}, HTTPStatus.BAD_REQUEST
+        specs.extend(generated)
+    if not specs:
+        return {"message": "Не указаны сеансы"}, HTTPStatus.BAD_REQUEST
+
+    rows, errors = _validate_session_specs(specs)
+    if errors:
+        return {"message": "Ошибки в данных сеансов", "errors": errors}, HTTPStatus.BAD_REQUEST
+
+    db.session.execute(
+        select(Excursion.excursion_id).where(Excursion.excursion_id == excursion_id).with_for_update()
+    )
+    # все существующие сеансы окна — одним запросом по индексу (excursion_id, start_datetime)
+    starts = [row['start_datetime'] for row in rows]
+    existing = {
+        row.start_datetime: row for row in db.session.execute(
+            select(ExcursionSession.session_id, ExcursionSession.start_datetime, ExcursionSession.seats_reserved)
+            .where(ExcursionSession.excursion_id == excursion_id,
+                   ExcursionSession.start_datetime.between(min(starts), max(starts)))
+        )
+    }
+    conflicts = [row for row in rows if row['start_datetime'] in existing]
+    if conflicts and on_conflict == 'error':
+        return {
+            "message": "На это время уже есть сеансы",
+            "conflicts": [row['start_datetime'].isoformat() for row in conflicts]
+        }, HTTPStatus.CONFLICT
+
+    updates = []
+    if on_conflict == 'update':
+        errors = [{"start_datetime": row['start_datetime'].isoformat(),
+                   "message": "max_participants меньше уже забронированных мест"}
+                  for row in conflicts if row['max_participants'] < existing[row['start_datetime']].seats_reserved]
+        if errors:
+            return {"message": "Ошибки в данных сеансов", "errors": errors}, HTTPStatus.BAD_REQUEST
+        updates = [{'session_id': existing[row['start_datetime']].session_id,
+                    'max_participants': row['max_participants'], 'cost': row['cost']} for row in conflicts]
+
+    new_rows = [dict(row, excursion_id=excursion_id, seats_reserved=0)
+                for row in rows if row['start_datetime'] not in existing]
+    try:
+        inserted = insert_sessions(new_rows)
+        if updates:
+            # executemany UPDATE по первичному ключу
+            db.session.execute(update(ExcursionSession), updates)
+            mark_excursion_summaries_stale([excursion_id])
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return {"message": f"Ошибка при создании сессий: {str(e)}"}, HTTPStatus.INTERNAL_SERVER_ERROR
+
+    return {
+        "created": [row.session_id for row in inserted],
+        "updated": [row['session_id'] for row in updates],
+        "skipped": [row['start_datetime'].isoformat() for row in conflicts] if on_conflict == 'skip' else []
+    }, HTTPStatus.CREATED
+
+
 def update_excursion_session(excursion_id, session_id, data):
     session = ExcursionSession.query.filter_by(excursion_id=excursion_id, session_id=session_id).first()
     if not session:
@@ -77,67 +234,30 @@ def update_excursion_session(excursion_id, session_id, data):
 
 
 def delete_excursion_session(excursion_id, session_id, notify_resident=True):
-    email = get_jwt_identity()
-    user = get_user_by_email(email)
-    deleter_email = user.email
+    """
+    Удаляет сеанс сразу. Если на нём есть активные брони, возвраты и письма участникам
+    выполняет фоновое задание отмены: ответ 202 с job_id вместо ожидания YooKassa и почты.
+    """
+    user = get_user_by_email(get_jwt_identity())
     session = ExcursionSession.query.filter_by(excursion_id=excursion_id, session_id=session_id).first()
     if not session:
         return {"message": "Сессия не найдена"}, HTTPStatus.NOT_FOUND
 
-    active_reservations = [r for r in session.reservations if not r.is_cancelled]
-    excursion_name = session.excursion.title if session.excursion else "экскурсии"
-
-    refunded = []
-
-    for res in active_reservations:
-        if res.is_paid and res.payment and session.cost > 0 and res.payment.status == "succeeded":
-            try:
-                refund_yookassa_payment(
-                    payment_id=res.payment.payment_id,
-                    amount=float(res.payment.amount),
-                    currency=res.payment.currency
-                )
-                refunded.append(res.reservation_id)
-            except Exception as e:
-                db.session.rollback()
-                return {"message": f"Ошибка возврата по брони {res.reservation_id}: {str(e)}"}, HTTPStatus.BAD_REQUEST
-
-        send_session_cancellation_email(reservation=res, excursion_name=excursion_name, session=session)
-
-    cancelled_reservations = [
-        res.to_dict()
-        for res in active_reservations
-    ]
-
-    if notify_resident and cancelled_reservations:
-        csv_data = generate_reservations_csv(cancelled_reservations)
-    else:
-        csv_data = None
-
+    has_active = any(not r.is_cancelled for r in session.reservations)
     try:
-        for res in active_reservations:
-            if res.payment:
-                db.session.delete(res.payment)
-
+        job = None
+        if has_active:
+            job = create_cancellation_job(CancellationJob.SESSION, session.excursion, [session], user,
+                                          report_email=user.email if notify_resident else None)
         db.session.delete(session)
         db.session.commit()
-
-        if notify_resident and csv_data:
-            send_session_deletion_email(deleter_email, excursion_name, session_id, csv_data)
-
-            response = make_response(csv_data)
-            filename = f"отмененные_бронирования_сессия_{session_id}.csv"
-            encoded_filename = quote(filename)
-            response.headers["Content-Disposition"] = f"attachment; filename*=UTF-8''{encoded_filename}"
-            response.headers["Content-Type"] = "text/csv; charset=utf-8"
-            return response
-
-        return {
-            "message": "Сессия удалена",
-            "cancelled_reservations": cancelled_reservations,
-            "refunded": refunded
-        }, HTTPStatus.OK
-
     except Exception as e:
         db.session.rollback()
         return {"message": f"Ошибка при удалении сессии: {str(e)}"}, HTTPStatus.INTERNAL_SERVER_ERROR
+
+    if job is None:
+        return {"message": "Сессия удалена", "cancelled_reservations": [], "refunded": []}, HTTPStatus.OK
+    return {
+        "message": "Сессия удалена, возвраты и уведомления участникам выполняются в фоне",
+        "job_id": job.job_id
+    }, HTTPStatus.ACCEPTED
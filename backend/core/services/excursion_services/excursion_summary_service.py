@@ -0,0 +1,229 @@
+from datetime import datetime
+
+from sqlalchemy import delete, event, func, insert, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from backend.core import db
+from backend.core.models.excursion_models import Excursion, ExcursionSession, ExcursionSummary, Reservation, Tag, \
+    excursion_tags, ExcursionPhoto
+from backend.core.services.reference_cache import invalidate_excursion_stats
+
+_CHUNK_SIZE = 500
+
+_PENDING_EXCURSIONS = "summary_excursion_ids"
+_PENDING_SESSIONS = "summary_session_ids"
+_PENDING_NEW = "summary_new_objects"
+_REFRESHING = "summary_refreshing"
+_CHANGED = "summary_changed"
+
+
+def _chunks(ids):
+    ids = sorted(ids)
+    for start in range(0, len(ids), _CHUNK_SIZE):
+        yield ids[start:start + _CHUNK_SIZE]
+
+
+def _refresh_chunk(session, excursion_ids, now):
+    base_rows = session.execute(
+        select(
+            Excursion.excursion_id,
+            Excursion.is_active,
+            Excursion.duration,
+            Excursion.distance_to_center,
+            Excursion.time_to_nearest_stop
+        ).where(Excursion.excursion_id.in_(excursion_ids))
+    ).all()
+
+    session_rows = session.execute(
+        select(
+            ExcursionSession.excursion_id,
+            func.min(ExcursionSession.start_datetime),
+            func.max(ExcursionSession.start_datetime),
+            func.min(ExcursionSession.cost),
+            func.max(ExcursionSession.cost),
+            func.coalesce(func.sum(ExcursionSession.max_participants), 0)
+        )
+        .where(ExcursionSession.excursion_id.in_(excursion_ids), ExcursionSession.start_datetime > now)
+        .group_by(ExcursionSession.excursion_id)
+    ).all()
+    sessions_by_excursion = {row[0]: row[1:] for row in session_rows}
+
+    booked_by_excursion = dict(session.execute(
+        select(ExcursionSession.excursion_id, func.coalesce(func.sum(Reservation.participants_count), 0))
+        .join(Reservation, Reservation.session_id == ExcursionSession.session_id)
+        .where(
+            ExcursionSession.excursion_id.in_(excursion_ids),
+            ExcursionSession.start_datetime > now,
+            Reservation.is_cancelled.is_(False)
+        )
+        .group_by(ExcursionSession.excursion_id)
+    ).all())
+
+    tags_by_excursion = {}
+    for excursion_id, tag_name in session.execute(
+        select(excursion_tags.c.excursion_id, Tag.name)
+        .join(Tag, Tag.tag_id == excursion_tags.c.tag_id)
+        .where(excursion_tags.c.excursion_id.in_(excursion_ids))
+    ):
+        tags_by_excursion.setdefault(excursion_id, []).append(tag_name)
+
+    rows = []
+    for excursion_id, is_active, duration, distance_to_center, time_to_nearest_stop in base_rows:
+        next_at, last_at, min_cost, max_cost, capacity = sessions_by_excursion.get(
+            excursion_id, (None, None, None, None, 0)
+        )
+        rows.append({
+            "excursion_id": excursion_id,
+            "is_active": is_active,
+            "duration": duration,
+            "distance_to_center": distance_to_center,
+            "time_to_nearest_stop": time_to_nearest_stop,
+            "next_session_at": next_at,
+            "last_session_at": last_at,
+            "min_cost": min_cost,
+            "max_cost": max_cost,
+            "total_capacity": capacity,
+            "booked_seats": booked_by_excursion.get(excursion_id, 0),
+            "tag_names": "," + "".join(f"{name}," for name in sorted(tags_by_excursion.get(excursion_id, []))),
+            "updated_at": now,
+        })
+
+    present_ids = {row["excursion_id"] for row in rows}
+    missing_ids = [excursion_id for excursion_id in excursion_ids if excursion_id not in present_ids]
+    if missing_ids:
+        session.execute(delete(ExcursionSummary).where(ExcursionSummary.excursion_id.in_(missing_ids)))
+    if rows:
+        _upsert_summaries(session, rows)
+
+
+def _upsert_summaries(session, rows):
+    """
+    INSERT ... ON CONFLICT (excursion_id) DO UPDATE: параллельные транзакции по одной экскурсии
+    (брони на разные её сеансы, правка экскурсии во время брони) не падают на первичном ключе,
+    как было бы при удалении и повторной вставке.
+    """
+    dialect = session.get_bind().dialect.name
+    if dialect not in ("postgresql", "sqlite"):
+        session.execute(delete(ExcursionSummary).where(
+            ExcursionSummary.excursion_id.in_([row["excursion_id"] for row in rows])
+        ))
+        session.execute(insert(ExcursionSummary), rows)
+        return
+
+    statement = (postgresql if dialect == "postgresql" else sqlite).insert(ExcursionSummary.__table__)
+    statement = statement.on_conflict_do_update(
+        index_elements=["excursion_id"],
+        set_={name: statement.excluded[name] for name in rows[0] if name != "excursion_id"}
+    )
+    session.execute(statement, rows)
+
+
+def refresh_excursion_summaries(excursion_ids, session=None, now=None):
+    """Пересчитывает сводки в текущей транзакции; коммит остаётся за вызывающим кодом."""
+    session = session or db.session
+    now = now or datetime.now()
+    excursion_ids = {excursion_id for excursion_id in excursion_ids if excursion_id is not None}
+
+    for chunk in _chunks(excursion_ids):
+        _refresh_chunk(session, chunk, now)
+    return len(excursion_ids)
+
+
+def refresh_stale_excursion_summaries(now=None):
+    """Обновляет сводки, у которых ближайший сеанс уже начался, и создаёт недостающие."""
+    now = now or datetime.now()
+    stale_ids = db.session.execute(
+        select(Excursion.excursion_id)
+        .outerjoin(ExcursionSummary, ExcursionSummary.excursion_id == Excursion.excursion_id)
+        .where(or_(ExcursionSummary.excursion_id.is_(None), ExcursionSummary.next_session_at <= now))
+    ).scalars().all()
+
+    refreshed = refresh_excursion_summaries(stale_ids, now=now)
+    if refreshed:
+        # прошедшие сеансы пропадают из каталога: новый updated_at сводок меняет и его версию
+        db.session.info[_CHANGED] = True
+    db.session.commit()
+    return refreshed
+
+
+def rebuild_excursion_summaries():
+    excursion_ids = db.session.execute(select(Excursion.excursion_id)).scalars().all()
+    db.session.execute(delete(ExcursionSummary))
+    refreshed = refresh_excursion_summaries(excursion_ids)
+    db.session.info[_CHANGED] = True
+    db.session.commit()
+    return refreshed
+
+
+def mark_excursion_summaries_stale(excursion_ids=(), session=None, session_ids=()):
+    """Для массовых запросов (query.delete/update), которые не проходят через unit of work."""
+    session = session or db.session
+    session.info.setdefault(_PENDING_EXCURSIONS, set()).update(excursion_ids)
+    session.info.setdefault(_PENDING_SESSIONS, set()).update(session_ids)
+
+
+# Изменения сеансов, броней и самих экскурсий отслеживаются по unit of work,
+# а сводки пересчитываются одним проходом перед коммитом той же транзакции
+
+def _summary_key(obj):
+    if isinstance(obj, (Excursion, ExcursionSession, ExcursionPhoto)):
+        return _PENDING_EXCURSIONS, obj.excursion_id
+    if isinstance(obj, Reservation):
+        return _PENDING_SESSIONS, obj.session_id
+    return None, None
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_changed_excursions(session, flush_context, instances):
+    if session.info.get(_REFRESHING):
+        return
+
+    new_objects = session.info.setdefault(_PENDING_NEW, [])
+    for obj in session.new:
+        if isinstance(obj, (Excursion, ExcursionSession, ExcursionPhoto, Reservation)):
+            # первичные и внешние ключи новых объектов известны только после flush
+            new_objects.append(obj)
+
+    for obj in (*session.dirty, *session.deleted):
+        key, value = _summary_key(obj)
+        if key is not None:
+            session.info.setdefault(key, set()).add(value)
+
+
+@event.listens_for(Session, "before_commit")
+def _refresh_changed_excursions(session):
+    if session.info.get(_REFRESHING):
+        return
+
+    session.flush()
+    excursion_ids = session.info.pop(_PENDING_EXCURSIONS, set())
+    session_ids = session.info.pop(_PENDING_SESSIONS, set())
+    for obj in session.info.pop(_PENDING_NEW, []):
+        key, value = _summary_key(obj)
+        (excursion_ids if key == _PENDING_EXCURSIONS else session_ids).add(value)
+    session_ids.discard(None)
+
+    session.info[_REFRESHING] = True
+    try:
+        if session_ids:
+            excursion_ids.update(session.execute(
+                select(ExcursionSession.excursion_id).where(ExcursionSession.session_id.in_(session_ids))
+            ).scalars())
+        if refresh_excursion_summaries(excursion_ids, session=session):
+            session.info[_CHANGED] = True
+    finally:
+        session.info.pop(_REFRESHING, None)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_excursion_stats(session):
+    # диапазоны цен и расстояний в /excursion-stats строятся по сводкам
+    if session.info.pop(_CHANGED, False):
+        invalidate_excursion_stats()
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changed_excursions(session):
+    for key in (_PENDING_EXCURSIONS, _PENDING_SESSIONS, _PENDING_NEW, _CHANGED):
+        session.info.pop(key, None)
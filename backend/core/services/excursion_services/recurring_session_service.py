@@ -0,0 +1,119 @@
+from datetime import datetime, time, timedelta
+
+from flask import current_app
+from sqlalchemy import insert, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+
+from backend.core import db
+from backend.core.models.excursion_models import Excursion, ExcursionSession, RecurringSchedule
+from backend.core.services.excursion_services.excursion_summary_service import mark_excursion_summaries_stale
+
+
+def weekly_occurrences(weekday, start_time, first_day, last_day):
+    """Начала сеансов еженедельного расписания в днях [first_day, last_day]; weekday: 0 = воскресенье."""
+    python_weekday = (weekday + 6) % 7
+    first = first_day + timedelta(days=(python_weekday - first_day.weekday()) % 7)
+    if first > last_day:
+        return []
+    return [datetime.combine(first + timedelta(weeks=week), start_time)
+            for week in range((last_day - first).days // 7 + 1)]
+
+
+def weekly_occurrence_count(weekday, first_day, last_day):
+    """Число сеансов weekly_occurrences без построения самих дат."""
+    offset = ((weekday + 6) % 7 - first_day.weekday()) % 7
+    span = (last_day - first_day).days
+    return 0 if offset > span else (span - offset) // 7 + 1
+
+
+def existing_session_starts(excursion_ids, window_start, window_end, session=None):
+    """Пары (excursion_id, start_datetime) уже существующих сеансов окна — одним запросом по индексу."""
+    session = session or db.session
+    if not excursion_ids:
+        return set()
+    rows = session.execute(
+        select(ExcursionSession.excursion_id, ExcursionSession.start_datetime)
+        .where(ExcursionSession.excursion_id.in_(excursion_ids),
+               ExcursionSession.start_datetime.between(window_start, window_end))
+    ).all()
+    return {(row.excursion_id, row.start_datetime) for row in rows}
+
+
+def insert_sessions(rows, session=None):
+    """
+    Вставляет сеансы одним executemany в текущей транзакции и возвращает вставленные строки
+    (session_id, excursion_id, schedule_id). Сеансы расписаний, уже созданные параллельным запуском,
+    пропускаются по уникальному индексу uq_excursion_sessions_generated.
+    """
+    session = session or db.session
+    if not rows:
+        return []
+    dialect = session.get_bind().dialect.name
+    if dialect == "postgresql":
+        statement = postgresql.insert(ExcursionSession.__table__)
+    elif dialect == "sqlite":
+        statement = sqlite.insert(ExcursionSession.__table__)
+    else:
+        statement = insert(ExcursionSession.__table__)
+    if dialect in ("postgresql", "sqlite"):
+        statement = statement.on_conflict_do_nothing(
+            index_elements=["excursion_id", "start_datetime"], index_where=text("schedule_id IS NOT NULL")
+        )
+    statement = statement.returning(ExcursionSession.session_id, ExcursionSession.excursion_id,
+                                    ExcursionSession.schedule_id)
+    inserted = session.execute(statement, rows).all()
+    mark_excursion_summaries_stale(excursion_ids={row.excursion_id for row in inserted}, session=session)
+    return inserted
+
+
+def generate_recurring_sessions(days=None, now=None):
+    """
+    Создаёт сеансы всех расписаний на days дней вперёд (по умолчанию RECURRING_SESSIONS_DAYS):
+    даты считаются арифметически, существующие сеансы окна читаются одним запросом,
+    недостающие вставляются одним executemany. Возвращает число созданных сеансов.
+    """
+    now = now or datetime.now()
+    days = days or current_app.config["RECURRING_SESSIONS_DAYS"]
+    first_day, last_day = now.date(), now.date() + timedelta(days=days)
+
+    schedules = db.session.execute(
+        select(RecurringSchedule)
+        .join(Excursion, Excursion.excursion_id == RecurringSchedule.excursion_id)
+        .where((RecurringSchedule.repeats == 0) | (RecurringSchedule.count_of_repeats < RecurringSchedule.repeats))
+        .order_by(RecurringSchedule.schedule_id)
+    ).scalars().all()
+    existing = existing_session_starts(
+        {schedule.excursion_id for schedule in schedules},
+        datetime.combine(first_day, time.min), datetime.combine(last_day, time.max)
+    )
+
+    rows = []
+    for schedule in schedules:
+        remaining = schedule.repeats - schedule.count_of_repeats if schedule.repeats else None
+        for start in weekly_occurrences(schedule.weekday, schedule.start_time, first_day, last_day):
+            if remaining is not None and remaining <= 0:
+                break
+            key = (schedule.excursion_id, start)
+            if start <= now or key in existing:
+                continue
+            existing.add(key)
+            rows.append({
+                "excursion_id": schedule.excursion_id,
+                "schedule_id": schedule.schedule_id,
+                "start_datetime": start,
+                "max_participants": schedule.max_participants,
+                "cost": schedule.cost,
+                "seats_reserved": 0,
+            })
+            if remaining is not None:
+                remaining -= 1
+
+    inserted = insert_sessions(rows)
+    created = {}
+    for row in inserted:
+        created[row.schedule_id] = created.get(row.schedule_id, 0) + 1
+    for schedule in schedules:
+        if schedule.schedule_id in created:
+            schedule.count_of_repeats += created[schedule.schedule_id]
+    db.session.commit()
+    return len(inserted)
@@ -0,0 +1,150 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, case, event, func, inspect, or_, select, text, update
+from sqlalchemy.orm import Session
+
+from backend.core import db
+from backend.core.models.excursion_models import ExcursionSession, Payment, Reservation, PENDING_HOLD_CONDITION
+from backend.core.services.excursion_services.excursion_summary_service import mark_excursion_summaries_stale
+
+
+def reserve_seats(session_id, participants_count, session=None):
+    """
+    Атомарно занимает места на сеансе в текущей транзакции.
+    Условный UPDATE блокирует только строку сеанса (в SQLite — берёт блокировку записи),
+    поэтому параллельные брони не могут превысить max_participants. Возвращает False, если мест не хватает.
+    """
+    session = session or db.session
+    result = session.execute(
+        update(ExcursionSession)
+        .where(
+            ExcursionSession.session_id == session_id,
+            ExcursionSession.seats_reserved + participants_count <= ExcursionSession.max_participants
+        )
+        .values(seats_reserved=ExcursionSession.seats_reserved + participants_count)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def release_seats(session_id, participants_count, session=None):
+    session = session or db.session
+    session.execute(
+        update(ExcursionSession)
+        .where(ExcursionSession.session_id == session_id)
+        .values(seats_reserved=case(
+            (ExcursionSession.seats_reserved > participants_count,
+             ExcursionSession.seats_reserved - participants_count),
+            else_=0
+        ))
+        .execution_options(synchronize_session=False)
+    )
+
+
+def hold_expiry(now=None):
+    return (now or datetime.now()) + timedelta(minutes=current_app.config["SEAT_HOLD_MINUTES"])
+
+
+def expire_seat_holds(session_id=None, now=None, session=None, limit=None):
+    """
+    Отменяет неоплаченные брони с истёкшим удержанием и возвращает их места в текущей транзакции.
+    UPDATE ... RETURNING отдаёт только строки, которые отменила именно эта транзакция,
+    поэтому параллельные вызовы не освобождают одни и те же места дважды.
+    limit ограничивает пачку, чтобы большой хвост просроченных броней разбирался короткими транзакциями.
+    """
+    session = session or db.session
+    now = now or datetime.now()
+    # брони, созданные до появления hold_expires_at, удерживают места SEAT_HOLD_MINUTES от booked_at
+    legacy_cutoff = now - timedelta(minutes=current_app.config["SEAT_HOLD_MINUTES"])
+
+    condition = and_(
+        text(PENDING_HOLD_CONDITION),
+        or_(
+            Reservation.hold_expires_at < now,
+            and_(Reservation.hold_expires_at.is_(None), Reservation.booked_at < legacy_cutoff)
+        )
+    )
+    if session_id is not None:
+        condition = and_(condition, Reservation.session_id == session_id)
+    statement = update(Reservation).where(condition)
+    if limit:
+        # UPDATE ... LIMIT не везде поддерживается, поэтому пачка выбирается подзапросом по тем же индексам
+        batch = select(Reservation.reservation_id).where(condition).limit(limit)
+        statement = update(Reservation).where(Reservation.reservation_id.in_(batch), condition)
+
+    expired = session.execute(
+        statement.values(is_cancelled=True)
+        .returning(Reservation.reservation_id, Reservation.session_id, Reservation.participants_count)
+        .execution_options(synchronize_session="fetch")
+    ).all()
+    if not expired:
+        return 0
+
+    released = defaultdict(int)
+    for _, expired_session_id, participants_count in expired:
+        released[expired_session_id] += participants_count
+    for expired_session_id, participants_count in released.items():
+        release_seats(expired_session_id, participants_count, session=session)
+    mark_excursion_summaries_stale(session=session, session_ids=released)
+
+    # платежи по отменённым броням больше не ждут оплаты; если оплата всё же придёт,
+    # payment.succeeded восстановит бронь или вернёт деньги
+    session.execute(
+        update(Payment)
+        .where(Payment.reservation_id.in_([row.reservation_id for row in expired]), Payment.status == 'pending')
+        .values(status='canceled')
+        .execution_options(synchronize_session=False)
+    )
+    return len(expired)
+
+
+def reinstate_reservation(reservation):
+    """Возвращает отменённую бронь в работу (например, при поздней оплате), если места ещё есть."""
+    if not reserve_seats(reservation.session_id, reservation.participants_count):
+        return False
+    reservation.is_cancelled = False
+    return True
+
+
+def reconcile_seat_counters(allow_decrease=False):
+    """
+    Пересчитывает счётчики по активным броням: для данных, созданных до появления счётчика,
+    и как страховка от расхождений. По умолчанию счётчик только увеличивается — это безопасно
+    параллельно с бронированием; уменьшение (allow_decrease) стоит запускать без входящего трафика.
+    """
+    active = (
+        select(func.coalesce(func.sum(Reservation.participants_count), 0))
+        .where(Reservation.session_id == ExcursionSession.session_id, Reservation.is_cancelled.is_(False))
+        .scalar_subquery()
+    )
+    if allow_decrease:
+        condition = ExcursionSession.seats_reserved != active
+    else:
+        condition = ExcursionSession.seats_reserved < active
+    result = db.session.execute(
+        update(ExcursionSession)
+        .where(condition)
+        .values(seats_reserved=active)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+# Места освобождаются при отмене или удалении активной брони любым путём:
+# отмена пользователем, удаление администратором, очистка неоплаченных, каскад при удалении пользователя
+
+@event.listens_for(Session, "before_flush")
+def _release_seats_of_inactive_reservations(session, flush_context, instances):
+    for obj in session.deleted:
+        if isinstance(obj, Reservation) and not obj.is_cancelled:
+            release_seats(obj.session_id, obj.participants_count, session=session)
+
+    for obj in session.dirty:
+        if not isinstance(obj, Reservation):
+            continue
+        history = inspect(obj).attrs.is_cancelled.history
+        if history.added and history.added[0] and not (history.deleted and history.deleted[0]):
+            release_seats(obj.session_id, obj.participants_count, session=session)
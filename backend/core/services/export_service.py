@@ -0,0 +1,129 @@
+import csv
+import io
+import json
+import tempfile
+from datetime import date, datetime
+from decimal import Decimal
+from urllib.parse import quote
+
+from flask import Response, stream_with_context
+from openpyxl import Workbook
+from openpyxl.utils import get_column_letter
+
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": XLSX_MIMETYPE,
+    "ndjson": "application/x-ndjson",
+}
+
+# столько байт накапливается перед отдачей очередного куска ответа
+_CHUNK_SIZE = 64 * 1024
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "Да" if value else "Нет"
+    if isinstance(value, datetime):
+        return value.strftime('%d.%m.%Y %H:%M')
+    if isinstance(value, date):
+        return value.strftime('%d.%m.%Y')
+    return value
+
+
+def _xlsx_value(value):
+    if isinstance(value, bool):
+        return "Да" if value else "Нет"
+    return value
+
+
+def stream_csv(headers, rows, delimiter=";"):
+    """
+    CSV кусками байтов: строки пишутся по мере чтения rows, поэтому память не зависит от размера выгрузки.
+    BOM и разделитель «;» нужны, чтобы Excel с русской локалью открыл файл без мастера импорта.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=delimiter)
+    buffer.write("\ufeff")
+    writer.writerow(headers)
+    for row in rows:
+        writer.writerow([_csv_value(value) for value in row])
+        if buffer.tell() >= _CHUNK_SIZE:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+def stream_xlsx(headers, rows, sheet_title="Лист1", column_widths=None):
+    """
+    XLSX в режиме write_only: строки сразу уходят во временный файл, а не держатся в памяти листом.
+    Ширина колонок задаётся заранее (column_widths или по заголовкам) — второго прохода по данным нет.
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=sheet_title[:31])
+    for index, header in enumerate(headers, 1):
+        width = column_widths[index - 1] if column_widths else max(len(header) + 2, 12)
+        sheet.column_dimensions[get_column_letter(index)].width = width
+    sheet.append(headers)
+    for row in rows:
+        sheet.append([_xlsx_value(value) for value in row])
+
+    with tempfile.TemporaryFile() as output:
+        workbook.save(output)
+        output.seek(0)
+        while chunk := output.read(_CHUNK_SIZE):
+            yield chunk
+
+
+def _json_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"{type(value).__name__} не сериализуется в JSON")
+
+
+def stream_ndjson(keys, rows):
+    """NDJSON: по объекту {keys[i]: row[i]} на строку, куски по _CHUNK_SIZE."""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write(json.dumps(dict(zip(keys, row)), ensure_ascii=False, default=_json_value))
+        buffer.write("\n")
+        if buffer.tell() >= _CHUNK_SIZE:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+def stream_export(export_format, headers, rows, keys=None, sheet_title="Лист1", column_widths=None):
+    """headers — заголовки колонок для CSV и XLSX, keys — имена полей для NDJSON."""
+    if export_format == "csv":
+        return stream_csv(headers, rows)
+    if export_format == "xlsx":
+        return stream_xlsx(headers, rows, sheet_title=sheet_title, column_widths=column_widths)
+    if export_format == "ndjson":
+        return stream_ndjson(keys or headers, rows)
+    raise ValueError(f"Неизвестный формат выгрузки: {export_format}")
+
+
+def export_bytes(export_format, headers, rows, **kwargs):
+    """Выгрузка целиком — для вложений в письма."""
+    return b"".join(stream_export(export_format, headers, rows, **kwargs))
+
+
+def export_response(export_format, headers, rows, filename, **kwargs):
+    """
+    Потоковый ответ с выгрузкой: rows — генератор, который читается по мере отправки ответа
+    в контексте исходного запроса. filename указывается без расширения.
+    """
+    body = stream_export(export_format, headers, rows, **kwargs)
+    filename = f"{filename}.{export_format}"
+    return Response(
+        stream_with_context(body),
+        mimetype=EXPORT_FORMATS[export_format],
+        headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}"}
+    )
@@ -0,0 +1,159 @@
+import base64
+import binascii
+import json
+from datetime import datetime, date
+from decimal import Decimal
+
+from sqlalchemy import and_, or_
+
+from backend.core import db
+
+DEFAULT_PAGE_LIMIT = 20
+MAX_PAGE_LIMIT = 100
+
+
+class SortKey:
+    """Выражение сортировки для keyset-пагинации (NULL всегда в конце)."""
+
+    def __init__(self, expression, descending=False, nullable=False):
+        self.expression = expression
+        self.descending = descending
+        self.nullable = nullable
+
+    def order_by(self):
+        order = self.expression.desc() if self.descending else self.expression.asc()
+        if self.nullable:
+            return [self.expression.is_(None).asc(), order]
+        return [order]
+
+    def equals(self, value):
+        if value is None:
+            return self.expression.is_(None)
+        return self.expression == value
+
+    def after(self, value):
+        if value is None:
+            return None
+        condition = self.expression < value if self.descending else self.expression > value
+        if self.nullable:
+            return or_(condition, self.expression.is_(None))
+        return condition
+
+
+def build_sort_keys(sort, columns, unique_key, default=None):
+    """
+    Ключи сортировки из строки вида "-booked_at,email" по словарю допустимых полей
+    {имя: (выражение, nullable)}; неизвестные поля — ValueError. unique_key замыкает порядок для курсора.
+    """
+    sort_keys, signature = [], []
+    for field in [s.strip() for s in (sort or default or "").split(",") if s.strip()]:
+        field_name = field.lstrip("-")
+        if field_name not in columns:
+            raise ValueError(f"Сортировка возможна по полям: {', '.join(columns)}")
+        expression, nullable = columns[field_name]
+        sort_keys.append(SortKey(expression, field.startswith("-"), nullable=nullable))
+        signature.append(field)
+    sort_keys.append(SortKey(unique_key, descending=bool(sort_keys) and sort_keys[0].descending))
+    return sort_keys, ",".join(signature)
+
+
+def parse_limit(raw_limit, default=DEFAULT_PAGE_LIMIT):
+    if raw_limit in (None, ""):
+        return default
+    try:
+        limit = int(raw_limit)
+    except (TypeError, ValueError):
+        raise ValueError("Параметр limit должен быть целым числом")
+    if limit < 1:
+        raise ValueError("Параметр limit должен быть больше нуля")
+    return min(limit, MAX_PAGE_LIMIT)
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"dt": value.isoformat()}
+    if isinstance(value, date):
+        return {"d": value.isoformat()}
+    if isinstance(value, Decimal):
+        return {"dec": str(value)}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if "dt" in value:
+            return datetime.fromisoformat(value["dt"])
+        if "d" in value:
+            return date.fromisoformat(value["d"])
+        if "dec" in value:
+            return Decimal(value["dec"])
+    return value
+
+
+def encode_cursor(sort_signature, values):
+    payload = {"s": sort_signature, "v": [_encode_value(v) for v in values]}
+    raw = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor, sort_signature, expected_length):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        values = [_decode_value(v) for v in payload["v"]]
+        signature = payload["s"]
+    except (binascii.Error, UnicodeError, ValueError, KeyError, TypeError):
+        raise ValueError("Некорректный курсор")
+
+    if signature != sort_signature or len(values) != expected_length:
+        raise ValueError("Курсор не соответствует параметрам сортировки")
+    return values
+
+
+def keyset_condition(sort_keys, values):
+    clauses = []
+    for index, key in enumerate(sort_keys):
+        after = key.after(values[index])
+        if after is None:
+            continue
+        prefix = [sort_keys[i].equals(values[i]) for i in range(index)]
+        clauses.append(and_(*prefix, after))
+    return or_(*clauses)
+
+
+def paginate_keyset(query, sort_keys, sort_signature, limit, cursor=None):
+    """Возвращает (элементы страницы, курсор следующей страницы или None)."""
+    if cursor:
+        values = decode_cursor(cursor, sort_signature, len(sort_keys))
+        query = query.filter(keyset_condition(sort_keys, values))
+
+    query = query.add_columns(*[key.expression for key in sort_keys])
+    query = query.order_by(None).order_by(*[clause for key in sort_keys for clause in key.order_by()])
+
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    items = [row[0] for row in rows]
+    next_cursor = encode_cursor(sort_signature, list(rows[-1][1:])) if has_more and rows else None
+    return items, next_cursor
+
+
+def count_total(query, exact_limit):
+    """
+    Общее число строк выборки: (число, оценка ли это). На PostgreSQL сначала берётся оценка планировщика
+    из EXPLAIN; если она больше exact_limit, точный COUNT по большой таблице не выполняется.
+    query передаётся без опций жадной загрузки, чтобы они не попали в подсчёт.
+    """
+    query = query.order_by(None)
+    if db.engine.dialect.name == "postgresql":
+        compiled = query.statement.compile(dialect=db.engine.dialect)
+        plan = db.session.connection().exec_driver_sql(
+            f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params
+        ).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        estimate = int(plan[0]["Plan"]["Plan Rows"])
+        if estimate > exact_limit:
+            return estimate, True
+    return query.count(), False
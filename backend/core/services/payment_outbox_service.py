@@ -0,0 +1,191 @@
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from http import HTTPStatus
+
+from flask import current_app
+from sqlalchemy import and_, or_, select, update
+
+from backend.core import db
+from backend.core.models.excursion_models import Payment, PaymentOutbox, Reservation
+from backend.core.services.yookassa_service import create_yookassa_payment
+
+
+def enqueue_payment(reservation, session=None):
+    """Ставит создание платежа в очередь в текущей транзакции — вместе с бронью или не ставит вовсе."""
+    session = session or db.session
+    job = PaymentOutbox(reservation=reservation, idempotence_key=str(uuid.uuid4()), status=PaymentOutbox.PENDING)
+    session.add(job)
+    return job
+
+
+def _claimable(now):
+    # задания в processing с истёкшей арендой остались от упавшего воркера и забираются заново
+    return or_(
+        and_(PaymentOutbox.status == PaymentOutbox.PENDING, PaymentOutbox.next_attempt_at <= now),
+        and_(PaymentOutbox.status == PaymentOutbox.PROCESSING, PaymentOutbox.locked_until < now)
+    )
+
+
+def claim_payment_jobs(limit, now=None):
+    """
+    Забирает до limit заданий. Условный UPDATE по каждому кандидату гарантирует,
+    что задание достанется только одному воркеру даже при нескольких процессах.
+    """
+    now = now or datetime.now()
+    lease = timedelta(seconds=current_app.config["PAYMENT_OUTBOX_LEASE_SECONDS"])
+    candidates = db.session.execute(
+        select(PaymentOutbox.outbox_id)
+        .where(_claimable(now))
+        .order_by(PaymentOutbox.next_attempt_at)
+        .limit(limit)
+    ).scalars().all()
+
+    claimed = []
+    for outbox_id in candidates:
+        result = db.session.execute(
+            update(PaymentOutbox)
+            .where(PaymentOutbox.outbox_id == outbox_id, _claimable(now))
+            .values(status=PaymentOutbox.PROCESSING, locked_until=now + lease,
+                    attempts=PaymentOutbox.attempts + 1, updated_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 1:
+            claimed.append(outbox_id)
+    db.session.commit()
+    return claimed
+
+
+def _retry_or_fail(job, error):
+    job.last_error = str(error)[:1000]
+    job.locked_until = None
+    if job.attempts >= current_app.config["PAYMENT_OUTBOX_MAX_ATTEMPTS"]:
+        job.status = PaymentOutbox.FAILED
+        # платёж так и не создан — бронь не должна держать места до истечения удержания
+        if not job.reservation.is_paid:
+            job.reservation.is_cancelled = True
+    else:
+        job.status = PaymentOutbox.PENDING
+        job.next_attempt_at = datetime.now() + timedelta(seconds=min(2 ** job.attempts, 60))
+    db.session.commit()
+
+
+def process_payment_job(outbox_id):
+    job = db.session.get(PaymentOutbox, outbox_id)
+    if not job or job.status != PaymentOutbox.PROCESSING:
+        return
+
+    reservation = job.reservation
+    if reservation.is_cancelled or reservation.is_paid:
+        job.status = PaymentOutbox.FAILED
+        job.last_error = "Бронь отменена до создания платежа"
+        job.locked_until = None
+        db.session.commit()
+        return
+
+    excursion_session = reservation.session
+    amount = excursion_session.cost * reservation.participants_count
+    user_email = reservation.user.email
+    payment_request = dict(
+        amount=amount,
+        email=user_email,
+        description=f"Оплата экскурсии «{excursion_session.excursion.title}» на {excursion_session.start_datetime}",
+        quantity=reservation.participants_count,
+        metadata={
+            "reservation_id": reservation.reservation_id,
+            "session_id": reservation.session_id,
+            "email": user_email
+        },
+        idempotence_key=job.idempotence_key
+    )
+    # запрос к YooKassa идёт вне транзакции: соединение с БД не удерживается на время ответа провайдера
+    db.session.commit()
+
+    try:
+        payment_response = create_yookassa_payment(**payment_request)
+    except Exception as e:
+        print(f"Ошибка создания платежа YooKassa для брони {job.reservation_id}: {e}")
+        _retry_or_fail(job, e)
+        return
+
+    # повтор с тем же ключом идемпотентности возвращает уже созданный платёж
+    if not db.session.get(Payment, payment_response.id):
+        db.session.add(Payment(
+            payment_id=payment_response.id,
+            session_id=reservation.session_id,
+            reservation_id=reservation.reservation_id,
+            participants_count=reservation.participants_count,
+            email=user_email,
+            amount=amount,
+            currency='RUB',
+            status=payment_response.status,
+            method=payment_response.payment_method.type
+        ))
+    job.status = PaymentOutbox.DONE
+    job.payment_id = payment_response.id
+    job.confirmation_url = payment_response.confirmation.confirmation_url
+    job.locked_until = None
+    job.last_error = None
+    db.session.commit()
+
+
+def _process_in_context(app, outbox_id):
+    with app.app_context():
+        try:
+            process_payment_job(outbox_id)
+        except Exception as e:
+            db.session.rollback()
+            print(f"Ошибка обработки задания на платёж {outbox_id}: {e}")
+
+
+def dispatch_payment_outbox(app):
+    """
+    Обрабатывает очередь платежей пулом из PAYMENT_OUTBOX_CONCURRENCY потоков, пока в ней есть готовые задания.
+    Запросы к провайдеру выполняются здесь, а не в веб-воркерах.
+    """
+    concurrency = app.config["PAYMENT_OUTBOX_CONCURRENCY"]
+    processed = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while True:
+            with app.app_context():
+                claimed = claim_payment_jobs(concurrency)
+            if not claimed:
+                return processed
+            list(pool.map(lambda outbox_id: _process_in_context(app, outbox_id), claimed))
+            processed += len(claimed)
+
+
+def _payment_state(reservation):
+    job = reservation.payment_job
+    if reservation.is_paid:
+        return {"status": "paid"}
+    if job is not None and job.status == PaymentOutbox.FAILED:
+        return {"status": "failed"}
+    if reservation.is_cancelled:
+        return {"status": "cancelled"}
+    if job is None:
+        # бронь создана до появления очереди: платёж создавался синхронно
+        if reservation.payment:
+            return {"status": "ready", "payment_id": reservation.payment.payment_id, "payment_url": None}
+        return {"status": "failed"}
+    if job.status == PaymentOutbox.DONE:
+        return {"status": "ready", "payment_id": job.payment_id, "payment_url": job.confirmation_url}
+    return {"status": "pending"}
+
+
+def get_payment_status(user_id, reservation_id):
+    """
+    Состояние оплаты брони. Ответ всегда немедленный: веб-воркер не ждёт диспетчер и YooKassa.
+    Пока ссылка готовится, в ответе retry_after и заголовок Retry-After — через сколько секунд спросить снова.
+    """
+    reservation = db.session.get(Reservation, reservation_id)
+    if not reservation or reservation.user_id != user_id:
+        return {"message": "Бронирование не найдено или не принадлежит вам"}, HTTPStatus.NOT_FOUND
+
+    state = _payment_state(reservation)
+    state["reservation_id"] = reservation_id
+    if state["status"] != "pending":
+        return state, HTTPStatus.OK
+    retry_after = current_app.config["PAYMENT_STATUS_RETRY_AFTER"]
+    state["retry_after"] = retry_after
+    return state, HTTPStatus.OK, {"Retry-After": str(retry_after)}
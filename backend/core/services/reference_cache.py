@@ -0,0 +1,137 @@
+import threading
+import time
+
+from flask import current_app, has_app_context
+from sqlalchemy import func
+
+from backend.core import db
+from backend.core.models.auth_models import Role
+from backend.core.models.excursion_models import Category, FormatType, AgeCategory, ExcursionSummary
+
+REFERENCES_KEY = "references"
+EXCURSION_STATS_KEY = "excursion_stats"
+
+# справочник -> (модель, поле с названием, поле с ID)
+REFERENCE_MODELS = {
+    "roles": (Role, "role_name", "role_id"),
+    "categories": (Category, "category_name", "category_id"),
+    "format_types": (FormatType, "format_type_name", "format_type_id"),
+    "age_categories": (AgeCategory, "age_category_name", "age_category_id"),
+}
+
+
+class TTLCache:
+    """Кэш в памяти процесса: значение живёт ttl секунд или до явной инвалидации."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get_or_load(self, key, loader, ttl):
+        entry = self._entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                return entry[1]
+            return self._store(key, loader, ttl)
+
+    def reload(self, key, loader, ttl, min_age):
+        """Перечитывает значение, если оно загружено больше min_age секунд назад, иначе отдаёт текущее."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.monotonic() - entry[2] < min_age:
+                return entry[1]
+            return self._store(key, loader, ttl)
+
+    def _store(self, key, loader, ttl):
+        value = loader()
+        now = time.monotonic()
+        self._entries[key] = (now + ttl, value, now)
+        return value
+
+    def invalidate(self, *keys):
+        with self._lock:
+            for key in keys or list(self._entries):
+                self._entries.pop(key, None)
+
+
+def _cache():
+    return current_app.extensions.setdefault("reference_cache", TTLCache())
+
+
+def _load_references():
+    references = {}
+    for name, (model, name_field, id_field) in REFERENCE_MODELS.items():
+        items = model.query.order_by(getattr(model, id_field)).all()
+        references[name] = {
+            "items": [item.to_dict() for item in items],
+            "ids": {getattr(item, name_field): getattr(item, id_field) for item in items},
+        }
+    return references
+
+
+def _load_excursion_stats():
+    min_cost, max_cost, min_center, max_center, min_time, max_time = db.session.query(
+        func.min(ExcursionSummary.min_cost),
+        func.max(ExcursionSummary.max_cost),
+        func.min(ExcursionSummary.distance_to_center),
+        func.max(ExcursionSummary.distance_to_center),
+        func.min(ExcursionSummary.time_to_nearest_stop),
+        func.max(ExcursionSummary.time_to_nearest_stop)
+    ).filter(ExcursionSummary.is_active.is_(True)).first()
+
+    return {
+        "cost": {
+            "min": float(min_cost) if min_cost is not None else None,
+            "max": float(max_cost) if max_cost is not None else None
+        },
+        "distance_to_center": {
+            "min": round(min_center, 2) if min_center is not None else None,
+            "max": round(max_center, 2) if max_center is not None else None
+        },
+        "time_to_stop": {
+            "min": round(min_time, 2) if min_time is not None else None,
+            "max": round(max_time, 2) if max_time is not None else None
+        },
+    }
+
+
+def _references():
+    return _cache().get_or_load(REFERENCES_KEY, _load_references, current_app.config["REFERENCE_CACHE_TTL"])
+
+
+def get_reference_list(name):
+    return _references()[name]["items"]
+
+
+def get_reference_id(name, value, error_message):
+    """
+    ID записи справочника по названию. При промахе кэш перечитывается (запись могли добавить в другом процессе),
+    но не чаще раза в REFERENCE_MISS_RELOAD_SECONDS — несуществующие названия из запросов не сбрасывают кэш.
+    """
+    reference_id = _references()[name]["ids"].get(value)
+    if reference_id is None:
+        references = _cache().reload(REFERENCES_KEY, _load_references, current_app.config["REFERENCE_CACHE_TTL"],
+                                     current_app.config["REFERENCE_MISS_RELOAD_SECONDS"])
+        reference_id = references[name]["ids"].get(value)
+    if reference_id is None:
+        raise ValueError(error_message)
+    return reference_id
+
+
+def get_excursion_stats():
+    return _cache().get_or_load(
+        EXCURSION_STATS_KEY, _load_excursion_stats, current_app.config["EXCURSION_STATS_CACHE_TTL"]
+    )
+
+
+def invalidate_references():
+    _cache().invalidate(REFERENCES_KEY)
+
+
+def invalidate_excursion_stats():
+    if has_app_context():
+        _cache().invalidate(EXCURSION_STATS_KEY)
@@ -0,0 +1,181 @@
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, case, or_, select, update
+
+from backend.core import db
+from backend.core.models.excursion_models import RefundRequest
+from backend.core.services.yookassa_service import get_yookassa_refund, refund_yookassa_payment
+
+
+def request_refund(payment_id, amount, currency='RUB', reservation_id=None, session_id=None):
+    """Записывает возврат в текущей транзакции; отправляет его submit_refunds или фоновый dispatch_refunds."""
+    refund = RefundRequest(
+        payment_id=payment_id,
+        reservation_id=reservation_id,
+        session_id=session_id,
+        amount=amount,
+        currency=currency or 'RUB',
+        idempotence_key=str(uuid.uuid4()),
+        status=RefundRequest.REQUESTED
+    )
+    db.session.add(refund)
+    return refund
+
+
+def _claimable(now):
+    # submitted с истёкшей арендой — отправка упавшего воркера (повтор с тем же ключом идемпотентности
+    # вернёт уже созданный возврат) или pending-возврат, статус которого пора запросить у YooKassa
+    return or_(
+        and_(RefundRequest.status == RefundRequest.REQUESTED, RefundRequest.next_attempt_at <= now),
+        and_(RefundRequest.status == RefundRequest.SUBMITTED, RefundRequest.locked_until < now)
+    )
+
+
+def claim_refunds(refund_request_ids=None, limit=None, now=None):
+    """Переводит готовые к отправке возвраты в submitted; уже завершённые и чужие в работе пропускаются."""
+    now = now or datetime.now()
+    lease = timedelta(seconds=current_app.config["REFUND_LEASE_SECONDS"])
+    query = select(RefundRequest.refund_request_id).where(_claimable(now)).order_by(RefundRequest.next_attempt_at)
+    if refund_request_ids is not None:
+        query = query.where(RefundRequest.refund_request_id.in_(refund_request_ids))
+    if limit:
+        query = query.limit(limit)
+    candidates = db.session.execute(query).scalars().all()
+
+    claimed = []
+    for refund_request_id in candidates:
+        result = db.session.execute(
+            update(RefundRequest)
+            .where(RefundRequest.refund_request_id == refund_request_id, _claimable(now))
+            .values(status=RefundRequest.SUBMITTED, locked_until=now + lease, updated_at=now,
+                    # перепроверка созданного возврата — не попытка отправки
+                    attempts=case((RefundRequest.provider_refund_id.is_(None), RefundRequest.attempts + 1),
+                                  else_=RefundRequest.attempts))
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 1:
+            claimed.append(refund_request_id)
+    db.session.commit()
+    return claimed
+
+
+def _retry_or_fail(refund, error):
+    refund.last_error = str(error)[:1000]
+    refund.locked_until = None
+    if refund.attempts >= current_app.config["REFUND_MAX_ATTEMPTS"]:
+        refund.status = RefundRequest.FAILED
+    else:
+        refund.status = RefundRequest.REQUESTED
+        refund.next_attempt_at = datetime.now() + timedelta(seconds=min(30 * 2 ** (refund.attempts - 1), 3600))
+    db.session.commit()
+
+
+def _recheck_later(refund, error=None):
+    if error is not None:
+        refund.last_error = str(error)[:1000]
+    refund.locked_until = datetime.now() + timedelta(seconds=current_app.config["REFUND_RECHECK_SECONDS"])
+    db.session.commit()
+
+
+def submit_refund(refund_request_id):
+    """
+    Отправляет возврат в YooKassa. Если возврат уже создан (есть provider_refund_id), его статус
+    запрашивается по id: повторный POST с ключом идемпотентности старше суток создал бы второй возврат.
+    """
+    refund = db.session.get(RefundRequest, refund_request_id)
+    if not refund or refund.status != RefundRequest.SUBMITTED:
+        return
+
+    provider_refund_id = refund.provider_refund_id
+    refund_params = dict(payment_id=refund.payment_id, amount=float(refund.amount), currency=refund.currency,
+                         idempotence_key=refund.idempotence_key)
+    # запрос к YooKassa идёт вне транзакции
+    db.session.commit()
+
+    try:
+        if provider_refund_id:
+            response = get_yookassa_refund(provider_refund_id)
+        else:
+            response = refund_yookassa_payment(**refund_params)
+    except Exception as e:
+        print(f"Ошибка возврата по платежу {refund.payment_id}: {e}")
+        if provider_refund_id:
+            # возврат уже создан: ошибка запроса статуса не повод слать его заново или считать неудачным
+            _recheck_later(refund, e)
+        else:
+            _retry_or_fail(refund, e)
+        return
+
+    refund.provider_refund_id = getattr(response, 'id', None) or refund.provider_refund_id
+    status = getattr(response, 'status', None)
+    if status == 'succeeded':
+        refund.status = RefundRequest.SUCCEEDED
+        refund.locked_until = None
+        refund.last_error = None
+    elif status == 'canceled':
+        details = getattr(response, 'cancellation_details', None)
+        refund.status = RefundRequest.FAILED
+        refund.locked_until = None
+        refund.last_error = f"Возврат отклонён YooKassa: {getattr(details, 'reason', None) or 'причина не указана'}"
+    else:
+        # pending: итог придёт webhook-ом refund.succeeded, а если нет — статус запросится позже
+        _recheck_later(refund)
+        return
+    db.session.commit()
+
+
+def _submit_in_context(app, refund_request_id, on_done):
+    with app.app_context():
+        try:
+            submit_refund(refund_request_id)
+        except Exception as e:
+            db.session.rollback()
+            print(f"Ошибка отправки возврата {refund_request_id}: {e}")
+        if on_done:
+            on_done()
+
+
+def submit_refunds(app, refund_request_ids=None, on_done=None):
+    """
+    Отправляет возвраты пулом из REFUND_CONCURRENCY потоков: массовая отмена занимает примерно время
+    самого долгого возврата, а не сумму всех. Без refund_request_ids обрабатывает всю готовую очередь.
+    on_done вызывается в контексте приложения после каждого возврата.
+    """
+    concurrency = app.config["REFUND_CONCURRENCY"]
+    limit = concurrency * 4 if refund_request_ids is None else None
+    submitted = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while True:
+            with app.app_context():
+                claimed = claim_refunds(refund_request_ids, limit=limit)
+            if not claimed:
+                return submitted
+            list(pool.map(lambda refund_request_id: _submit_in_context(app, refund_request_id, on_done), claimed))
+            submitted += len(claimed)
+            if refund_request_ids is not None:
+                return submitted
+
+
+def dispatch_refunds(app):
+    """Фоновая задача: повторяет возвраты после ошибок и перепроверяет зависшие в pending."""
+    return submit_refunds(app)
+
+
+def mark_refunds_succeeded(payment_id, provider_refund_id=None):
+    """Отмечает возвраты платежа завершёнными по webhook refund.succeeded в текущей транзакции."""
+    values = dict(status=RefundRequest.SUCCEEDED, locked_until=None)
+    condition = RefundRequest.payment_id == payment_id
+    if provider_refund_id:
+        values['provider_refund_id'] = provider_refund_id
+        # id возврата может быть не записан, если воркер упал сразу после ответа YooKassa
+        condition = or_(RefundRequest.provider_refund_id == provider_refund_id,
+                        and_(condition, RefundRequest.provider_refund_id.is_(None)))
+    db.session.execute(
+        update(RefundRequest)
+        .where(condition, RefundRequest.status.in_([RefundRequest.REQUESTED, RefundRequest.SUBMITTED]))
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
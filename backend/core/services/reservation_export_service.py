@@ -0,0 +1,169 @@
+from sqlalchemy import select
+
+from backend.core import db
+from backend.core.models.excursion_models import Excursion, ExcursionSession, Payment, Reservation
+from backend.core.services.excursion_services.analytics_service import parse_analytics_params
+
+PAYMENT_STATUSES = ('pending', 'succeeded', 'canceled', 'refund_pending', 'refunded')
+RESERVATION_STATUSES = ('active', 'cancelled', 'paid', 'unpaid')
+
+# строк на одну выборку с серверного курсора
+_YIELD_PER = 1000
+
+
+def _reservation_columns():
+    return [
+        ('reservation_id', 'ID бронирования', Reservation.reservation_id),
+        ('booked_at', 'Дата бронирования', Reservation.booked_at),
+        ('user_id', 'ID пользователя', Reservation.user_id),
+        ('full_name', 'ФИО', Reservation.full_name),
+        ('email', 'Электронная почта', Reservation.email),
+        ('phone_number', 'Телефон', Reservation.phone_number),
+        ('participants_count', 'Количество участников', Reservation.participants_count),
+        ('excursion_id', 'ID экскурсии', Excursion.excursion_id),
+        ('excursion_title', 'Название экскурсии', Excursion.title),
+        ('place', 'Место экскурсии', Excursion.place),
+        ('session_id', 'ID сессии', ExcursionSession.session_id),
+        ('session_start_datetime', 'Время сессии', ExcursionSession.start_datetime),
+        ('total_cost', 'Общая стоимость', Reservation.participants_count * ExcursionSession.cost),
+        ('is_paid', 'Оплачена', Reservation.is_paid),
+        ('is_cancelled', 'Отменена', Reservation.is_cancelled),
+        ('payment_status', 'Статус платежа', Payment.status),
+    ]
+
+
+def _participant_columns():
+    return [
+        ('session_start_datetime', 'Время сессии', ExcursionSession.start_datetime),
+        ('excursion_title', 'Название экскурсии', Excursion.title),
+        ('place', 'Место экскурсии', Excursion.place),
+        ('session_id', 'ID сессии', ExcursionSession.session_id),
+        ('reservation_id', 'ID бронирования', Reservation.reservation_id),
+        ('full_name', 'ФИО', Reservation.full_name),
+        ('email', 'Электронная почта', Reservation.email),
+        ('phone_number', 'Телефон', Reservation.phone_number),
+        ('participants_count', 'Количество участников', Reservation.participants_count),
+        ('is_paid', 'Оплачена', Reservation.is_paid),
+    ]
+
+
+def _payment_columns():
+    return [
+        ('payment_id', 'ID платежа', Payment.payment_id),
+        ('created_at', 'Дата платежа', Payment.created_at),
+        ('status', 'Статус', Payment.status),
+        ('amount', 'Сумма', Payment.amount),
+        ('currency', 'Валюта', Payment.currency),
+        ('method', 'Способ оплаты', Payment.method),
+        ('email', 'Электронная почта', Payment.email),
+        ('participants_count', 'Количество участников', Payment.participants_count),
+        ('reservation_id', 'ID бронирования', Payment.reservation_id),
+        ('session_id', 'ID сессии', Payment.session_id),
+        ('session_start_datetime', 'Время сессии', ExcursionSession.start_datetime),
+        ('excursion_id', 'ID экскурсии', Excursion.excursion_id),
+        ('excursion_title', 'Название экскурсии', Excursion.title),
+    ]
+
+
+def _reservations_query(columns, filters):
+    query = (
+        select(*columns)
+        .join(ExcursionSession, ExcursionSession.session_id == Reservation.session_id)
+        .join(Excursion, Excursion.excursion_id == ExcursionSession.excursion_id)
+        .outerjoin(Payment, Payment.reservation_id == Reservation.reservation_id)
+    )
+    status = filters.get('status')
+    active = Reservation.is_cancelled.is_(False)
+    if status == 'active':
+        query = query.where(active)
+    elif status == 'cancelled':
+        query = query.where(Reservation.is_cancelled.is_(True))
+    elif status == 'paid':
+        query = query.where(active, Reservation.is_paid.is_(True))
+    elif status == 'unpaid':
+        query = query.where(active, Reservation.is_paid.is_(False))
+    return query
+
+
+def _participants_query(columns, filters):
+    query = (
+        select(*columns)
+        .join(ExcursionSession, ExcursionSession.session_id == Reservation.session_id)
+        .join(Excursion, Excursion.excursion_id == ExcursionSession.excursion_id)
+        .where(Reservation.is_cancelled.is_(False))
+    )
+    if filters.get('status') in ('paid', 'unpaid'):
+        query = query.where(Reservation.is_paid.is_(filters['status'] == 'paid'))
+    return query
+
+
+def _payments_query(columns, filters):
+    query = (
+        select(*columns)
+        .outerjoin(ExcursionSession, ExcursionSession.session_id == Payment.session_id)
+        .outerjoin(Excursion, Excursion.excursion_id == ExcursionSession.excursion_id)
+    )
+    if filters.get('status'):
+        query = query.where(Payment.status == filters['status'])
+    return query
+
+
+# вид выгрузки: (колонки, запрос, колонка фильтра по датам, порядок, допустимые статусы, название листа)
+EXPORTS = {
+    'reservations': (_reservation_columns, _reservations_query, Reservation.booked_at,
+                     Reservation.reservation_id, RESERVATION_STATUSES, 'Бронирования'),
+    'participants': (_participant_columns, _participants_query, ExcursionSession.start_datetime,
+                     (ExcursionSession.start_datetime, Reservation.reservation_id), ('paid', 'unpaid'), 'Участники'),
+    'payments': (_payment_columns, _payments_query, Payment.created_at,
+                 Payment.created_at, PAYMENT_STATUSES, 'Платежи'),
+}
+
+
+def parse_export_filters(kind, args):
+    """Фильтры выгрузки из параметров запроса: start_date, end_date, excursion_id, status. ValueError при ошибке."""
+    if kind not in EXPORTS:
+        raise ValueError("Неизвестный вид выгрузки")
+    start, end, _ = parse_analytics_params({key: args.get(key) for key in ('start_date', 'end_date')})
+    status = args.get('status') or None
+    if status is not None and status not in EXPORTS[kind][4]:
+        raise ValueError(f"status должен быть одним из: {', '.join(EXPORTS[kind][4])}")
+    excursion_id = args.get('excursion_id')
+    if excursion_id is not None and not excursion_id.isdigit():
+        raise ValueError("excursion_id должен быть числом")
+    return {
+        'start': start,
+        'end': end,
+        'excursion_id': int(excursion_id) if excursion_id else None,
+        'status': status,
+    }
+
+
+def export_rows(kind, filters):
+    """
+    Заголовки, имена полей и генератор строк выгрузки. Строки читаются одним плоским SELECT
+    с серверного курсора порциями по _YIELD_PER, без загрузки ORM-объектов и их связей.
+    """
+    build_columns, build_query, date_column, order_by, _, _ = EXPORTS[kind]
+    columns = build_columns()
+    query = build_query([column.label(key) for key, _, column in columns], filters)
+    if filters.get('start') is not None:
+        query = query.where(date_column >= filters['start'])
+    if filters.get('end') is not None:
+        query = query.where(date_column <= filters['end'])
+    if filters.get('excursion_id') is not None:
+        query = query.where(Excursion.excursion_id == filters['excursion_id'])
+    query = query.order_by(*(order_by if isinstance(order_by, tuple) else (order_by,)))
+
+    def rows():
+        result = db.session.execute(query.execution_options(stream_results=True, yield_per=_YIELD_PER))
+        try:
+            for row in result:
+                yield tuple(row)
+        finally:
+            result.close()
+
+    return [title for _, title, _ in columns], [key for key, _, _ in columns], rows()
+
+
+def export_sheet_title(kind):
+    return EXPORTS[kind][5]
@@ -1,13 +1,18 @@
 from http import HTTPStatus
 
-from sqlalchemy import func
+from flask import current_app
+from sqlalchemy.orm import contains_eager, joinedload
 
 from backend.core import db
 from backend.core.models.excursion_models import Reservation, ExcursionSession, Payment
 from backend.core.services.email_service import send_reservation_confirmation_email, send_reservation_refund_email, \
     send_reservation_cancellation_email
+from backend.core.services.excursion_services.analytics_service import parse_analytics_params
+from backend.core.services.excursion_services.seat_service import reserve_seats, expire_seat_holds, hold_expiry
+from backend.core.services.pagination import build_sort_keys, count_total, paginate_keyset
+from backend.core.services.payment_outbox_service import enqueue_payment
 from backend.core.services.user_services.auth_service import get_user_by_email
-from backend.core.services.yookassa_service import create_yookassa_payment, refund_yookassa_payment
+from backend.core.services.yookassa_service import refund_yookassa_payment
 
 
 def get_reservations_by_user_email(email):
@@ -31,16 +36,19 @@ def create_reservation_with_payment(user_email, session_id, full_name, phone_num
     if not session_id:
         return {"message": "session_id is required"}, HTTPStatus.BAD_REQUEST
 
+    if not isinstance(participants_count, int) or isinstance(participants_count, bool) or participants_count < 1:
+        return {"message": "participants_count должен быть положительным целым числом"}, HTTPStatus.BAD_REQUEST
+
     session = db.session.get(ExcursionSession, session_id)
     if not session:
         return {"message": "Сеанс не найден"}, HTTPStatus.NOT_FOUND
 
-    existing_participants = db.session.query(
-        func.coalesce(func.sum(Reservation.participants_count), 0)
-    ).filter_by(session_id=session_id, is_cancelled=False, is_paid=True).scalar()
-
-    if existing_participants + participants_count > session.max_participants:
-        return {"message": "Недостаточно свободных мест"}, HTTPStatus.BAD_REQUEST
+    # места занимаются условным UPDATE в той же транзакции, что и вставка брони;
+    # если их не хватает, сначала освобождаются просроченные удержания этого сеанса
+    if not reserve_seats(session_id, participants_count):
+        if not (expire_seat_holds(session_id=session_id) and reserve_seats(session_id, participants_count)):
+            db.session.rollback()
+            return {"message": "Недостаточно свободных мест"}, HTTPStatus.BAD_REQUEST
 
     amount = session.cost * participants_count
 
@@ -60,7 +68,9 @@ def create_reservation_with_payment(user_email, session_id, full_name, phone_num
 
         try:
             send_reservation_confirmation_email(reservation, user)
+            db.session.commit()
         except Exception as e:
+            db.session.rollback()
             print(f"Ошибка при отправке письма: {e}")
 
         return {
@@ -76,42 +86,21 @@ def create_reservation_with_payment(user_email, session_id, full_name, phone_num
         email=email,
         participants_count=participants_count,
         is_paid=False,
-        is_cancelled=False
+        is_cancelled=False,
+        hold_expires_at=hold_expiry()
     )
     db.session.add(reservation)
-    db.session.commit()
-
-    payment_response = create_yookassa_payment(
-        amount=amount,
-        email=user_email,
-        description=f"Оплата экскурсии «{session.excursion.title}» на {session.start_datetime}",
-        quantity=participants_count,
-        metadata={
-            "reservation_id": reservation.reservation_id,
-            "session_id": session_id,
-            "email": user_email
-        }
-    )
-
-    payment = Payment(
-        payment_id=payment_response.id,
-        session_id=session_id,
-        reservation_id=reservation.reservation_id,
-        participants_count=participants_count,
-        email=user_email,
-        amount=amount,
-        currency='RUB',
-        status=payment_response.status,
-        method=payment_response.payment_method.type
-    )
-    db.session.add(payment)
+    # платёж создаёт фоновый диспетчер: бронь и задание на платёж фиксируются одной транзакцией,
+    # а веб-воркер не ждёт ответа YooKassa
+    enqueue_payment(reservation)
     db.session.commit()
 
     return {
-        "message": "Перейдите по ссылке для оплаты",
-        "payment_id": payment.payment_id,
-        "payment_url": payment_response.confirmation.confirmation_url
-    }, HTTPStatus.CREATED
+        "message": "Бронирование создано, ссылка на оплату готовится",
+        "reservation_id": reservation.reservation_id,
+        "status": "pending",
+        "status_url": f"/api/user/v2/reservations/{reservation.reservation_id}/payment"
+    }, HTTPStatus.ACCEPTED
 
 
 def cancel_user_reservation(user_email, reservation_id):
@@ -146,7 +135,9 @@ def cancel_user_reservation(user_email, reservation_id):
 
     try:
         send_reservation_refund_email(reservation)
+        db.session.commit()
     except Exception as e:
+        db.session.rollback()
         print(f"Ошибка отправки email: {e}")
 
     if refund_done:
@@ -190,13 +181,90 @@ def delete_reservation_with_refund(reservation_id):
     return True, "Бронирование успешно удалено", 200
 
 
-def get_all_reservations():
-    reservations = Reservation.query.all()
+RESERVATION_SORTS = {
+    'booked_at': (Reservation.booked_at, False),
+    'session_start': (ExcursionSession.start_datetime, False),
+    'participants_count': (Reservation.participants_count, False),
+}
+
+
+def _parse_id(value, name):
+    if value in (None, ""):
+        return None
+    if not str(value).isdigit():
+        raise ValueError(f"{name} должен быть числом")
+    return int(value)
+
+
+def _filtered_reservations(filters):
+    """Брони с фильтрами status, paid, session_id, excursion_id, start_date и end_date (по дате брони)."""
+    query = Reservation.query.join(Reservation.session)
+    status = filters.get('status')
+    if status not in (None, "", 'active', 'cancelled'):
+        raise ValueError("status должен быть active или cancelled")
+    if status:
+        query = query.filter(Reservation.is_cancelled.is_(status == 'cancelled'))
+    paid = filters.get('paid')
+    if paid not in (None, "", 'true', 'false'):
+        raise ValueError("paid должен быть true или false")
+    if paid:
+        query = query.filter(Reservation.is_paid.is_(paid == 'true'))
+    session_id = _parse_id(filters.get('session_id'), 'session_id')
+    if session_id is not None:
+        query = query.filter(Reservation.session_id == session_id)
+    excursion_id = _parse_id(filters.get('excursion_id'), 'excursion_id')
+    if excursion_id is not None:
+        query = query.filter(ExcursionSession.excursion_id == excursion_id)
+    start, end, _ = parse_analytics_params({key: filters.get(key) for key in ('start_date', 'end_date')})
+    if start is not None:
+        query = query.filter(Reservation.booked_at >= start)
+    if end is not None:
+        query = query.filter(Reservation.booked_at <= end)
+    return query
+
+
+def _with_related(query):
+    # сеанс уже присоединён для фильтров; экскурсия и платёж подгружаются тем же запросом
+    return query.options(contains_eager(Reservation.session).joinedload(ExcursionSession.excursion),
+                         joinedload(Reservation.payment))
+
+
+def get_all_reservations(filters=None, sort=None):
+    filters = filters or {}
+    sort_keys, _ = build_sort_keys(sort, RESERVATION_SORTS, Reservation.reservation_id, default="-booked_at")
+    query = _with_related(_filtered_reservations(filters))
+    reservations = query.order_by(*[clause for key in sort_keys for clause in key.order_by()]).all()
     return [r.to_dict() for r in reservations]
 
 
+def list_reservations_page(filters, sort, limit, cursor=None):
+    """Страница броней по курсору (по умолчанию новые сначала) и общее число броней с этими фильтрами."""
+    query = _filtered_reservations(filters)
+    sort_keys, sort_signature = build_sort_keys(sort, RESERVATION_SORTS, Reservation.reservation_id,
+                                                default="-booked_at")
+    reservations, next_cursor = paginate_keyset(_with_related(query), sort_keys, sort_signature, limit, cursor)
+    total, estimated = count_total(query, current_app.config["ADMIN_EXACT_COUNT_LIMIT"])
+    return reservations, next_cursor, total, estimated
+
+
 def get_reservation_by_id(reservation_id):
     reservation = Reservation.query.get(reservation_id)
     if not reservation:
         return None
     return reservation.to_dict_detailed()
+
+
+def refund_late_payment(payment_id, payment_object):
+    """Возврат оплаты, пришедшей после истечения удержания, когда мест на сеансе уже нет."""
+    amount = payment_object.get("amount", {})
+    try:
+        refund_yookassa_payment(payment_id, float(amount.get("value", 0)), amount.get("currency", "RUB"))
+    except Exception as e:
+        print(f"Ошибка возврата поздней оплаты {payment_id}: {e}")
+        return {"message": "Не удалось вернуть оплату"}, HTTPStatus.INTERNAL_SERVER_ERROR
+
+    payment = Payment.query.filter_by(payment_id=payment_id).first()
+    if payment:
+        payment.status = "refunded"
+        db.session.commit()
+    return {"message": "Места закончились, оплата возвращена"}, HTTPStatus.OK
@@ -0,0 +1,120 @@
+from datetime import datetime
+
+from flask import request, Response
+from sqlalchemy import event, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from backend.core import db
+from backend.core.models.excursion_models import ExcursionSummary
+from backend.core.models.news_models import News, NewsImage
+from backend.core.models.system_models import ResourceVersion
+from backend.core.services.response_cache import get_response_cache
+
+CATALOG = "catalog"
+NEWS = "news"
+
+# модели, изменения которых меняют публичное представление ресурса; у каталога и экскурсий
+# отдельного счётчика нет — версия берётся из updated_at сводок (excursion_summary_service)
+_TRACKED_MODELS = {
+    News: NEWS,
+    NewsImage: NEWS,
+}
+
+_PENDING = "changed_resources"
+
+
+def bump_version(name, session=None):
+    """Увеличивает версию ресурса в текущей транзакции; коммит остаётся за вызывающим кодом."""
+    session = session or db.session
+    now = datetime.now()
+    result = session.execute(
+        update(ResourceVersion)
+        .where(ResourceVersion.name == name)
+        .values(version=ResourceVersion.version + 1, updated_at=now)
+    )
+    if result.rowcount:
+        return
+
+    try:
+        with session.begin_nested():
+            session.execute(insert(ResourceVersion).values(name=name, version=1, updated_at=now))
+    except IntegrityError:
+        # строку одновременно создала другая транзакция
+        session.execute(
+            update(ResourceVersion)
+            .where(ResourceVersion.name == name)
+            .values(version=ResourceVersion.version + 1, updated_at=now)
+        )
+
+
+def get_version(name):
+    """Версия ресурса со счётчиком в resource_versions (новости)."""
+    version = db.session.execute(select(ResourceVersion.version).where(ResourceVersion.name == name)).scalar()
+    return f"{name}-{version or 0}"
+
+
+def _timestamp(value):
+    return value.strftime("%Y%m%d%H%M%S%f") if value else "0"
+
+
+def catalog_version():
+    """
+    Версия каталога по сводкам экскурсий: пересчёт сводки обновляет её updated_at, удаление экскурсии
+    меняет число строк. Общей строки-счётчика, которую обновляла бы каждая бронь, нет.
+    """
+    count, updated_at = db.session.execute(
+        select(func.count(), func.max(ExcursionSummary.updated_at)).select_from(ExcursionSummary)
+    ).one()
+    return f"{CATALOG}-{count}-{_timestamp(updated_at)}"
+
+
+def excursion_version(excursion_id):
+    """Версия одной экскурсии — бронь на сеанс другой экскурсии её не меняет."""
+    updated_at = db.session.execute(
+        select(ExcursionSummary.updated_at).where(ExcursionSummary.excursion_id == excursion_id)
+    ).scalar()
+    return f"excursion-{excursion_id}-{_timestamp(updated_at)}"
+
+
+def conditional_get(etag, build_response, cache_key=None):
+    """
+    Отвечает 304 по If-None-Match до построения тела ответа; etag — версия ресурса (get_version,
+    catalog_version, excursion_version). Last-Modified не отдаётся: If-Modified-Since с точностью
+    до секунды давал бы 304 на второе изменение в ту же секунду.
+    build_response возвращает (данные, статус); ETag добавляется только к успешным ответам.
+    С cache_key тело берётся из общего кэша ответов: версия ресурса входит в ключ,
+    поэтому любое изменение ресурса само делает старые записи недоступными.
+    """
+    headers = {"ETag": f'W/"{etag}"', "Cache-Control": "no-cache"}
+    if request.if_none_match.contains_weak(etag):
+        return Response(status=304, headers=headers)
+
+    response_cache = get_response_cache() if cache_key is not None else None
+    if response_cache is not None:
+        data, status = response_cache.get_or_build(f"{etag}:{cache_key}", build_response)
+    else:
+        data, status = build_response()
+    if status != 200:
+        return data, status
+    return data, status, headers
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_changed_resources(session, flush_context, instances):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        name = _TRACKED_MODELS.get(type(obj))
+        if name:
+            session.info.setdefault(_PENDING, set()).add(name)
+
+
+@event.listens_for(Session, "before_commit")
+def _bump_changed_resources(session):
+    session.flush()
+    for name in sorted(session.info.pop(_PENDING, ())):
+        bump_version(name, session=session)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changed_resources(session):
+    session.info.pop(_PENDING, None)
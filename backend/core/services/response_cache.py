@@ -0,0 +1,261 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from flask import current_app
+
+try:
+    import redis
+except ImportError:  # redis — необязательная зависимость, нужна только для RESPONSE_CACHE_BACKEND=redis
+    redis = None
+
+_LOCK_POLL_INTERVAL = 0.02
+
+
+class MemoryBackend:
+    """LRU в памяти процесса: общий для потоков одного воркера."""
+
+    def __init__(self, max_entries=512):
+        self._max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = [threading.Lock() for _ in range(64)]
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    @contextmanager
+    def lock(self, key, timeout):
+        key_lock = self._key_locks[hash(key) % len(self._key_locks)]
+        acquired = key_lock.acquire(timeout=timeout)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                key_lock.release()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class FilesystemBackend:
+    """Файлы в общем каталоге: кэш разделяется всеми воркерами на одной машине."""
+
+    _PRUNE_EVERY = 100
+
+    def __init__(self, directory):
+        self._directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._writes = 0
+
+    def _path(self, key, suffix):
+        return os.path.join(self._directory, hashlib.sha256(key.encode("utf-8")).hexdigest() + suffix)
+
+    def get(self, key):
+        path = self._path(key, ".cache")
+        try:
+            with open(path, "rb") as f:
+                expires_at = float(f.readline())
+                value = f.read()
+        except (OSError, ValueError):
+            return None
+        if expires_at <= time.time():
+            self._remove(path)
+            return None
+        return value
+
+    def set(self, key, value, ttl):
+        path = self._path(key, ".cache")
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(f"{time.time() + ttl}\n".encode("ascii"))
+            f.write(value)
+        os.replace(tmp_path, path)
+
+        self._writes += 1
+        if self._writes % self._PRUNE_EVERY == 0:
+            self._prune()
+
+    @contextmanager
+    def lock(self, key, timeout):
+        # O_EXCL-файл работает между процессами и на всех платформах, в отличие от fcntl
+        path = self._path(key, ".lock")
+        deadline = time.time() + timeout
+        acquired = False
+        while True:
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                acquired = True
+                break
+            except FileExistsError:
+                if self._is_stale_lock(path, timeout):
+                    self._remove(path)
+                    continue
+                if time.time() >= deadline:
+                    break
+                time.sleep(_LOCK_POLL_INTERVAL)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                self._remove(path)
+
+    @staticmethod
+    def _is_stale_lock(path, timeout):
+        try:
+            return os.path.getmtime(path) < time.time() - timeout
+        except OSError:
+            return False
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _prune(self):
+        now = time.time()
+        for name in os.listdir(self._directory):
+            path = os.path.join(self._directory, name)
+            if name.endswith(".cache"):
+                try:
+                    with open(path, "rb") as f:
+                        expired = float(f.readline()) <= now
+                except (OSError, ValueError):
+                    expired = True
+                if expired:
+                    self._remove(path)
+
+    def clear(self):
+        for name in os.listdir(self._directory):
+            self._remove(os.path.join(self._directory, name))
+
+
+class RedisBackend:
+    """Любой сервер с протоколом Redis (redis, valkey, keydb), в том числе локальный."""
+
+    _RELEASE_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+    def __init__(self, url, prefix="ukno:response:"):
+        if redis is None:
+            raise RuntimeError("Для RESPONSE_CACHE_BACKEND=redis установите пакет redis")
+        self._client = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    def get(self, key):
+        return self._client.get(self._prefix + key)
+
+    def set(self, key, value, ttl):
+        self._client.set(self._prefix + key, value, ex=max(int(ttl), 1))
+
+    @contextmanager
+    def lock(self, key, timeout):
+        lock_key = f"{self._prefix}lock:{key}"
+        token = uuid.uuid4().hex
+        deadline = time.time() + timeout
+        acquired = False
+        while True:
+            if self._client.set(lock_key, token, nx=True, px=int(timeout * 1000)):
+                acquired = True
+                break
+            if time.time() >= deadline or self.get(key) is not None:
+                break
+            time.sleep(_LOCK_POLL_INTERVAL)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                self._client.eval(self._RELEASE_SCRIPT, 1, lock_key, token)
+
+    def clear(self):
+        for key in self._client.scan_iter(match=self._prefix + "*"):
+            self._client.delete(key)
+
+
+class ResponseCache:
+    def __init__(self, backend, ttl=300, lock_timeout=10):
+        self.backend = backend
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+
+    def get_or_build(self, key, build_response):
+        """
+        Возвращает (данные, статус) из кэша или строит ответ. Пока один запрос строит ответ для ключа,
+        остальные ждут его результата, а не идут в БД сами. Кэшируются только ответы 200.
+        """
+        cached = self.backend.get(key)
+        if cached is not None:
+            return json.loads(cached), 200
+
+        with self.backend.lock(key, self.lock_timeout):
+            cached = self.backend.get(key)
+            if cached is not None:
+                return json.loads(cached), 200
+
+            data, status = build_response()
+            if status == 200:
+                self.backend.set(key, json.dumps(data, ensure_ascii=False).encode("utf-8"), self.ttl)
+            return data, status
+
+
+def create_response_cache(config):
+    backend_name = config.get("RESPONSE_CACHE_BACKEND", "memory")
+    if backend_name == "none":
+        return None
+    if backend_name == "memory":
+        backend = MemoryBackend(config.get("RESPONSE_CACHE_MAX_ENTRIES", 512))
+    elif backend_name == "filesystem":
+        backend = FilesystemBackend(config["RESPONSE_CACHE_DIR"])
+    elif backend_name == "redis":
+        backend = RedisBackend(config["RESPONSE_CACHE_REDIS_URL"])
+    else:
+        raise ValueError(f"Неизвестный RESPONSE_CACHE_BACKEND: {backend_name}")
+    return ResponseCache(backend, ttl=config.get("RESPONSE_CACHE_TTL", 300))
+
+
+def get_response_cache():
+    if "response_cache" not in current_app.extensions:
+        current_app.extensions["response_cache"] = create_response_cache(current_app.config)
+    return current_app.extensions["response_cache"]
+
+
+def normalize_params(args, params, list_params=(), ordered_params=()):
+    """
+    Ключ кэша из параметров, которые обработчик действительно читает (params), и так, как он их читает:
+    берётся только первое значение (args.get). Значения-списки через запятую (list_params) сортируются
+    без повторов, в ordered_params (например, sort) порядок сохраняется; прочие значения — как есть.
+    """
+    normalized = []
+    for name in sorted(set(params)):
+        value = args.get(name)
+        if value is None:
+            continue
+        if name in list_params or name in ordered_params:
+            parts = [part.strip() for part in value.split(",") if part.strip()]
+            if not parts:
+                continue
+            value = ",".join(parts if name in ordered_params else sorted(set(parts)))
+        normalized.append(f"{name}={value}")
+    return "&".join(normalized)
@@ -0,0 +1,247 @@
+import atexit
+import os
+import socket
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta
+
+from apscheduler.schedulers.background import BackgroundScheduler
+from sqlalchemy import or_, text, update
+from sqlalchemy.exc import IntegrityError
+
+from backend.core import db
+from backend.core.models.system_models import ScheduledJobState, SchedulerLease
+from backend.core.scripts.clear_unpaid import cleanup_unpaid_reservations
+from backend.core.scripts.create_session_from_recurring import create_sessions_from_recurring
+from backend.core.services.email_outbox_service import deliver_queued_emails
+from backend.core.services.excursion_services.booking_rollup_service import refresh_booking_rollups
+from backend.core.services.excursion_services.cancellation_service import run_cancellation_jobs
+from backend.core.services.excursion_services.excursion_summary_service import refresh_stale_excursion_summaries
+from backend.core.services.excursion_services.seat_service import reconcile_seat_counters
+from backend.core.services.payment_outbox_service import dispatch_payment_outbox
+from backend.core.services.refund_service import dispatch_refunds
+from backend.core.services.webhook_service import drain_webhook_events
+
+LEADER_LEASE = "scheduler"
+# ключ advisory-блокировки PostgreSQL, общий для всех процессов приложения
+ADVISORY_LOCK_KEY = zlib.crc32(b"ukno-web:scheduler")
+
+
+class LeaderElection:
+    """
+    Выбирает один процесс, который выполняет периодические задачи, среди всех воркеров и узлов.
+    На PostgreSQL лидер держит advisory-блокировку на отдельном соединении: если процесс упадёт,
+    блокировка снимется вместе с соединением. На SQLite лидер продлевает аренду в scheduler_leases.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.lease_seconds = app.config["SCHEDULER_LEASE_SECONDS"]
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._connection = None
+        self._leader_until = None
+        self._lock = threading.Lock()
+
+    def is_leader(self):
+        return self._leader_until is not None and self._leader_until > datetime.now()
+
+    def heartbeat(self):
+        with self._lock, self.app.app_context():
+            try:
+                if db.engine.dialect.name == "postgresql":
+                    leader = self._hold_advisory_lock()
+                else:
+                    leader = self._renew_lease()
+            except Exception as e:
+                db.session.rollback()
+                print(f"Ошибка выбора лидера планировщика: {e}")
+                leader = False
+            self._leader_until = datetime.now() + timedelta(seconds=self.lease_seconds) if leader else None
+            return leader
+
+    def _hold_advisory_lock(self):
+        if self._connection is not None:
+            try:
+                self._connection.execute(text("SELECT 1"))
+                self._connection.commit()
+                return True
+            except Exception:
+                # соединение потеряно — вместе с ним потеряна и блокировка
+                self._close_connection()
+
+        connection = db.engine.connect()
+        acquired = connection.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": ADVISORY_LOCK_KEY}).scalar()
+        # завершаем транзакцию, чтобы соединение не висело idle in transaction; блокировка сессионная
+        connection.commit()
+        if not acquired:
+            connection.close()
+            return False
+        self._connection = connection
+        return True
+
+    def _renew_lease(self):
+        now = datetime.now()
+        locked_until = now + timedelta(seconds=self.lease_seconds)
+        renewed = db.session.execute(
+            update(SchedulerLease)
+            .where(SchedulerLease.name == LEADER_LEASE,
+                   or_(SchedulerLease.holder == self.holder, SchedulerLease.locked_until < now))
+            .values(holder=self.holder, locked_until=locked_until)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if renewed:
+            db.session.commit()
+            return True
+        if db.session.get(SchedulerLease, LEADER_LEASE) is not None:
+            db.session.rollback()
+            return False
+        try:
+            db.session.add(SchedulerLease(name=LEADER_LEASE, holder=self.holder, locked_until=locked_until))
+            db.session.commit()
+            return True
+        except IntegrityError:
+            db.session.rollback()
+            return False
+
+    def _close_connection(self):
+        try:
+            self._connection.close()
+        except Exception:
+            pass
+        self._connection = None
+
+    def release(self):
+        with self._lock, self.app.app_context():
+            self._leader_until = None
+            if self._connection is not None:
+                self._close_connection()
+                return
+            try:
+                db.session.execute(
+                    update(SchedulerLease)
+                    .where(SchedulerLease.name == LEADER_LEASE, SchedulerLease.holder == self.holder)
+                    .values(locked_until=datetime.now())
+                    .execution_options(synchronize_session=False)
+                )
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+
+
+def _record_start(name, holder, started_at):
+    state = db.session.get(ScheduledJobState, name)
+    if state is None:
+        state = ScheduledJobState(name=name)
+        db.session.add(state)
+    state.last_holder = holder
+    state.last_started_at = started_at
+    state.run_count = (state.run_count or 0) + 1
+    db.session.commit()
+
+
+def _record_finish(name, duration_ms, error=None):
+    state = db.session.get(ScheduledJobState, name)
+    state.last_finished_at = datetime.now()
+    state.last_duration_ms = duration_ms
+    if error is None:
+        state.last_success_at = state.last_finished_at
+        state.last_error = None
+    else:
+        state.last_error = error[:1000]
+        state.failure_count = (state.failure_count or 0) + 1
+    db.session.commit()
+
+
+def run_scheduled_job(app, election, name, func):
+    """Выполняет задачу, только если этот процесс — лидер, и записывает длительность и результат запуска."""
+    if not election.is_leader():
+        return False
+    with app.app_context():
+        started = time.monotonic()
+        try:
+            _record_start(name, election.holder, datetime.now())
+        except Exception as e:
+            db.session.rollback()
+            print(f"Не удалось записать запуск задачи {name}: {e}")
+        error = None
+        try:
+            func(app)
+        except Exception as e:
+            db.session.rollback()
+            print(f"Ошибка периодической задачи {name}: {e}")
+            error = str(e) or e.__class__.__name__
+        try:
+            _record_finish(name, int((time.monotonic() - started) * 1000), error)
+        except Exception as e:
+            db.session.rollback()
+            print(f"Не удалось записать результат задачи {name}: {e}")
+    return error is None
+
+
+def get_scheduler_status():
+    """Последние запуски периодических задач; на SQLite — ещё и текущая аренда лидерства."""
+    lease = db.session.get(SchedulerLease, LEADER_LEASE)
+    leader = None
+    if lease is not None and lease.locked_until > datetime.now():
+        leader = {"holder": lease.holder, "locked_until": lease.locked_until.isoformat()}
+    jobs = ScheduledJobState.query.order_by(ScheduledJobState.name).all()
+    return {"leader": leader, "jobs": [job.to_dict() for job in jobs]}
+
+
+def scheduled_jobs(app):
+    """Периодические задачи: (имя, функция от app, параметры интервала APScheduler). Выполняются в контексте app."""
+    config = app.config
+    jobs = [
+        ("cleanup_unpaid_reservations", lambda _: cleanup_unpaid_reservations(), {"minutes": 5}),
+        # первый запуск сразу — заполняет сводки для экскурсий, созданных до появления таблицы
+        ("refresh_excursion_summaries", lambda _: refresh_stale_excursion_summaries(),
+         {"minutes": 1, "next_run_time": datetime.now()}),
+        ("reconcile_seat_counters", lambda _: reconcile_seat_counters(),
+         {"hours": 1, "next_run_time": datetime.now()}),
+        ("create_sessions_from_recurring", lambda _: create_sessions_from_recurring(),
+         {"hours": 1, "next_run_time": datetime.now()}),
+        # при первом запуске без отметки сводки собираются по всей истории
+        ("refresh_booking_rollups", lambda _: refresh_booking_rollups(),
+         {"seconds": config["BOOKING_ROLLUP_POLL_SECONDS"], "next_run_time": datetime.now()}),
+        # платежи YooKassa создаются здесь, а не в обработчике запроса
+        ("dispatch_payment_outbox", dispatch_payment_outbox, {"seconds": config["PAYMENT_OUTBOX_POLL_SECONDS"]}),
+        ("run_cancellation_jobs", run_cancellation_jobs, {"seconds": config["CANCELLATION_JOB_POLL_SECONDS"]}),
+        # повторы возвратов после ошибок и перепроверка возвратов в pending
+        ("dispatch_refunds", dispatch_refunds, {"seconds": config["REFUND_POLL_SECONDS"]}),
+        ("deliver_queued_emails", deliver_queued_emails, {"seconds": config["EMAIL_POLL_SECONDS"]}),
+    ]
+    if config["WEBHOOK_QUEUE_MODE"]:
+        jobs.append(("drain_webhook_events", drain_webhook_events, {"seconds": config["WEBHOOK_POLL_SECONDS"]}))
+    return jobs
+
+
+def start_scheduler(app):
+    """
+    Запускает планировщик в этом процессе. Он есть в каждом воркере, но задачи выполняет только лидер,
+    остальные раз в SCHEDULER_HEARTBEAT_SECONDS пробуют перехватить лидерство. Возвращает None,
+    если SCHEDULER_ENABLED выключен.
+    """
+    if not app.config["SCHEDULER_ENABLED"]:
+        return None
+
+    election = LeaderElection(app)
+    election.heartbeat()
+
+    scheduler = BackgroundScheduler()
+    scheduler.add_job(election.heartbeat, "interval", seconds=app.config["SCHEDULER_HEARTBEAT_SECONDS"],
+                      max_instances=1, coalesce=True)
+    for name, func, interval in scheduled_jobs(app):
+        # max_instances=1 — в процессе-лидере задача не перекрывается сама с собой
+        scheduler.add_job(run_scheduled_job, "interval", args=(app, election, name, func), id=name,
+                          max_instances=1, coalesce=True, **interval)
+    scheduler.start()
+
+    def shutdown():
+        scheduler.shutdown()
+        # лидерство освобождается сразу, не дожидаясь истечения аренды
+        election.release()
+
+    atexit.register(shutdown)
+    return scheduler
@@ -1,9 +1,13 @@
 from http import HTTPStatus
 
+from flask import current_app
 from flask_jwt_extended import create_access_token, get_jwt_identity
+from sqlalchemy.orm import contains_eager
 
 from backend.core import db
 from backend.core.models.auth_models import User, Role
+from backend.core.services.excursion_services.excursion_search import escape_like
+from backend.core.services.pagination import build_sort_keys, count_total, paginate_keyset
 
 
 def get_user_by_email(email):
@@ -14,14 +18,35 @@ def get_role_by_name(role_name):
     return Role.query.filter_by(role_name=role_name).first()
 
 
-def get_all_users(role=None):
-    query = User.query
+USER_SORTS = {
+    'email': (User.email, False),
+    'full_name': (User.full_name, False),
+}
 
-    if role:
-        query = query.filter(User.role.has(role_name=role))
 
-    users = query.all()
-    return users
+def _filtered_users(role=None, email_prefix=None):
+    query = User.query.join(User.role)
+    if role:
+        query = query.filter(Role.role_name == role)
+    if email_prefix:
+        query = query.filter(User.email.like(f"{escape_like(email_prefix)}%", escape="\\"))
+    return query
+
+
+def get_all_users(role=None, email_prefix=None, sort=None):
+    sort_keys, _ = build_sort_keys(sort, USER_SORTS, User.user_id)
+    query = _filtered_users(role, email_prefix).options(contains_eager(User.role))
+    return query.order_by(*[clause for key in sort_keys for clause in key.order_by()]).all()
+
+
+def list_users_page(role, email_prefix, sort, limit, cursor=None):
+    """Страница пользователей по курсору (по умолчанию по email) и их общее число с этими фильтрами."""
+    query = _filtered_users(role, email_prefix)
+    sort_keys, sort_signature = build_sort_keys(sort, USER_SORTS, User.user_id, default="email")
+    users, next_cursor = paginate_keyset(query.options(contains_eager(User.role)), sort_keys, sort_signature,
+                                         limit, cursor)
+    total, estimated = count_total(query, current_app.config["ADMIN_EXACT_COUNT_LIMIT"])
+    return users, next_cursor, total, estimated
 
 
 def create_user(email, password, full_name, phone, role_name):
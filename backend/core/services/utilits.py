@@ -1,19 +1,16 @@
 import os
 import re
-import threading
 import uuid
 from datetime import datetime
-from io import BytesIO
 
 from flask import current_app
-from flask_mail import Message
 from itsdangerous import URLSafeTimedSerializer
-from openpyxl import Workbook
-from openpyxl.utils import get_column_letter
 from werkzeug.utils import secure_filename
 
-from backend.core import mail
+from backend.core import db
 from backend.core.config import Config
+from backend.core.services.email_outbox_service import queue_email
+from backend.core.services.export_service import export_bytes
 
 UPLOAD_FOLDER = Config.UPLOAD_FOLDER
 
@@ -54,40 +51,19 @@ def is_valid_email(email):
     return bool(re.match(r"[^@]+@[^@]+\.[^@]+", email))
 
 
-def send_async_email(app, msg):
-    with app.app_context():
-        try:
-            mail.send(msg)
-        except Exception as e:
-            print(f"Ошибка при отправке email: {e}")
-
-
-def send_email(subject, recipient, body, body_html=None, attachments=None):
+def send_email(subject, recipient, body, body_html=None, attachments=None, commit=False):
+    """
+    Ставит письмо в очередь отправки; отправляет фоновый обработчик email_outbox_service.
+    Письмо фиксируется вместе с остальными изменениями вызывающего кода, коммит — за ним;
+    commit=True коммитит сразу (и всё, что уже есть в сессии).
+    """
     if not recipient or not is_valid_email(recipient):
         print(f"Попытка отправить email на невалидный адрес: {recipient}")
         return
 
-    msg = Message(
-        subject=subject,
-        recipients=[recipient],
-        body=body,
-        html=body_html
-    )
-
-    if attachments:
-        for attachment in attachments:
-            if isinstance(attachment, tuple) and len(attachment) == 3:
-                filename, content_bytes, mimetype = attachment
-                data = BytesIO(content_bytes)
-                msg.attach(filename, mimetype, data.read())
-            elif isinstance(attachment, tuple) and len(attachment) == 2:
-                filename, content_bytes = attachment
-                data = BytesIO(content_bytes)
-                msg.attach(filename, "text/csv; charset=utf-8", data.read())
-            else:
-                print(f"Некорректный формат вложения: {attachment}")
-
-    threading.Thread(target=send_async_email, args=(current_app._get_current_object(), msg)).start()
+    queue_email(subject, recipient, body, body_html=body_html, attachments=attachments)
+    if commit:
+        db.session.commit()
 
 
 def generate_reset_token(email, expires_sec=3600):
@@ -116,48 +92,25 @@ def format_datetime(value):
     return str(value)  # если не datetime, вернуть как есть
 
 
+RESERVATION_REPORT_COLUMNS = [
+    ('reservation_id', 'ID бронирования'),
+    ('full_name', 'ФИО'),
+    ('email', 'Электронная почта'),
+    ('phone_number', 'Телефон'),
+    ('participants_count', 'Количество участников'),
+    ('booked_at', 'Дата бронирования'),
+    ('session_datetime', 'Время сессии'),
+    ('excursion_title', 'Название экскурсии'),
+    ('place', 'Место экскурсии'),
+    ('total_cost', 'Общая стоимость'),
+    ('is_paid', 'Оплачена'),
+    ('is_cancelled', 'Отменена'),
+]
+
+
 def generate_reservations_csv(reservations):
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Отменённые бронирования"
-
-    headers = [
-        ('reservation_id', 'ID бронирования'),
-        ('full_name', 'ФИО'),
-        ('email', 'Электронная почта'),
-        ('phone_number', 'Телефон'),
-        ('participants_count', 'Количество участников'),
-        ('booked_at', 'Дата бронирования'),
-        ('session_datetime', 'Время сессии'),
-        ('excursion_title', 'Название экскурсии'),
-        ('place', 'Место экскурсии'),
-        ('total_cost', 'Общая стоимость'),
-        ('is_paid', 'Оплачена'),
-        ('is_cancelled', 'Отменена'),
-    ]
-    ws.append([h[1] for h in headers])
-
-    for r in reservations:
-        ws.append([
-            str(r.get('reservation_id', '')),
-            str(r.get('full_name', '')),
-            str(r.get('email', '')),
-            str(r.get('phone_number', '')),
-            str(r.get('participants_count', '')),
-            format_datetime(r.get('booked_at', '')),
-            format_datetime(r.get('session_datetime', '')),
-            str(r.get('excursion_title', '')),
-            str(r.get('place', '')),
-            str(r.get('total_cost', '')),
-            'Да' if r.get('is_paid') else 'Нет',
-            'Да' if r.get('is_cancelled') else 'Нет',
-        ])
-
-    for col_idx, column_cells in enumerate(ws.columns, 1):
-        max_length = max((len(str(cell.value)) if cell.value else 0) for cell in column_cells)
-        ws.column_dimensions[get_column_letter(col_idx)].width = max_length + 2
-
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
-    return output.read()
+    """CSV со списком броней (словари снимков) для отчёта об отмене."""
+    flags = ('is_paid', 'is_cancelled')
+    rows = ([bool(r.get(key)) if key in flags else r.get(key) for key, _ in RESERVATION_REPORT_COLUMNS]
+            for r in reservations)
+    return export_bytes("csv", [title for _, title in RESERVATION_REPORT_COLUMNS], rows)
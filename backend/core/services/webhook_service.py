@@ -0,0 +1,196 @@
+from datetime import datetime, timedelta
+from http import HTTPStatus
+
+from flask import current_app
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+
+from backend.core import db
+from backend.core.models.excursion_models import Payment, Reservation
+from backend.core.models.system_models import WebhookEvent
+from backend.core.services.email_service import send_reservation_confirmation_email
+from backend.core.services.excursion_services.seat_service import reinstate_reservation
+from backend.core.services.refund_service import mark_refunds_succeeded
+from backend.core.services.reservation_service import refund_late_payment
+
+YOOKASSA = "yookassa"
+
+
+def record_webhook_event(payload, provider=YOOKASSA):
+    """
+    Сохраняет событие в текущей транзакции. Возвращает None, если такое событие уже получено:
+    YooKassa повторяет доставку, пока не получит 200, и повтор не должен применяться второй раз.
+    """
+    object_data = payload.get('object') or {}
+    object_id = str(object_data.get('id') or '')
+    event = WebhookEvent(
+        provider=provider,
+        dedup_key=f"{provider}:{payload['event']}:{object_id}",
+        event_type=payload['event'],
+        object_id=object_id,
+        payload=payload
+    )
+    try:
+        with db.session.begin_nested():
+            db.session.add(event)
+    except IntegrityError:
+        return None
+    return event
+
+
+def _send_confirmation(reservation_id):
+    reservation = db.session.get(Reservation, reservation_id)
+    try:
+        send_reservation_confirmation_email(reservation, reservation.user)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Ошибка при отправке письма: {e}")
+
+
+def apply_yookassa_event(event_type, object_data):
+    """
+    Применяет событие YooKassa в текущей транзакции, не коммитя её.
+    Возвращает действия, которые нужно выполнить после коммита (письма, возвраты).
+    """
+    after_commit = []
+
+    if event_type == 'payment.succeeded':
+        payment_id = object_data.get('id')
+        payment = db.session.execute(
+            select(Payment).options(joinedload(Payment.reservation)).where(Payment.payment_id == payment_id)
+        ).scalar_one_or_none()
+        reservation = payment.reservation if payment and payment.reservation else None
+        if reservation is None:
+            reservation_id = (object_data.get('metadata') or {}).get('reservation_id')
+            reservation = db.session.get(Reservation, reservation_id) if reservation_id else None
+
+        if payment:
+            payment.status = 'succeeded'
+        if reservation and not reservation.is_paid:
+            # оплата пришла после истечения удержания: бронь восстанавливается, если места остались,
+            # иначе деньги возвращаются
+            if reservation.is_cancelled and not reinstate_reservation(reservation):
+                # статус остаётся refund_pending, если возврат не прошёл — такие платежи видно в админке
+                if payment:
+                    payment.status = 'refund_pending'
+                after_commit.append(lambda: refund_late_payment(payment_id, object_data))
+                return after_commit
+
+            reservation.is_paid = True
+            reservation.hold_expires_at = None
+            reservation_id = reservation.reservation_id
+            after_commit.append(lambda: _send_confirmation(reservation_id))
+
+    elif event_type == 'payment.canceled':
+        payment = db.session.execute(
+            select(Payment).options(joinedload(Payment.reservation))
+            .where(Payment.payment_id == object_data.get('id'))
+        ).scalar_one_or_none()
+        if payment:
+            payment.status = 'canceled'
+            # неоплаченная бронь больше не удерживает места
+            if payment.reservation and not payment.reservation.is_paid:
+                payment.reservation.is_cancelled = True
+
+    elif event_type == 'refund.succeeded':
+        db.session.execute(
+            update(Payment)
+            .where(Payment.payment_id == object_data.get('payment_id'))
+            .values(status='refunded')
+            .execution_options(synchronize_session=False)
+        )
+        mark_refunds_succeeded(object_data.get('payment_id'), object_data.get('id'))
+
+    return after_commit
+
+
+def _run_after_commit(actions):
+    for action in actions:
+        try:
+            action()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Ошибка обработки события после коммита: {e}")
+
+
+def handle_yookassa_webhook(payload):
+    if not payload or 'event' not in payload:
+        return {"message": "Некорректные данные"}, HTTPStatus.BAD_REQUEST
+
+    event = record_webhook_event(payload)
+    if event is None:
+        db.session.rollback()
+        return {"message": "Событие уже обработано"}, HTTPStatus.OK
+
+    if current_app.config["WEBHOOK_QUEUE_MODE"]:
+        # в режиме очереди ответ не ждёт применения события — его сделает process_webhook_events
+        db.session.commit()
+        return {"message": "Событие принято"}, HTTPStatus.OK
+
+    actions = apply_yookassa_event(event.event_type, payload.get('object') or {})
+    event.status = WebhookEvent.PROCESSED
+    event.attempts = 1
+    event.processed_at = datetime.now()
+    db.session.commit()
+    _run_after_commit(actions)
+    return {"message": "Webhook обработан"}, HTTPStatus.OK
+
+
+def process_webhook_events(limit=None, now=None):
+    """
+    Применяет пачку полученных событий одной транзакцией, каждое — в своей точке сохранения.
+    Событие забирается условным UPDATE, поэтому параллельные обработчики не применят его дважды.
+    Событие с ошибкой откладывается с нарастающей паузой, после WEBHOOK_MAX_ATTEMPTS попыток — FAILED.
+    """
+    limit = limit or current_app.config["WEBHOOK_BATCH_SIZE"]
+    max_attempts = current_app.config["WEBHOOK_MAX_ATTEMPTS"]
+    now = now or datetime.now()
+    events = db.session.execute(
+        select(WebhookEvent)
+        .where(WebhookEvent.status == WebhookEvent.RECEIVED, WebhookEvent.next_attempt_at <= now)
+        .order_by(WebhookEvent.received_at, WebhookEvent.webhook_event_id)
+        .limit(limit)
+    ).scalars().all()
+
+    actions, failed, processed = [], [], 0
+    for event in events:
+        webhook_event_id, dedup_key, attempts = event.webhook_event_id, event.dedup_key, event.attempts + 1
+        try:
+            with db.session.begin_nested():
+                claimed = db.session.execute(
+                    update(WebhookEvent)
+                    .where(WebhookEvent.webhook_event_id == webhook_event_id,
+                           WebhookEvent.status == WebhookEvent.RECEIVED)
+                    .values(status=WebhookEvent.PROCESSED, processed_at=now, attempts=WebhookEvent.attempts + 1)
+                    .execution_options(synchronize_session=False)
+                ).rowcount
+                if claimed:
+                    actions.extend(apply_yookassa_event(event.event_type, event.payload.get('object') or {}))
+                    processed += 1
+        except Exception as e:
+            print(f"Ошибка применения события {dedup_key}: {e}")
+            failed.append((webhook_event_id, attempts, str(e)[:1000]))
+
+    for webhook_event_id, attempts, error in failed:
+        db.session.execute(
+            update(WebhookEvent)
+            .where(WebhookEvent.webhook_event_id == webhook_event_id)
+            .values(
+                attempts=attempts,
+                last_error=error,
+                status=WebhookEvent.FAILED if attempts >= max_attempts else WebhookEvent.RECEIVED,
+                next_attempt_at=now + timedelta(seconds=min(30 * 2 ** (attempts - 1), 3600))
+            )
+            .execution_options(synchronize_session=False)
+        )
+    db.session.commit()
+    _run_after_commit(actions)
+    return processed
+
+
+def drain_webhook_events(app):
+    with app.app_context():
+        while process_webhook_events():
+            pass
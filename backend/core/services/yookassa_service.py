@@ -1,9 +1,43 @@
+import threading
 import uuid
 
-from yookassa import Refund, Payment
+from yookassa import Payment
+from yookassa.client import ApiClient
+from yookassa.domain.common.http_verb import HttpVerb
+from yookassa.domain.request.refund_request import RefundRequest as YooKassaRefundRequest
+from yookassa.domain.response.refund_response import RefundResponse
 
 
-def create_yookassa_payment(amount, email, description, quantity=1, metadata=None, currency='RUB'):
+class _KeepAliveApiClient(ApiClient):
+    """
+    Клиент YooKassa, который держит одно HTTP-соединение на поток, а не открывает
+    новое (с TLS-рукопожатием) на каждый запрос, как стандартный ApiClient.
+    """
+    _local = threading.local()
+
+    def get_session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = super().get_session()
+            self._local.session = session
+        return session
+
+    def execute(self, body, method, path, query_params, request_headers):
+        self.log_request(body, method, path, query_params, request_headers)
+        raw_response = self.get_session().request(
+            method,
+            self.endpoint + path,
+            params=query_params,
+            headers=request_headers,
+            json=body,
+            verify=self.configuration.verify
+        )
+        self.log_response(raw_response.content, self.get_response_info(raw_response), raw_response.headers)
+        return raw_response
+
+
+def create_yookassa_payment(amount, email, description, quantity=1, metadata=None, currency='RUB',
+                            idempotence_key=None):
     try:
         payment = Payment.create({
             "amount": {
@@ -36,7 +70,7 @@ def create_yookassa_payment(amount, email, description, quantity=1, metadata=Non
             "payment_method_data": {
                 "type": "bank_card"
             }
-        }, uuid.uuid4())
+        }, idempotence_key or uuid.uuid4())
         return payment
 
     except Exception as e:
@@ -44,16 +78,26 @@ def create_yookassa_payment(amount, email, description, quantity=1, metadata=Non
         raise e
 
 
-def refund_yookassa_payment(payment_id: str, amount: float, currency: str = "RUB") -> Refund:
-    refund = Refund.create({
+def refund_yookassa_payment(payment_id: str, amount: float, currency: str = "RUB",
+                            idempotence_key: str = None) -> RefundResponse:
+    params = YooKassaRefundRequest({
         "payment_id": payment_id,
         "amount": {
             "value": f"{amount:.2f}",
             "currency": currency
         },
         "comment": "Возврат за отменённое бронирование"
-    }, uuid.uuid4())
-    return refund
+    })
+    response = _KeepAliveApiClient().request(
+        HttpVerb.POST, "/refunds", None, {"Idempotence-Key": str(idempotence_key or uuid.uuid4())}, params
+    )
+    return RefundResponse(response)
+
+
+def get_yookassa_refund(refund_id: str) -> RefundResponse:
+    """Текущее состояние уже созданного возврата (GET /refunds/{id})."""
+    response = _KeepAliveApiClient().request(HttpVerb.GET, f"/refunds/{refund_id}")
+    return RefundResponse(response)
 
 # def refund_yookassa_payment(payment_id, amount, receipt, currency="RUB"):
 #     refund = Refund.create({
@@ -1,12 +1,12 @@
 from flask import request
 from flask_restx import Resource, fields
-from sqlalchemy import func
 
 from backend.admin.routes import admin_required
 from backend.core import db
 from backend.core.models.auth_models import Role
-from backend.core.models.excursion_models import FormatType, Category, AgeCategory, Excursion, ExcursionSession
+from backend.core.models.excursion_models import FormatType, Category, AgeCategory
 from backend.core.schemas.excursion_schemas import role_model
+from backend.core.services.reference_cache import get_reference_list, get_excursion_stats, invalidate_references
 from backend.references import ref_ns
 
 # Для валидации и автодокументации сделаем модели (пример)
@@ -28,8 +28,7 @@ class CategoryList(Resource):
     @admin_required
     @ref_ns.doc(description="Список всех категорий экскурсий")
     def get(self):
-        categories = Category.query.all()
-        return [c.to_dict() for c in categories], 200
+        return get_reference_list("categories"), 200
 
     @admin_required
     @ref_ns.expect(category_model)
@@ -48,6 +47,7 @@ class CategoryList(Resource):
 
         db.session.add(category)
         db.session.commit()
+        invalidate_references()
         return category.to_dict(), 201
 
 
@@ -61,6 +61,7 @@ class CategoryResource(Resource):
             return {'message': 'Категория не найдена'}, 404
         db.session.delete(category)
         db.session.commit()
+        invalidate_references()
         return {'message': 'Категория удалена'}, 200
 
 
@@ -69,8 +70,7 @@ class FormatTypeList(Resource):
     @admin_required
     @ref_ns.doc(description="Список всех типов форматов экскурсий")
     def get(self):
-        format_types = FormatType.query.all()
-        return [f.to_dict() for f in format_types], 200
+        return get_reference_list("format_types"), 200
 
     @admin_required
     @ref_ns.expect(format_type_model)
@@ -87,6 +87,7 @@ class FormatTypeList(Resource):
         format_type = FormatType(format_type_name=name)
         db.session.add(format_type)
         db.session.commit()
+        invalidate_references()
         return format_type.to_dict(), 201
 
 
@@ -100,6 +101,7 @@ class FormatTypeResource(Resource):
             return {'message': 'Тип формата не найден'}, 404
         db.session.delete(format_type)
         db.session.commit()
+        invalidate_references()
         return {'message': 'Тип формата удалён'}, 200
 
 
@@ -108,8 +110,7 @@ class AgeCategoryList(Resource):
     @admin_required
     @ref_ns.doc(description="Список всех возрастных категорий экскурсий")
     def get(self):
-        age_categories = AgeCategory.query.all()
-        return [a.to_dict() for a in age_categories], 200
+        return get_reference_list("age_categories"), 200
 
     @admin_required
     @ref_ns.expect(age_category_model)
@@ -127,6 +128,7 @@ class AgeCategoryList(Resource):
 
         db.session.add(age_category)
         db.session.commit()
+        invalidate_references()
         return age_category.to_dict(), 201
 
 
@@ -140,6 +142,7 @@ class AgeCategoryResource(Resource):
             return {'message': 'Возрастная категория не найдена'}, 404
         db.session.delete(age_category)
         db.session.commit()
+        invalidate_references()
         return {'message': 'Возрастная категория удалена'}, 200
 
 
@@ -148,8 +151,7 @@ class RoleList(Resource):
     @admin_required
     @ref_ns.doc(description="Список всех ролей")
     def get(self):
-        roles = Role.query.all()
-        return [r.to_dict() for r in roles], 200
+        return get_reference_list("roles"), 200
 
     @admin_required
     @ref_ns.expect(role_model)
@@ -166,6 +168,7 @@ class RoleList(Resource):
         role = Role(role_name=name)
         db.session.add(role)
         db.session.commit()
+        invalidate_references()
         return role.to_dict(), 201
 
 
@@ -179,6 +182,7 @@ class RoleResource(Resource):
             return {'message': 'Роль не найдена'}, 404
         db.session.delete(role)
         db.session.commit()
+        invalidate_references()
         return {'message': 'Роль удалена'}, 200
 
 
@@ -186,54 +190,11 @@ class RoleResource(Resource):
 class ExcursionStats(Resource):
     @ref_ns.doc(description="Получить статистику, роли, возрастные категории, форматы и категории экскурсий")
     def get(self):
-        # Статистика по стоимости сессий
-        min_cost, max_cost = db.session.query(
-            func.min(ExcursionSession.cost),
-            func.max(ExcursionSession.cost)
-        ).first()
-
-        # Статистика по расстоянию до центра
-        min_center, max_center = db.session.query(
-            func.min(Excursion.distance_to_center),
-            func.max(Excursion.distance_to_center)
-        ).filter(Excursion.is_active.is_(True)).first()
-
-        min_time, max_time = db.session.query(
-            func.min(Excursion.time_to_nearest_stop),
-            func.max(Excursion.time_to_nearest_stop)
-        ).filter(Excursion.is_active.is_(True)).first()
-
-        # Роли
-        roles = Role.query.all()
-        roles_data = [r.to_dict() for r in roles]
-
-        # Возрастные категории
-        age_categories = AgeCategory.query.all()
-        age_categories_data = [a.to_dict() for a in age_categories]
-
-        # Типы форматов
-        format_types = FormatType.query.all()
-        format_types_data = [f.to_dict() for f in format_types]
-
-        # Категории экскурсий
-        categories = Category.query.all()
-        categories_data = [c.to_dict() for c in categories]
-
+        # Справочники и диапазоны фильтров меняются редко — отдаются из кэша процесса
         return {
-            "cost": {
-                "min": float(min_cost) if min_cost is not None else None,
-                "max": float(max_cost) if max_cost is not None else None
-            },
-            "distance_to_center": {
-                "min": round(min_center, 2) if min_center is not None else None,
-                "max": round(max_center, 2) if max_center is not None else None
-            },
-            "time_to_stop": {
-                "min": round(min_time, 2) if min_time is not None else None,
-                "max": round(max_time, 2) if max_time is not None else None
-            },
-            "roles": roles_data,
-            "age_categories": age_categories_data,
-            "format_types": format_types_data,
-            "categories": categories_data
+            **get_excursion_stats(),
+            "roles": get_reference_list("roles"),
+            "age_categories": get_reference_list("age_categories"),
+            "format_types": get_reference_list("format_types"),
+            "categories": get_reference_list("categories")
         }, 200
@@ -6,20 +6,24 @@ from flask import request
 from flask_jwt_extended import get_jwt, verify_jwt_in_request, get_jwt_identity
 from flask_restx import Resource
 
+from backend.core.services.excursion_services.analytics_service import get_resident_excursion_analytics, \
+    parse_analytics_params, get_daily_booking_stats
+from backend.core.services.excursion_services.cancellation_service import get_cancellation_job
 from backend.core.services.excursion_services.excursion_photo_service import add_photo_to_excursion, \
     get_photos_for_excursion, \
     delete_photo_from_excursion
 from backend.core.services.excursion_services.excursion_service import create_excursion, update_excursion, \
     get_excursions_for_resident, \
-    get_resident_excursion_analytics, get_excursion, verify_resident_owns_excursion, delete_excursion
+    get_excursion, verify_resident_owns_excursion, delete_excursion, \
+    serialize_excursions, serialize_excursion
 from backend.core.services.excursion_services.excursion_session_service import create_excursion_session, \
     update_excursion_session, \
-    delete_excursion_session, get_sessions_for_excursion
+    delete_excursion_session, get_sessions_for_excursion, serialize_sessions, bulk_create_excursion_sessions
 from . import resident_ns
 from ..core.messages import AuthMessages
 from ..core.schemas.auth_schemas import login_model, change_password_model
 from ..core.schemas.excursion_schemas import data_param, photos_param, excursion_model, session_model, \
-    session_patch_model
+    session_patch_model, session_bulk_model
 from ..core.services.user_services.auth_service import get_user_by_email, change_profile_password
 from ..core.services.user_services.profile_service import login_user, get_profile, get_user_info_response, \
     delete_profile
@@ -39,6 +43,12 @@ def resident_required(fn):
     return wrapper
 
 
+def _with_job_status_url(result, status):
+    if status == HTTPStatus.ACCEPTED:
+        result["status_url"] = f"/api/resident/cancellation-jobs/{result['job_id']}"
+    return result, status
+
+
 @resident_ns.route('/login')
 class ResidentLogin(Resource):
     @resident_ns.expect(login_model)
@@ -110,7 +120,7 @@ class ExcursionsResource(Resource):
         resident_email = get_jwt_identity()
         resident = get_user_by_email(resident_email)
         excursions = get_excursions_for_resident(resident.user_id)
-        return {"excursions": [excursion.to_dict() for excursion in excursions]}, HTTPStatus.OK
+        return {"excursions": serialize_excursions(excursions)}, HTTPStatus.OK
 
 
 @resident_ns.route('/excursions/<int:excursion_id>')
@@ -127,7 +137,7 @@ class ExcursionResource(Resource):
         excursion, error, status = update_excursion(excursion_id, data)
         if error:
             return error, status
-        return {"message": "Экскурсия обновлена", "excursion": excursion.to_dict()}, status
+        return {"message": "Экскурсия обновлена", "excursion": serialize_excursion(excursion)}, status
 
     @resident_required
     @resident_ns.doc(description="Получение экскурсии с записями")
@@ -136,11 +146,11 @@ class ExcursionResource(Resource):
         excursion, error, status = verify_resident_owns_excursion(resident_id, excursion_id)
         if error:
             return error, status
-        excursion = get_excursion(excursion_id)
+        excursion = get_excursion(excursion_id, profile="admin_full")
         if not excursion:
             return {"message": "Экскурсия не найдена"}, 404
 
-        data = excursion.to_dict(include_related=True)
+        data = serialize_excursion(excursion, include_related=True)
         return {"excursion": data}, HTTPStatus.OK
 
     @resident_required
@@ -152,7 +162,7 @@ class ExcursionResource(Resource):
         if error:
             return error, status
 
-        return delete_excursion(excursion_id, resident, return_csv=True)
+        return _with_job_status_url(*delete_excursion(excursion_id, resident))
 
 
 @resident_ns.route('/excursions/<int:excursion_id>/sessions')
@@ -164,7 +174,7 @@ class ExcursionSessionsResource(Resource):
         if error:
             return error, status
         sessions = get_sessions_for_excursion(excursion_id)
-        return [s.to_dict() for s in sessions], HTTPStatus.OK
+        return serialize_sessions(sessions), HTTPStatus.OK
 
     @resident_required
     @resident_ns.expect(session_model, validate=True)
@@ -180,6 +190,19 @@ class ExcursionSessionsResource(Resource):
         return session.to_dict(), status
 
 
+@resident_ns.route('/excursions/<int:excursion_id>/sessions/bulk')
+class ExcursionSessionsBulkResource(Resource):
+    @resident_required
+    @resident_ns.expect(session_bulk_model, validate=True)
+    @resident_ns.doc(description="Массовое создание сеансов списком или по правилу повторения одной транзакцией")
+    def post(self, excursion_id):
+        resident_id = get_user_by_email(get_jwt_identity()).user_id
+        excursion, error, status = verify_resident_owns_excursion(resident_id, excursion_id)
+        if error:
+            return error, status
+        return bulk_create_excursion_sessions(excursion_id, request.get_json())
+
+
 @resident_ns.route('/excursions/<int:excursion_id>/sessions/<int:session_id>')
 class ExcursionSessionResource(Resource):
     @resident_required
@@ -203,7 +226,7 @@ class ExcursionSessionResource(Resource):
         excursion, error, status = verify_resident_owns_excursion(resident_id, excursion_id)
         if error:
             return error, status
-        return delete_excursion_session(excursion_id, session_id, notify_resident=True)
+        return _with_job_status_url(*delete_excursion_session(excursion_id, session_id, notify_resident=True))
 
 
 @resident_ns.route('/excursions/<int:excursion_id>/photos')
@@ -262,8 +285,52 @@ class ExcursionPhotoResource(Resource):
 @resident_ns.route('/analytics')
 class ExcursionAnalytics(Resource):
     @resident_required
-    @resident_ns.doc(description="Аналитика по экскурсиям резидента (кол-во посетителей, популярность и т.д.)")
+    @resident_ns.doc(
+        description="Аналитика по экскурсиям резидента (кол-во посетителей, популярность и т.д.)",
+        params={
+            'start_date': 'Начало периода по дате сеанса (ISO 8601)',
+            'end_date': 'Конец периода по дате сеанса (ISO 8601, включительно)',
+            'bucket': 'Динамика по периодам: day, week или month'
+        }
+    )
     def get(self):
         resident_id = get_user_by_email(get_jwt_identity()).user_id
-        analytics_data = get_resident_excursion_analytics(resident_id)
+        try:
+            start, end, bucket = parse_analytics_params(request.args)
+        except ValueError as e:
+            return {"message": str(e)}, HTTPStatus.BAD_REQUEST
+        analytics_data = get_resident_excursion_analytics(resident_id, start, end, bucket)
         return analytics_data, HTTPStatus.OK
+
+
+@resident_ns.route('/analytics/daily')
+class ExcursionDailyAnalytics(Resource):
+    @resident_required
+    @resident_ns.doc(
+        description="Брони, отмены, оплаты и возвраты по дням из предрасчитанных сводок",
+        params={
+            'start_date': 'Первый день (ISO 8601)',
+            'end_date': 'Последний день (ISO 8601, включительно)',
+            'bucket': 'Группировка: day (по умолчанию), week или month',
+            'excursion_id': 'Только одна экскурсия'
+        }
+    )
+    def get(self):
+        resident_id = get_user_by_email(get_jwt_identity()).user_id
+        try:
+            start, end, bucket = parse_analytics_params(request.args)
+        except ValueError as e:
+            return {"message": str(e)}, HTTPStatus.BAD_REQUEST
+        return get_daily_booking_stats(start, end, bucket, resident_id=resident_id,
+                                       excursion_id=request.args.get('excursion_id', type=int)), HTTPStatus.OK
+
+
+@resident_ns.route('/cancellation-jobs/<int:job_id>')
+class ResidentCancellationJob(Resource):
+    @resident_required
+    @resident_ns.doc(description="Ход задания отмены, созданного резидентом")
+    def get(self, job_id):
+        job = get_cancellation_job(job_id, requester=get_user_by_email(get_jwt_identity()))
+        if not job:
+            return {"message": "Задание не найдено"}, HTTPStatus.NOT_FOUND
+        return job.to_dict(), HTTPStatus.OK
@@ -8,7 +8,8 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from flask_restx import Resource, fields
 
 from backend.core.schemas.auth_schemas import login_model, user_model, change_password_model, edit_profile_model
-from backend.core.services.excursion_services.excursion_service import list_excursions, get_excursion
+from backend.core.services.excursion_services.excursion_service import list_excursions, get_excursion, \
+    serialize_excursions, serialize_excursion, list_excursions_page, parse_excursion_fields
 from . import user_ns
 from ..core import db
 from ..core.messages import AuthMessages
@@ -16,6 +17,11 @@ from ..core.models.news_models import News
 from ..core.schemas.excursion_schemas import reservation_model, cancel_model
 from ..core.services.calendar_utilits import create_ical_from_reservation
 from ..core.services.email_service import send_reset_email
+from ..core.services.pagination import parse_limit
+from ..core.services.payment_outbox_service import get_payment_status
+from ..core.services.resource_versions import conditional_get, catalog_version, excursion_version, get_version, \
+    NEWS
+from ..core.services.response_cache import normalize_params
 from ..core.services.reservation_service import get_reservations_by_user_email, create_reservation_with_payment, \
     cancel_user_reservation, get_reservations_by_reservation_id
 from ..core.services.user_services.auth_service import get_user_by_email, update_profile, change_profile_password
@@ -101,35 +107,53 @@ class UserExcursionsList(Resource):
             'sort': (
                     'Сортировка: title, duration, price, time. '
                     'Можно с -, например: -price, -time'
-            )
+            ),
+            'limit': 'Размер страницы (включает постраничную выдачу, максимум 100)',
+            'cursor': 'Курсор следующей страницы из поля next_cursor предыдущего ответа',
+            'fields': 'Список полей экскурсии через запятую, например: title,photos,category'
         }
     )
     def get(self):
+        cache_key = "excursions?" + normalize_params(request.args, CATALOG_PARAMS, list_params=CATALOG_LIST_PARAMS,
+                                                     ordered_params=("sort",))
+        return conditional_get(catalog_version(), self._list_excursions, cache_key=cache_key)
+
+    @staticmethod
+    def _list_excursions():
         args = request.args
-        filters = {
-            'category': args.get('category'),
-            'format_type': args.get('format_type'),
-            'age_category': args.get('age_category'),
-            'tags': args.get('tags'),
-            'min_duration': args.get('min_duration'),
-            'max_duration': args.get('max_duration'),
-            'min_distance_to_center': args.get('min_distance_to_center'),
-            'max_distance_to_center': args.get('max_distance_to_center'),
-            'min_distance_to_stop': args.get('min_distance_to_stop'),
-            'max_distance_to_stop': args.get('max_distance_to_stop'),
-            'min_price': args.get('min_price'),
-            'max_price': args.get('max_price'),
-            'start_date': args.get('start_date'),
-            'end_date': args.get('end_date'),
-            'title': args.get('title'),
-        }
+        filters = {name: args.get(name) for name in CATALOG_FILTER_PARAMS}
         sort = args.get('sort')
-        excursions = list_excursions(filters, sort)
+        try:
+            fields = parse_excursion_fields(args.get('fields'))
+            if args.get('limit') or args.get('cursor'):
+                limit = parse_limit(args.get('limit'))
+                excursions, next_cursor = list_excursions_page(
+                    filters, sort, limit, args.get('cursor'), fields=fields
+                )
+                return {
+                    "excursions": serialize_excursions(excursions, fields=fields),
+                    "next_cursor": next_cursor
+                }, HTTPStatus.OK
+        except ValueError as e:
+            return {"message": str(e)}, HTTPStatus.BAD_REQUEST
+
+        excursions = list_excursions(filters, sort, fields=fields)
         return {
-            "excursions": [excursion.to_dict() for excursion in excursions]
+            "excursions": serialize_excursions(excursions, fields=fields)
         }, HTTPStatus.OK
 
 
+# параметры каталога со списком значений через запятую: порядок значений не влияет на выдачу
+CATALOG_LIST_PARAMS = ("category", "format_type", "age_category", "tags", "fields")
+CATALOG_FILTER_PARAMS = (
+    "category", "format_type", "age_category", "tags", "min_duration", "max_duration",
+    "min_distance_to_center", "max_distance_to_center", "min_distance_to_stop", "max_distance_to_stop",
+    "min_price", "max_price", "start_date", "end_date", "title",
+)
+# все параметры, которые читает список экскурсий, — из них строится ключ общего кэша ответов
+CATALOG_PARAMS = CATALOG_FILTER_PARAMS + ("sort", "fields", "limit", "cursor")
+
+
 @user_ns.route('/password-reset-request')
 class PasswordResetRequest(Resource):
     @user_ns.expect(user_ns.model("PasswordResetRequest", {
@@ -145,6 +169,7 @@ class PasswordResetRequest(Resource):
             return {"message": "Если пользователь существует, инструкция отправлена на почту"}, HTTPStatus.OK
 
         send_reset_email(user)
+        db.session.commit()
         return {"message": "Письмо для восстановления пароля отправлено"}, HTTPStatus.OK
 
 
@@ -193,7 +218,8 @@ class Reservations(Resource):
 class ReservationCreate(Resource):
     @jwt_required()
     @user_ns.expect(reservation_model)
-    @user_ns.doc(description="Запись на сеанс экскурсии через оплату")
+    @user_ns.doc(description="Запись на сеанс экскурсии. Для платных сеансов возвращает 202 и reservation_id, "
+                             "ссылку на оплату нужно получить через /v2/reservations/<id>/payment")
     def post(self):
         data = request.get_json()
 
@@ -223,6 +249,19 @@ class ReservationCreate(Resource):
         return response, status
 
 
+@user_ns.route('/v2/reservations/<int:reservation_id>/payment')
+class ReservationPaymentStatus(Resource):
+    @jwt_required()
+    @user_ns.doc(description="Статус оплаты брони и ссылка на оплату, когда платёж создан. "
+                             "Пока статус pending, повторять запрос через retry_after секунд")
+    def get(self, reservation_id):
+        user = get_user_by_email(get_jwt_identity())
+        if not user:
+            return {"message": "Пользователь не найден"}, HTTPStatus.UNAUTHORIZED
+
+        return get_payment_status(user.user_id, reservation_id)
+
+
 @user_ns.route('/reservations/<int:reservation_id>/export_ical')
 class ExportReservationICal(Resource):
     def get(self, reservation_id):
@@ -269,30 +308,35 @@ class GoogleCalendarLink(Resource):
 class NewsList(Resource):
     @user_ns.doc(description="Список всех новостей (без авторизации)")
     def get(self):
-        news_list = News.query.order_by(News.created_at.desc()).all()
-        return {
-            "news": [n.to_dict() for n in news_list]
-        }, HTTPStatus.OK
+        return conditional_get(get_version(NEWS), lambda: ({
+            "news": [n.to_dict() for n in News.query.order_by(News.created_at.desc()).all()]
+        }, HTTPStatus.OK), cache_key="news")
 
 
 @user_ns.route('/excursions_detail/<int:excursion_id>')
 class DetailExcursion(Resource):
     def get(self, excursion_id):
-        excursion = get_excursion(excursion_id)
+        return conditional_get(excursion_version(excursion_id), lambda: self._get_excursion(excursion_id),
+                               cache_key=f"excursion:{excursion_id}")
+
+    @staticmethod
+    def _get_excursion(excursion_id):
+        excursion = get_excursion(excursion_id, sessions_after=datetime.now())
 
         if not excursion:
             return {"message": "Экскурсия не найдена"}, HTTPStatus.NOT_FOUND
 
-        now = datetime.now()
-        excursion.sessions = [s for s in excursion.sessions if s.start_datetime > now]
-
-        return excursion.to_dict(), HTTPStatus.OK
+        return serialize_excursion(excursion), HTTPStatus.OK
 
 
 @user_ns.route('/news/<int:news_id>')
 class NewsDetail(Resource):
     @user_ns.doc(description="Детальный просмотр новости по ID (без авторизации)")
     def get(self, news_id):
+        return conditional_get(get_version(NEWS), lambda: self._get_news(news_id))
+
+    @staticmethod
+    def _get_news(news_id):
         news = News.query.get(news_id)
         if not news:
             return {"message": "Новость не найдена"}, HTTPStatus.NOT_FOUND
@@ -138,7 +138,29 @@ export const useDataStore = defineStore('data', {
             'Content-Type': 'application/json',
           },
         })
-        window.location.href = response.data.payment_url
+        if (response.status !== 202) {
+          return response.data
+        }
+        // платёж создаётся в фоне: опрашиваем статус с нарастающей паузой (не меньше retry_after)
+        let delay = 1
+        for (let attempt = 0; attempt < 15; attempt++) {
+          const status = await axios.get(`${baseUrl}${response.data.status_url}`, {
+            headers: {
+              Authorization: `Bearer ${this.auth_key}`,
+            },
+          })
+          if (status.data.payment_url) {
+            window.location.href = status.data.payment_url
+            return status.data
+          }
+          if (status.data.status !== 'pending') {
+            throw new Error('Не удалось создать платёж, попробуйте позже')
+          }
+          const pause = Math.max(delay, status.data.retry_after || 0)
+          await new Promise((resolve) => setTimeout(resolve, pause * 1000))
+          delay = Math.min(delay * 2, 5)
+        }
+        throw new Error('Платёж создаётся слишком долго, проверьте бронирование в профиле')
       } catch (error) {
         console.log(this.auth_key)
         console.error('Ошибка при бронировании:', error.response?.data || error.message)
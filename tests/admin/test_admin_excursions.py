@@ -1,10 +1,23 @@
-from datetime import datetime
+from datetime import date, datetime, time, timedelta
 from http import HTTPStatus
+from types import SimpleNamespace
+from uuid import uuid4
 
 import pytest
+from sqlalchemy import update
 
 from backend.core import db
-from tests.conftest import get_excursion_payload, create_excursion_session
+from backend.core.models.auth_models import User
+from backend.core.models.excursion_models import Reservation, Payment, ExcursionSession, RefundRequest, \
+    RecurringSchedule, SessionDailyStats, ExcursionDailyStats
+from backend.core.models.system_models import EmailOutbox, RollupChange
+from backend.core.services import refund_service
+from backend.core.services.excursion_services.booking_rollup_service import backfill_booking_rollups, \
+    refresh_booking_rollups
+from backend.core.services.excursion_services.cancellation_service import run_cancellation_jobs
+from backend.core.services.excursion_services.recurring_session_service import generate_recurring_sessions
+from tests.conftest import get_excursion_payload, create_excursion_session, recreate_test_user, TestUserData, \
+    count_queries
 from tests.excursion_tests import _assert_excursions_list_response, _assert_create_excursion_bad_json, \
     _assert_patch_update_excursion_success, _assert_patch_excursion_not_found, _assert_get_excursion_by_id_success, \
     _assert_get_not_found, _assert_delete_success, _assert_delete_not_found, _test_get_sessions_for_excursion, \
@@ -106,3 +119,302 @@ class TestExcursionPhotos:
 
     def test_delete_photo_admin(self, admin_client, new_excursion_id):
         _test_delete_photo(admin_client, "/api/admin", new_excursion_id)
+
+
+def _session_with_reservations(app, excursion_id, participants, paid):
+    """Сеанс с participants бронями, первые paid из них оплачены через YooKassa."""
+    with app.app_context():
+        recreate_test_user(TestUserData.EMAIL, TestUserData.PASSWORD, TestUserData.FULL_NAME,
+                           TestUserData.PHONE, TestUserData.ROLE)
+        user = User.query.filter_by(email=TestUserData.EMAIL).first()
+        session_id = create_excursion_session(excursion_id, datetime(2029, 11, 1, 10, 0), 5, 700).session_id
+        emails, payment_ids = [f"participant{i}@example.com" for i in range(participants)], []
+        for i, email in enumerate(emails):
+            reservation = Reservation(session_id=session_id, user_id=user.user_id, full_name=f"Участник {i}",
+                                      phone_number="000", email=email, participants_count=1, is_paid=True,
+                                      is_cancelled=False)
+            db.session.add(reservation)
+            db.session.flush()
+            if i < paid:
+                payment_ids.append(f"cancel-{uuid4()}")
+                db.session.add(Payment(payment_id=payment_ids[-1], session_id=session_id,
+                                       reservation_id=reservation.reservation_id, participants_count=1,
+                                       email=email, amount=700, status="succeeded"))
+        db.session.commit()
+    return session_id, emails, payment_ids
+
+
+def test_session_deletion_runs_refunds_and_emails_in_background(app, admin_client, new_excursion_id, monkeypatch):
+    refunds = []
+
+    def fake_refund(**kwargs):
+        refunds.append(kwargs)
+        return SimpleNamespace(id=f"refund-{uuid4()}", status="succeeded")
+
+    monkeypatch.setattr(refund_service, "refund_yookassa_payment", fake_refund)
+    session_id, emails, payment_ids = _session_with_reservations(app, new_excursion_id, participants=3, paid=1)
+
+    r = admin_client.delete(f"/api/admin/excursions/{new_excursion_id}/sessions/{session_id}")
+    assert r.status_code == HTTPStatus.ACCEPTED, r.get_data(as_text=True)
+    status_url = r.get_json()["status_url"]
+    assert not refunds
+
+    with app.app_context():
+        assert db.session.get(ExcursionSession, session_id) is None
+
+    job = admin_client.get(status_url).get_json()
+    assert job["status"] == "pending"
+    assert job["progress"] == {"total": 3, "done": 0, "failed": 0, "pending": 3}
+
+    assert run_cancellation_jobs(app) == 1
+
+    job = admin_client.get(status_url).get_json()
+    assert job["status"] == "done"
+    assert job["progress"]["done"] == 3
+    assert all(item["notified"] for item in job["items"])
+    assert sorted(item["refund_status"] for item in job["items"]) == ["not_required", "not_required", "succeeded"]
+    assert len(refunds) == 1 and refunds[0]["payment_id"] == payment_ids[0]
+
+    with app.app_context():
+        queued = {e.recipient for e in EmailOutbox.query.filter_by(subject="Отмена экскурсионной сессии").all()}
+        assert set(emails) <= queued
+
+
+def test_failed_refunds_are_retried_without_repeating_succeeded_ones(app, admin_client, new_excursion_id,
+                                                                     monkeypatch):
+    calls = []
+    failing = set()
+
+    def fake_refund(**kwargs):
+        calls.append(kwargs["payment_id"])
+        if kwargs["payment_id"] in failing:
+            raise RuntimeError("YooKassa недоступна")
+        return SimpleNamespace(id=f"refund-{uuid4()}", status="succeeded")
+
+    monkeypatch.setattr(refund_service, "refund_yookassa_payment", fake_refund)
+    session_id, _, payment_ids = _session_with_reservations(app, new_excursion_id, participants=3, paid=3)
+    failing.add(payment_ids[1])
+
+    r = admin_client.delete(f"/api/admin/excursions/{new_excursion_id}/sessions/{session_id}")
+    status_url = r.get_json()["status_url"]
+    assert run_cancellation_jobs(app) == 1
+
+    job = admin_client.get(status_url).get_json()
+    assert job["status"] == "done"
+    assert sorted(item["refund_status"] for item in job["items"]) == ["requested", "succeeded", "succeeded"]
+    assert sorted(calls) == sorted(payment_ids)
+
+    failing.clear()
+    with app.app_context():
+        # ждать backoff в тесте не нужно — переносим следующую попытку на сейчас
+        RefundRequest.query.filter(RefundRequest.payment_id.in_(payment_ids)).update(
+            {RefundRequest.next_attempt_at: datetime.now()}, synchronize_session=False)
+        db.session.commit()
+    assert refund_service.dispatch_refunds(app) >= 1
+
+    job = admin_client.get(status_url).get_json()
+    assert [item["refund_status"] for item in job["items"]] == ["succeeded"] * 3
+    assert calls.count(payment_ids[1]) == 2
+    assert calls.count(payment_ids[0]) == 1 and calls.count(payment_ids[2]) == 1
+    with app.app_context():
+        refunds = RefundRequest.query.filter(RefundRequest.payment_id.in_(payment_ids)).all()
+        assert {refund.attempts for refund in refunds if refund.payment_id == payment_ids[1]} == {2}
+
+
+def test_pending_refund_is_rechecked_by_id_not_resubmitted(app, monkeypatch):
+    posts, fetches = [], []
+
+    def fake_refund(**kwargs):
+        posts.append(kwargs)
+        return SimpleNamespace(id=provider_refund_id, status="pending")
+
+    def fake_get_refund(refund_id):
+        fetches.append(refund_id)
+        return SimpleNamespace(id=refund_id, status="pending" if len(fetches) == 1 else "succeeded")
+
+    monkeypatch.setattr(refund_service, "refund_yookassa_payment", fake_refund)
+    monkeypatch.setattr(refund_service, "get_yookassa_refund", fake_get_refund)
+    provider_refund_id = f"refund-{uuid4()}"
+    with app.app_context():
+        refund = refund_service.request_refund(f"pending-{uuid4()}", 700)
+        db.session.commit()
+        refund_request_id = refund.refund_request_id
+
+    def recheck():
+        with app.app_context():
+            RefundRequest.query.filter_by(refund_request_id=refund_request_id).update(
+                {RefundRequest.locked_until: datetime.now() - timedelta(seconds=1)}, synchronize_session=False)
+            db.session.commit()
+        refund_service.submit_refunds(app, [refund_request_id])
+
+    refund_service.submit_refunds(app, [refund_request_id])
+    recheck()
+    recheck()
+
+    assert len(posts) == 1 and fetches == [provider_refund_id] * 2
+    with app.app_context():
+        refund = db.session.get(RefundRequest, refund_request_id)
+        assert refund.status == RefundRequest.SUCCEEDED
+        # перепроверки не расходуют REFUND_MAX_ATTEMPTS
+        assert refund.attempts == 1
+        db.session.delete(refund)
+        db.session.commit()
+
+
+def test_recurring_sessions_are_generated_in_bulk_and_only_once(app, new_excursion_id):
+    now = datetime(2031, 1, 1, 12, 0)  # среда
+    with app.app_context():
+        weekly = RecurringSchedule(excursion_id=new_excursion_id, weekday=1, start_time=time(10, 0),
+                                   max_participants=10, cost=300)
+        limited = RecurringSchedule(excursion_id=new_excursion_id, weekday=3, start_time=time(18, 0),
+                                    max_participants=5, cost=0, repeats=3)
+        db.session.add_all([weekly, limited])
+        db.session.commit()
+        weekly_id, limited_id = weekly.schedule_id, limited.schedule_id
+        # сеанс, добавленный вручную на время расписания, не дублируется
+        create_excursion_session(new_excursion_id, datetime(2031, 1, 6, 10, 0), 10, 300)
+
+    def generate():
+        with app.app_context():
+            return generate_recurring_sessions(days=365, now=now)
+
+    created, queries = count_queries(app, generate)
+    # 52 понедельника года без одного ручного сеанса и три сеанса ограниченного расписания
+    assert created == 51 + 3
+    assert queries <= 12
+
+    with app.app_context():
+        sessions = ExcursionSession.query.filter_by(excursion_id=new_excursion_id).all()
+        mondays = sorted(s.start_datetime for s in sessions if s.start_datetime.time() == time(10, 0))
+        assert len(mondays) == 52 and all(b - a == timedelta(weeks=1) for a, b in zip(mondays, mondays[1:]))
+        assert sorted(s.start_datetime for s in sessions if s.schedule_id == limited_id) == [
+            datetime(2031, 1, 1, 18, 0), datetime(2031, 1, 8, 18, 0), datetime(2031, 1, 15, 18, 0)]
+        assert db.session.get(RecurringSchedule, weekly_id).count_of_repeats == 51
+        assert db.session.get(RecurringSchedule, limited_id).count_of_repeats == 3
+
+        assert generate_recurring_sessions(days=365, now=now) == 0
+
+
+def test_booking_rollups_follow_changed_reservations_and_payments(app, admin_client, new_excursion_id):
+    day = datetime(2033, 3, 14, 10, 0)
+    with app.app_context():
+        backfill_booking_rollups()
+        recreate_test_user(TestUserData.EMAIL, TestUserData.PASSWORD, TestUserData.FULL_NAME,
+                           TestUserData.PHONE, TestUserData.ROLE)
+        user_id = User.query.filter_by(email=TestUserData.EMAIL).first().user_id
+        session_id = create_excursion_session(new_excursion_id, datetime(2033, 4, 1, 12, 0), 10, 600).session_id
+        for count, status in ((2, "succeeded"), (3, "refunded")):
+            reservation = Reservation(session_id=session_id, user_id=user_id, full_name="Гость", phone_number="000",
+                                      email="guest@example.com", participants_count=count, is_paid=True,
+                                      is_cancelled=status == "refunded", booked_at=day)
+            db.session.add(reservation)
+            db.session.flush()
+            db.session.add(Payment(payment_id=f"rollup-{uuid4()}", session_id=session_id, created_at=day,
+                                   reservation_id=reservation.reservation_id, participants_count=count,
+                                   email="guest@example.com", amount=600 * count, status=status))
+        db.session.commit()
+
+        assert refresh_booking_rollups() >= 1
+        stats = db.session.get(SessionDailyStats, (session_id, day.date()))
+        assert (stats.bookings, stats.participants, stats.cancellations) == (2, 2, 1)
+        assert (stats.paid_amount, stats.refunded_amount) == (3000, 1800)
+
+        Reservation.query.filter_by(session_id=session_id, is_cancelled=False).one().is_cancelled = True
+        db.session.commit()
+        refresh_booking_rollups()
+
+    r = admin_client.get(f"/api/admin/analytics/daily?excursion_id={new_excursion_id}&start_date=2033-03-01"
+                         f"&end_date=2033-03-31&bucket=month")
+    assert r.status_code == HTTPStatus.OK, r.get_data(as_text=True)
+    data = r.get_json()
+    assert data["series"] == [{"period": "2033-03-01", "bookings": 2, "participants": 0, "cancellations": 2,
+                               "paid_amount": 3000.0, "refunded_amount": 1800.0}]
+
+    with app.app_context():
+        db.session.delete(db.session.get(ExcursionSession, session_id))
+        db.session.commit()
+        # строки удалённого сеанса остаются в истории
+        refresh_booking_rollups()
+        stats = db.session.get(SessionDailyStats, (session_id, day.date()))
+        assert (stats.bookings, stats.cancellations, stats.paid_amount, stats.refunded_amount) == (2, 2, 3000, 1800)
+        assert db.session.get(ExcursionDailyStats, (new_excursion_id, day.date())).paid_amount == 3000
+
+
+def test_booking_rollups_keep_deleted_reservations_and_sessions(app, admin_client, new_excursion_id, monkeypatch):
+    monkeypatch.setattr(refund_service, "refund_yookassa_payment",
+                        lambda **kwargs: SimpleNamespace(id=f"refund-{uuid4()}", status="succeeded"))
+    session_id, emails, payment_ids = _session_with_reservations(app, new_excursion_id, participants=3, paid=2)
+
+    def stats():
+        return db.session.get(SessionDailyStats, (session_id, date.today()))
+
+    with app.app_context():
+        # изменения старше отметки с запасом: удаление брони пересчёт найдёт только по журналу RollupChange
+        past = datetime.now() - timedelta(days=1)
+        for model in (Reservation, Payment):
+            db.session.execute(update(model).where(model.session_id == session_id).values(updated_at=past))
+        db.session.commit()
+        backfill_booking_rollups()
+        assert (stats().bookings, stats().participants, stats().paid_amount) == (3, 3, 1400)
+
+        db.session.delete(Reservation.query.filter_by(session_id=session_id, email=emails[2]).one())
+        db.session.commit()
+        refresh_booking_rollups()
+        assert (stats().bookings, stats().participants) == (2, 2)
+
+        # отмена с возвратом по платежу попадает в сводку при удалении сеанса, без пересчёта между ними
+        payment = db.session.get(Payment, payment_ids[0])
+        payment.status = "refunded"
+        payment.reservation.is_cancelled = True
+        db.session.commit()
+
+    r = admin_client.delete(f"/api/admin/excursions/{new_excursion_id}/sessions/{session_id}")
+    assert r.status_code == HTTPStatus.ACCEPTED, r.get_data(as_text=True)
+
+    with app.app_context():
+        refresh_booking_rollups()
+        row = stats()
+        assert (row.bookings, row.participants, row.cancellations) == (2, 1, 1)
+        assert (row.paid_amount, row.refunded_amount) == (1400, 700)
+
+    # платёж отменённой брони удалён вместе с сеансом, возврат учитывается по RefundRequest
+    assert run_cancellation_jobs(app) == 1
+    with app.app_context():
+        for _ in range(2):
+            refresh_booking_rollups()
+            assert (stats().paid_amount, stats().refunded_amount) == (1400, 1400)
+        assert db.session.get(ExcursionDailyStats, (new_excursion_id, date.today())).refunded_amount == 1400
+        assert RollupChange.query.filter_by(session_id=session_id).count() == 0
+
+
+def test_admin_reservations_are_paginated_by_cursor(app, admin_client, new_excursion_id):
+    session_id, _, _ = _session_with_reservations(app, new_excursion_id, participants=3, paid=1)
+    url = f"/api/admin/reservations?excursion_id={new_excursion_id}&status=active"
+
+    r = admin_client.get(f"{url}&limit=2")
+    assert r.status_code == HTTPStatus.OK, r.get_data(as_text=True)
+    first = r.get_json()
+    assert len(first["reservations"]) == 2 and first["next_cursor"]
+    assert first["total"] == 3 and first["total_is_estimate"] is False
+
+    r = admin_client.get(f"{url}&limit=2&cursor={first['next_cursor']}")
+    second = r.get_json()
+    assert len(second["reservations"]) == 1 and second["next_cursor"] is None
+    ids = [item["reservation_id"] for item in first["reservations"] + second["reservations"]]
+    assert ids == sorted(ids, reverse=True)
+    assert second["reservations"][0]["excursion_title"] and second["reservations"][0]["payment_status"]
+
+    # сеанс, экскурсия и платёж загружаются вместе с бронями — число запросов не зависит от размера страницы
+    _, small = count_queries(app, lambda: admin_client.get(f"{url}&limit=1"))
+    _, large = count_queries(app, lambda: admin_client.get(f"{url}&limit=3"))
+    assert small == large
+
+    r = admin_client.get(f"/api/admin/reservations?session_id={session_id}&paid=false&limit=5")
+    assert r.get_json()["reservations"] == [] and r.get_json()["total"] == 0
+    assert admin_client.get(f"{url}&limit=2&sort=-email").status_code == HTTPStatus.BAD_REQUEST
+    assert admin_client.get(f"{url}&limit=2&cursor={first['next_cursor']}&sort=booked_at").status_code \
+        == HTTPStatus.BAD_REQUEST
+
+    with app.app_context():
+        db.session.delete(db.session.get(ExcursionSession, session_id))
+        db.session.commit()
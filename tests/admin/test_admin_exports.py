@@ -0,0 +1,111 @@
+import csv
+import io
+import json
+from datetime import datetime
+from http import HTTPStatus
+from uuid import uuid4
+
+import pytest
+from openpyxl import load_workbook
+
+from backend.core import db
+from backend.core.models.auth_models import User
+from backend.core.models.excursion_models import ExcursionSession, Payment, Reservation
+from backend.core.services.export_service import export_response, stream_csv, stream_xlsx
+from backend.core.services.utilits import generate_reservations_csv
+from tests.conftest import create_excursion_session, get_excursion_payload, recreate_test_user, TestUserData
+
+
+def _rows(count):
+    for i in range(count):
+        yield [i, f"Гость {i}", datetime(2030, 1, 1, 12, 30), i % 2 == 0, None]
+
+
+def test_csv_export_is_streamed_in_chunks():
+    chunks = list(stream_csv(["ID", "ФИО", "Дата", "Оплачена", "Комментарий"], _rows(20000)))
+    assert len(chunks) > 1
+
+    lines = list(csv.reader(io.StringIO(b"".join(chunks).decode("utf-8-sig")), delimiter=";"))
+    assert lines[0] == ["ID", "ФИО", "Дата", "Оплачена", "Комментарий"]
+    assert lines[1] == ["0", "Гость 0", "01.01.2030 12:30", "Да", ""]
+    assert len(lines) == 20001
+
+
+def test_xlsx_export_writes_native_cells():
+    data = b"".join(stream_xlsx(["ID", "ФИО", "Дата", "Оплачена", "Комментарий"], _rows(3), sheet_title="Брони"))
+    sheet = load_workbook(io.BytesIO(data))["Брони"]
+    assert [cell.value for cell in sheet[2]] == [0, "Гость 0", datetime(2030, 1, 1, 12, 30), "Да", None]
+    assert sheet.max_row == 4
+
+
+def test_export_response_and_cancellation_report_are_csv(app):
+    with app.test_request_context():
+        response = export_response("csv", ["ID"], iter([[1], [2]]), "брони")
+        assert response.is_streamed and response.mimetype == "text/csv"
+        assert "filename*=UTF-8''%D0%B1%D1%80%D0%BE%D0%BD%D0%B8.csv" in response.headers["Content-Disposition"]
+        assert b"".join(response.response).decode("utf-8-sig").splitlines() == ["ID", "1", "2"]
+
+    report = generate_reservations_csv([{"reservation_id": 7, "full_name": "Гость", "is_paid": True}])
+    header, row = report.decode("utf-8-sig").splitlines()
+    assert header.startswith("ID бронирования;ФИО")
+    assert row.startswith("7;Гость;") and row.endswith(";Да;Нет")
+
+
+@pytest.fixture
+def exported_excursion_id(app, admin_client):
+    r = admin_client.post("/api/admin/excursions", data=get_excursion_payload(), content_type='multipart/form-data')
+    assert r.status_code == HTTPStatus.OK, r.get_data(as_text=True)
+    excursion_id = r.get_json()["excursion_id"]
+
+    with app.app_context():
+        recreate_test_user(TestUserData.EMAIL, TestUserData.PASSWORD, TestUserData.FULL_NAME,
+                           TestUserData.PHONE, TestUserData.ROLE)
+        user_id = User.query.filter_by(email=TestUserData.EMAIL).first().user_id
+        session_id = create_excursion_session(excursion_id, datetime(2034, 2, 1, 10, 0), 10, 400).session_id
+        for name, cancelled in (("Активный гость", False), ("Отменивший гость", True)):
+            reservation = Reservation(session_id=session_id, user_id=user_id, full_name=name, phone_number="000",
+                                      email="guest@example.com", participants_count=2, is_paid=True,
+                                      is_cancelled=cancelled)
+            db.session.add(reservation)
+            db.session.flush()
+            db.session.add(Payment(payment_id=f"export-{uuid4()}", session_id=session_id,
+                                   reservation_id=reservation.reservation_id, participants_count=2,
+                                   email="guest@example.com", amount=800,
+                                   status="refunded" if cancelled else "succeeded"))
+        db.session.commit()
+
+    yield excursion_id
+
+    with app.app_context():
+        db.session.delete(db.session.get(ExcursionSession, session_id))
+        db.session.commit()
+    admin_client.delete(f"/api/admin/excursions/{excursion_id}")
+
+
+def test_admin_exports_stream_filtered_rows(admin_client, exported_excursion_id):
+    base = "/api/admin/exports"
+
+    r = admin_client.get(f"{base}/reservations?format=ndjson&excursion_id={exported_excursion_id}")
+    assert r.status_code == HTTPStatus.OK and r.mimetype == "application/x-ndjson"
+    reservations = [json.loads(line) for line in r.get_data(as_text=True).splitlines()]
+    assert [item["full_name"] for item in reservations] == ["Активный гость", "Отменивший гость"]
+    assert reservations[0]["total_cost"] == 800 and reservations[0]["payment_status"] == "succeeded"
+    assert reservations[0]["session_start_datetime"] == "2034-02-01T10:00:00"
+
+    r = admin_client.get(f"{base}/reservations?format=ndjson&excursion_id={exported_excursion_id}&status=cancelled")
+    assert [json.loads(line)["full_name"] for line in r.get_data(as_text=True).splitlines()] == ["Отменивший гость"]
+
+    r = admin_client.get(f"{base}/participants?excursion_id={exported_excursion_id}&start_date=2034-02-01"
+                         f"&end_date=2034-02-01")
+    assert r.status_code == HTTPStatus.OK and r.mimetype == "text/csv"
+    lines = list(csv.reader(io.StringIO(r.get_data().decode("utf-8-sig")), delimiter=";"))
+    assert len(lines) == 2 and "Активный гость" in lines[1]
+
+    r = admin_client.get(f"{base}/payments?format=xlsx&excursion_id={exported_excursion_id}&status=refunded")
+    assert r.status_code == HTTPStatus.OK
+    sheet = load_workbook(io.BytesIO(r.get_data()))["Платежи"]
+    assert sheet.max_row == 2 and sheet.cell(row=2, column=3).value == "refunded"
+
+    assert admin_client.get(f"{base}/users").status_code == HTTPStatus.NOT_FOUND
+    assert admin_client.get(f"{base}/payments?status=lost").status_code == HTTPStatus.BAD_REQUEST
+    assert admin_client.get(f"{base}/payments?format=pdf").status_code == HTTPStatus.BAD_REQUEST
@@ -0,0 +1,61 @@
+from http import HTTPStatus
+
+import pytest
+
+from backend.core import db
+from backend.core.models.excursion_models import Category
+from backend.core.services.reference_cache import get_reference_id
+from tests.conftest import count_queries
+
+
+def test_excursion_stats_served_from_cache(app, client):
+    r = client.get("/api/references/excursion-stats")
+    assert r.status_code == HTTPStatus.OK
+
+    r, queries = count_queries(app, lambda: client.get("/api/references/excursion-stats"))
+    assert r.status_code == HTTPStatus.OK
+    assert queries == 0
+    assert {"cost", "distance_to_center", "time_to_stop", "roles", "categories"} <= set(r.get_json())
+
+
+def test_reference_changes_invalidate_cache(app, admin_client):
+    name = "Кэшируемая категория"
+    with app.app_context():
+        Category.query.filter_by(category_name=name).delete()
+        db.session.commit()
+
+    admin_client.get("/api/references/excursion-stats")
+
+    r = admin_client.post("/api/references/categories", json={"name": name})
+    assert r.status_code == HTTPStatus.CREATED
+    category_id = r.get_json()["category_id"]
+
+    names = [c["category_name"] for c in admin_client.get("/api/references/excursion-stats").get_json()["categories"]]
+    assert name in names
+
+    r = admin_client.delete(f"/api/references/categories/{category_id}")
+    assert r.status_code == HTTPStatus.OK
+    names = [c["category_name"] for c in admin_client.get("/api/references/categories").get_json()]
+    assert name not in names
+
+
+def test_unknown_reference_name_reloads_cache_rarely(app):
+    def lookup(value):
+        with app.app_context():
+            return get_reference_id("categories", value, "Категория не найдена")
+
+    with app.app_context():
+        known = Category.query.first().category_name
+    lookup(known)
+
+    for value in ("Категории нет", "Ещё одной нет"):
+        _, queries = count_queries(app, lambda: pytest.raises(ValueError, lookup, value))
+        assert queries == 0
+
+    # справочник старше REFERENCE_MISS_RELOAD_SECONDS перечитывается при промахе
+    min_age, app.config["REFERENCE_MISS_RELOAD_SECONDS"] = app.config["REFERENCE_MISS_RELOAD_SECONDS"], 0
+    try:
+        _, queries = count_queries(app, lambda: pytest.raises(ValueError, lookup, "И этой нет"))
+        assert queries > 0
+    finally:
+        app.config["REFERENCE_MISS_RELOAD_SECONDS"] = min_age
@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta
+from http import HTTPStatus
+from uuid import uuid4
+
+import pytest
+
+from backend import app as app_module
+from backend.core import db
+from backend.core.models.system_models import ScheduledJobState, SchedulerLease
+from backend.core.services.scheduler_service import LEADER_LEASE, LeaderElection, run_scheduled_job
+
+
+@pytest.fixture
+def elections(app):
+    with app.app_context():
+        SchedulerLease.query.filter_by(name=LEADER_LEASE).delete()
+        db.session.commit()
+    first, second = LeaderElection(app), LeaderElection(app)
+    yield first, second
+    first.release()
+    second.release()
+
+
+def test_only_leader_runs_jobs_and_lease_fails_over(app, admin_client, elections):
+    first, second = elections
+    name = f"test-job-{uuid4().hex[:8]}"
+    runs = []
+
+    assert first.heartbeat()
+    assert not second.heartbeat()
+
+    assert not run_scheduled_job(app, second, name, lambda _: runs.append("second"))
+    assert run_scheduled_job(app, first, name, lambda _: runs.append("first"))
+    assert runs == ["first"]
+
+    with app.app_context():
+        state = db.session.get(ScheduledJobState, name)
+        assert state.last_holder == first.holder
+        assert state.run_count == 1 and state.last_success_at and state.last_duration_ms is not None
+
+        # лидер перестал продлевать аренду — её перехватывает другой процесс
+        db.session.get(SchedulerLease, LEADER_LEASE).locked_until = datetime.now() - timedelta(seconds=1)
+        db.session.commit()
+
+    assert second.heartbeat()
+    assert not first.heartbeat()
+
+    def failing_job(_):
+        raise RuntimeError("сбой задачи")
+
+    assert not run_scheduled_job(app, second, name, failing_job)
+
+    r = admin_client.get("/api/admin/scheduler/jobs")
+    assert r.status_code == HTTPStatus.OK
+    data = r.get_json()
+    assert data["leader"]["holder"] == second.holder
+    job = next(job for job in data["jobs"] if job["name"] == name)
+    assert job["run_count"] == 2 and job["failure_count"] == 1
+    assert job["last_error"] == "сбой задачи" and job["last_holder"] == second.holder
+
+    with app.app_context():
+        db.session.delete(db.session.get(ScheduledJobState, name))
+        db.session.commit()
+
+
+def test_cli_commands_do_not_start_scheduler(monkeypatch):
+    started = []
+    monkeypatch.setattr(app_module, "start_scheduler", started.append)
+    monkeypatch.setattr(app_module, "ensure_title_search_index", lambda: None)
+    monkeypatch.setattr("sys.argv", ["app.py", "ensure_search_index"])
+
+    with pytest.raises(SystemExit) as exit_info:
+        app_module.main()
+    assert exit_info.value.code == 0
+    assert not started
@@ -15,6 +15,26 @@ class TestAdminUsers:
         assert isinstance(data, list)
         assert any(u["email"] == TestAdminData.EMAIL for u in data)
 
+    def test_admin_get_users_page(self, client, admin_access_token):
+        headers = {"Authorization": f"Bearer {admin_access_token}"}
+        prefix = TestAdminData.EMAIL[:3]
+        r = client.get(f'/api/admin/users?email={prefix}&role=admin&limit=1', headers=headers)
+        assert r.status_code == HTTPStatus.OK
+        data = r.get_json()
+        assert data["total"] >= 1 and data["total_is_estimate"] is False
+        assert all(u["email"].startswith(prefix) and u["role"] == "admin" for u in data["users"])
+
+        emails = [u["email"] for u in data["users"]]
+        while data["next_cursor"]:
+            r = client.get(f'/api/admin/users?email={prefix}&role=admin&limit=1&cursor={data["next_cursor"]}',
+                           headers=headers)
+            data = r.get_json()
+            emails += [u["email"] for u in data["users"]]
+        assert TestAdminData.EMAIL in emails and emails == sorted(emails)
+
+        r = client.get('/api/admin/users?sort=password_hash&limit=5', headers=headers)
+        assert r.status_code == HTTPStatus.BAD_REQUEST
+
     def test_admin_create_user(self, client, admin_access_token):
         with client.application.app_context():
             existing_user = User.query.filter_by(email=TestUserData.EMAIL).first()
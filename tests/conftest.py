@@ -3,6 +3,7 @@ import json
 
 import pytest
 from flask_jwt_extended import create_access_token
+from sqlalchemy import event
 from werkzeug.datastructures import FileStorage
 
 from backend.core import create_app, db
@@ -247,3 +248,19 @@ def create_excursion_session(excursion_id, start_datetime, max_participants, cos
     db.session.add(session)
     db.session.commit()
     return session
+
+
+def count_queries(app, func):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        result = func()
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return result, len(statements)
@@ -4,7 +4,9 @@ from http import HTTPStatus
 import pytest
 
 from backend.core import db
-from tests.conftest import get_excursion_payload, create_excursion_session
+from backend.core.models.excursion_models import Excursion, ExcursionSession, Reservation
+from backend.core.services.excursion_services.analytics_service import get_resident_excursion_analytics
+from tests.conftest import get_excursion_payload, create_excursion_session, count_queries
 from tests.excursion_tests import _assert_excursions_list_response, _assert_create_excursion_bad_json, \
     _assert_patch_update_excursion_success, _assert_patch_excursion_not_found, _assert_get_excursion_by_id_success, \
     _assert_get_not_found, _assert_delete_success, _assert_delete_not_found, _test_get_sessions_for_excursion, \
@@ -101,3 +103,85 @@ class TestExcursionPhotos:
 
     def test_delete_photo_resident(self, resident_client, excursion_id):
         _test_delete_photo(resident_client, "/api/resident", excursion_id)
+
+
+def test_bulk_create_sessions_resident(app, resident_client, excursion_id):
+    url = f"/api/resident/excursions/{excursion_id}/sessions/bulk"
+    payload = {
+        "sessions": [{"start_datetime": "2031-05-31T18:00:00", "max_participants": 8, "cost": 900}],
+        # воскресенья и среды июня 2031: 1, 4, 8, 11, 15, 18, 22, 25, 29
+        "recurrence": {"weekdays": [0, 3], "start_time": "11:00", "date_from": "2031-06-01",
+                       "date_to": "2031-06-30", "max_participants": 10, "cost": 1500}
+    }
+    r = resident_client.post(url, json=payload)
+    assert r.status_code == HTTPStatus.CREATED, r.get_data(as_text=True)
+    assert len(r.get_json()["created"]) == 10
+
+    r = resident_client.post(url, json=payload)
+    assert r.status_code == HTTPStatus.CONFLICT
+    assert len(r.get_json()["conflicts"]) == 10
+
+    payload["sessions"].append({"start_datetime": "2031-07-01T11:00:00", "max_participants": 4})
+    r = resident_client.post(url, json=dict(payload, on_conflict="skip"))
+    assert r.status_code == HTTPStatus.CREATED
+    assert len(r.get_json()["created"]) == 1 and len(r.get_json()["skipped"]) == 10
+
+    payload["recurrence"]["max_participants"] = 12
+    r = resident_client.post(url, json=dict(payload, on_conflict="update"))
+    assert r.status_code == HTTPStatus.CREATED
+    assert r.get_json()["created"] == [] and len(r.get_json()["updated"]) == 11
+
+    with app.app_context():
+        sessions = ExcursionSession.query.filter(ExcursionSession.excursion_id == excursion_id,
+                                                 ExcursionSession.start_datetime >= datetime(2031, 1, 1)).all()
+        assert len(sessions) == 11
+        assert sorted(s.max_participants for s in sessions) == [4, 8] + [12] * 9
+
+    r = resident_client.post(url, json={"sessions": [{"start_datetime": "вчера", "max_participants": 5},
+                                                     {"start_datetime": "2031-08-01T11:00:00",
+                                                      "max_participants": 0}]})
+    assert r.status_code == HTTPStatus.BAD_REQUEST
+    assert [error["index"] for error in r.get_json()["errors"]] == [0, 1]
+
+    # число сеансов правила считается до построения дат: огромный диапазон отклоняется сразу
+    r = resident_client.post(url, json={"recurrence": {"weekdays": list(range(7)), "start_time": "23:59",
+                                                       "date_from": "0001-01-01", "date_to": "9999-12-31",
+                                                       "max_participants": 5}})
+    assert r.status_code == HTTPStatus.BAD_REQUEST and "не больше" in r.get_json()["message"]
+
+
+def test_resident_analytics_grouped_by_month(app, resident_client, excursion_id):
+    with app.app_context():
+        resident_id = db.session.get(Excursion, excursion_id).created_by
+        june = create_excursion_session(excursion_id, datetime(2032, 6, 10, 12, 0), 10, 500).session_id
+        july = create_excursion_session(excursion_id, datetime(2032, 7, 10, 12, 0), 10, 500).session_id
+        for session_id, count, paid, cancelled in ((june, 4, True, False), (june, 2, False, True),
+                                                   (july, 1, True, False)):
+            db.session.add(Reservation(session_id=session_id, user_id=resident_id, full_name="Гость",
+                                       phone_number="000", email="guest@example.com", participants_count=count,
+                                       is_paid=paid, is_cancelled=cancelled))
+        db.session.commit()
+
+    r = resident_client.get("/api/resident/analytics?start_date=2032-06-01&end_date=2032-07-31&bucket=month")
+    assert r.status_code == HTTPStatus.OK, r.get_data(as_text=True)
+    data = r.get_json()
+    excursion = next(item for item in data["details"] if item["excursion_id"] == excursion_id)
+    assert excursion["session_count"] == 2 and excursion["total_participants"] == 5
+    assert excursion["revenue"] == 2500 and excursion["fill_rate"] == 0.25
+    assert excursion["cancellation_rate"] == round(1 / 3, 4)
+    june_stats, july_stats = data["series"][:2]
+    assert june_stats["period"] == "2032-06-01" and june_stats["total_participants"] == 4
+    assert july_stats["period"] == "2032-07-01" and july_stats["revenue"] == 500
+
+    with app.app_context():
+        _, queries = count_queries(app, lambda: get_resident_excursion_analytics(resident_id, bucket="week"))
+    assert queries == 2
+
+    r = resident_client.get("/api/resident/analytics?bucket=year")
+    assert r.status_code == HTTPStatus.BAD_REQUEST
+
+    with app.app_context():
+        # без активных броней удаление экскурсии в фикстуре не создаёт задание отмены
+        for session_id in (june, july):
+            db.session.delete(db.session.get(ExcursionSession, session_id))
+        db.session.commit()
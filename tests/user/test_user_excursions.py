@@ -1,10 +1,22 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from http import HTTPStatus
 
 import pytest
+from sqlalchemy import event
+from werkzeug.datastructures import MultiDict
 
+from backend.core import db
 from backend.core.messages import AuthMessages
-from backend.core.models.excursion_models import ExcursionSession
-from tests.conftest import TestUserData
+from backend.core.models.auth_models import User
+from backend.core.models.excursion_models import Excursion, ExcursionSession, ExcursionSummary, Reservation
+from backend.core.models.news_models import News
+from backend.core.services.excursion_services.excursion_summary_service import refresh_excursion_summaries, \
+    refresh_stale_excursion_summaries
+from backend.core.services.response_cache import MemoryBackend, FilesystemBackend, ResponseCache, normalize_params
+from tests.conftest import TestUserData, TestAdminData, recreate_test_user, create_excursion_session, \
+    count_queries
 
 
 def test_get_excursions_list(client):
@@ -122,3 +134,330 @@ def test_delete_profile(client, access_token):
     assert r.status_code == HTTPStatus.OK
     data = r.get_json()
     assert AuthMessages.USER_DELETED_SELF in data.get("message", "")
+
+
+def test_excursion_detail_reports_booked_seats(client, app, access_token, existing_excursion_id):
+    headers = {"Authorization": f"Bearer {access_token}"}
+    with app.app_context():
+        recreate_test_user(TestUserData.EMAIL, TestUserData.PASSWORD, TestUserData.FULL_NAME,
+                           TestUserData.PHONE, TestUserData.ROLE)
+        session_id = ExcursionSession.query.filter_by(excursion_id=existing_excursion_id).first().session_id
+
+    payload = {
+        "session_id": session_id,
+        "full_name": TestUserData.FULL_NAME,
+        "phone_number": TestUserData.PHONE,
+        "email": TestUserData.EMAIL,
+        "participants_count": 1
+    }
+    r = client.post("/api/user/v2/reservations", json=payload, headers=headers)
+    assert r.status_code == HTTPStatus.CREATED, r.get_data(as_text=True)
+
+    r = client.get(f"/api/user/excursions_detail/{existing_excursion_id}")
+    assert r.status_code == HTTPStatus.OK
+    session_data = next(s for s in r.get_json()["sessions"] if s["session_id"] == session_id)
+    assert session_data["booked"] == 1
+    assert session_data["available"] == session_data["max_participants"] - 1
+
+
+@pytest.mark.parametrize("query", ["МАТЕМАТИКЕ", "занятия по", "по"])
+def test_excursions_title_search_is_case_insensitive(client, existing_excursion_id, query):
+    r = client.get("/api/user/excursions", query_string={"title": query})
+    assert r.status_code == HTTPStatus.OK
+    assert any(e["excursion_id"] == existing_excursion_id for e in r.get_json()["excursions"])
+
+
+def test_excursion_detail_hides_past_sessions(client, app, existing_excursion_id):
+    with app.app_context():
+        past = create_excursion_session(existing_excursion_id, datetime(2020, 1, 1, 12, 0), 5, 100)
+        past_id = past.session_id
+
+    r = client.get(f"/api/user/excursions_detail/{existing_excursion_id}")
+    assert r.status_code == HTTPStatus.OK
+    session_ids = [s["session_id"] for s in r.get_json()["sessions"]]
+    assert session_ids and past_id not in session_ids
+
+    r = client.get("/api/user/excursions", query_string={"title": "математике"})
+    excursion = next(e for e in r.get_json()["excursions"] if e["excursion_id"] == existing_excursion_id)
+    assert past_id not in [s["session_id"] for s in excursion["sessions"]]
+
+    with app.app_context():
+        assert db.session.get(ExcursionSession, past_id) is not None
+
+
+@pytest.fixture
+def catalog_excursions(app, existing_excursion_id):
+    with app.app_context():
+        source = db.session.get(Excursion, existing_excursion_id)
+        created = []
+        # одинаковые цены и даты проверяют переход страницы на равных значениях ключа сортировки
+        for index, cost in enumerate([500, 500, 0]):
+            excursion = Excursion(
+                title=f"Пагинация {index}", description=source.description, duration=source.duration,
+                category_id=source.category_id, format_type_id=source.format_type_id,
+                age_category_id=source.age_category_id, created_by=source.created_by, place=source.place
+            )
+            db.session.add(excursion)
+            db.session.flush()
+            db.session.add(ExcursionSession(excursion_id=excursion.excursion_id, max_participants=5,
+                                            start_datetime=datetime(2029, 8, 1, 10, 0), cost=cost))
+            created.append(excursion.excursion_id)
+        db.session.commit()
+
+    yield created
+
+    with app.app_context():
+        for excursion_id in created:
+            db.session.delete(db.session.get(Excursion, excursion_id))
+        db.session.commit()
+
+
+@pytest.mark.parametrize("sort", [None, "-price", "time", "title"])
+def test_excursions_keyset_pagination(client, catalog_excursions, sort):
+    query = {"sort": sort} if sort else {}
+    r = client.get("/api/user/excursions", query_string=query)
+    expected = [e["excursion_id"] for e in r.get_json()["excursions"]]
+
+    seen, cursor = [], None
+    while True:
+        params = dict(query, limit=1)
+        if cursor:
+            params["cursor"] = cursor
+        r = client.get("/api/user/excursions", query_string=params)
+        assert r.status_code == HTTPStatus.OK
+        data = r.get_json()
+        assert len(data["excursions"]) <= 1
+        seen.extend(e["excursion_id"] for e in data["excursions"])
+        cursor = data["next_cursor"]
+        if cursor is None:
+            break
+
+    assert seen == expected
+    assert set(catalog_excursions) <= set(seen)
+
+
+def test_excursions_field_projection(client, existing_excursion_id):
+    r = client.get("/api/user/excursions", query_string={"fields": "title,photos", "limit": 100})
+    assert r.status_code == HTTPStatus.OK
+    excursion = next(e for e in r.get_json()["excursions"] if e["excursion_id"] == existing_excursion_id)
+    assert set(excursion) == {"excursion_id", "title", "photos"}
+
+    r = client.get("/api/user/excursions", query_string={"fields": "title,password"})
+    assert r.status_code == HTTPStatus.BAD_REQUEST
+
+
+def test_excursions_invalid_cursor(client):
+    r = client.get("/api/user/excursions", query_string={"limit": 1, "cursor": "мусор"})
+    assert r.status_code == HTTPStatus.BAD_REQUEST
+    r = client.get("/api/user/excursions", query_string={"limit": "abc"})
+    assert r.status_code == HTTPStatus.BAD_REQUEST
+
+
+def test_excursion_summary_follows_sessions_and_reservations(client, app, access_token, existing_excursion_id):
+    with app.app_context():
+        recreate_test_user(TestUserData.EMAIL, TestUserData.PASSWORD, TestUserData.FULL_NAME,
+                           TestUserData.PHONE, TestUserData.ROLE)
+        create_excursion_session(existing_excursion_id, datetime(2030, 3, 1, 12, 0), 4, 250)
+        first_id = ExcursionSession.query.filter_by(excursion_id=existing_excursion_id).order_by(
+            ExcursionSession.start_datetime).first().session_id
+        summary = db.session.get(ExcursionSummary, existing_excursion_id)
+        assert summary.next_session_at == datetime(2029, 7, 25, 17, 0)
+        assert summary.last_session_at == datetime(2030, 3, 1, 12, 0)
+        assert summary.total_capacity == 5
+        assert float(summary.max_cost) == 250
+        assert ",математика," in summary.tag_names
+
+    payload = {
+        "session_id": first_id,
+        "full_name": TestUserData.FULL_NAME,
+        "phone_number": TestUserData.PHONE,
+        "email": TestUserData.EMAIL,
+        "participants_count": 1
+    }
+    r = client.post("/api/user/v2/reservations", json=payload, headers={"Authorization": f"Bearer {access_token}"})
+    assert r.status_code == HTTPStatus.CREATED, r.get_data(as_text=True)
+
+    with app.app_context():
+        assert db.session.get(ExcursionSummary, existing_excursion_id).booked_seats == 1
+
+        # после начала ближайшего сеанса плановый пересчёт сдвигает дату и цену на следующий
+        refresh_stale_excursion_summaries(now=datetime(2029, 8, 1))
+        summary = db.session.get(ExcursionSummary, existing_excursion_id)
+        assert summary.next_session_at == datetime(2030, 3, 1, 12, 0)
+        assert float(summary.min_cost) == 250
+        assert summary.total_capacity == 4
+        assert summary.booked_seats == 0
+
+    r = client.get("/api/user/excursions", query_string={"tags": "математика", "min_price": 0})
+    assert existing_excursion_id in [e["excursion_id"] for e in r.get_json()["excursions"]]
+    r = client.get("/api/user/excursions", query_string={"tags": "матем"})
+    assert existing_excursion_id not in [e["excursion_id"] for e in r.get_json()["excursions"]]
+
+
+def test_excursion_summary_is_upserted(app, existing_excursion_id):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with app.app_context():
+        db.session.execute(ExcursionSummary.__table__.update()
+                           .where(ExcursionSummary.excursion_id == existing_excursion_id)
+                           .values(total_capacity=999, tag_names=","))
+        event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            refresh_excursion_summaries([existing_excursion_id])
+        finally:
+            event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+        db.session.commit()
+
+        # строка обновляется на месте, без DELETE: параллельная транзакция не упрётся в первичный ключ
+        assert not [statement for statement in statements if statement.startswith("DELETE")]
+        assert any("ON CONFLICT" in statement for statement in statements)
+        summaries = ExcursionSummary.query.filter_by(excursion_id=existing_excursion_id).all()
+        assert len(summaries) == 1
+        assert summaries[0].total_capacity == 1 and ",математика," in summaries[0].tag_names
+
+
+def test_catalog_conditional_get(client, app, existing_excursion_id):
+    r = client.get("/api/user/excursions")
+    etag = r.headers["ETag"]
+    assert "Last-Modified" not in r.headers
+
+    r = client.get("/api/user/excursions", headers={"If-None-Match": etag})
+    assert r.status_code == HTTPStatus.NOT_MODIFIED
+    assert r.data == b""
+    detail_url = f"/api/user/excursions_detail/{existing_excursion_id}"
+    detail_etag = client.get(detail_url).headers["ETag"]
+    assert detail_etag != etag
+    assert client.get(detail_url, headers={"If-None-Match": detail_etag}).status_code == HTTPStatus.NOT_MODIFIED
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            create_excursion_session(existing_excursion_id, datetime(2030, 5, 1, 12, 0), 3, 100)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+    # изменение каталога не пишет в общую строку resource_versions
+    assert not [statement for statement in statements if "resource_versions" in statement]
+
+    r = client.get("/api/user/excursions", headers={"If-None-Match": etag})
+    assert r.status_code == HTTPStatus.OK
+    assert r.headers["ETag"] != etag
+    assert client.get(detail_url, headers={"If-None-Match": detail_etag}).status_code == HTTPStatus.OK
+
+
+def test_news_conditional_get(client, app):
+    with app.app_context():
+        author = User.query.filter_by(email=TestAdminData.EMAIL).first()
+        news = News(title="Условный запрос", content="Текст", author_id=author.user_id)
+        db.session.add(news)
+        db.session.commit()
+        news_id = news.news_id
+
+    r = client.get(f"/api/user/news/{news_id}")
+    assert r.status_code == HTTPStatus.OK
+    etag = r.headers["ETag"]
+    assert client.get("/api/user/news", headers={"If-None-Match": etag}).status_code == HTTPStatus.NOT_MODIFIED
+
+    with app.app_context():
+        db.session.get(News, news_id).title = "Условный запрос (обновлено)"
+        db.session.commit()
+
+    r = client.get(f"/api/user/news/{news_id}", headers={"If-None-Match": etag})
+    assert r.status_code == HTTPStatus.OK
+    assert r.get_json()["title"] == "Условный запрос (обновлено)"
+
+    with app.app_context():
+        db.session.delete(db.session.get(News, news_id))
+        db.session.commit()
+
+
+def test_catalog_served_from_response_cache(client, app, existing_excursion_id):
+    params = {"tags": "математика,школьники", "sort": "-price"}
+    first = client.get("/api/user/excursions", query_string=params)
+    assert first.status_code == HTTPStatus.OK
+
+    reordered = {"sort": "-price", "tags": "школьники, математика"}
+    r, queries = count_queries(app, lambda: client.get("/api/user/excursions", query_string=reordered))
+    assert r.status_code == HTTPStatus.OK
+    assert r.get_json() == first.get_json()
+    # остаётся только чтение версии каталога
+    assert queries == 1
+
+
+def test_cache_key_uses_params_as_handler_reads_them():
+    def key(*pairs):
+        return normalize_params(MultiDict(pairs), ("tags", "sort", "title"), list_params=("tags",),
+                                ordered_params=("sort",))
+
+    # обработчик читает только первое значение параметра
+    assert key(("tags", "a"), ("tags", "b")) != key(("tags", "b"), ("tags", "a"))
+    assert key(("tags", "b, a,a")) == key(("tags", "a,b"))
+    assert key(("sort", "price,-time")) != key(("sort", "-time,price"))
+    assert key(("title", "Музей"), ("utm_source", "mail")) == key(("title", "Музей"))
+
+
+@pytest.mark.parametrize("backend_name", ["memory", "filesystem"])
+def test_response_cache_single_flight(tmp_path, backend_name):
+    if backend_name == "memory":
+        backend = MemoryBackend()
+    else:
+        backend = FilesystemBackend(str(tmp_path))
+    cache = ResponseCache(backend, ttl=60)
+    builds = []
+
+    def build():
+        builds.append(1)
+        time.sleep(0.2)
+        return {"excursions": []}, HTTPStatus.OK
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda _: cache.get_or_build("catalog-1:excursions?", build), range(8)))
+
+    assert len(builds) == 1
+    assert all(result == ({"excursions": []}, 200) for result in results)
+
+
+def test_concurrent_reservations_never_oversell(app, access_token, existing_excursion_id):
+    capacity, attempts = 5, 24
+    with app.app_context():
+        recreate_test_user(TestUserData.EMAIL, TestUserData.PASSWORD, TestUserData.FULL_NAME,
+                           TestUserData.PHONE, TestUserData.ROLE)
+        session_id = create_excursion_session(existing_excursion_id, datetime(2029, 9, 1, 10, 0), capacity, 0) \
+            .session_id
+
+    payload = {
+        "session_id": session_id,
+        "full_name": TestUserData.FULL_NAME,
+        "phone_number": TestUserData.PHONE,
+        "email": TestUserData.EMAIL,
+        "participants_count": 1
+    }
+
+    def reserve(_):
+        with app.test_client() as thread_client:
+            return thread_client.post("/api/user/v2/reservations", json=payload,
+                                      headers={"Authorization": f"Bearer {access_token}"}).status_code
+
+    with ThreadPoolExecutor(max_workers=12) as pool:
+        statuses = list(pool.map(reserve, range(attempts)))
+
+    assert statuses.count(HTTPStatus.CREATED) == capacity
+    assert statuses.count(HTTPStatus.BAD_REQUEST) == attempts - capacity
+
+    with app.app_context():
+        session = db.session.get(ExcursionSession, session_id)
+        assert session.seats_reserved == capacity
+        assert session.booked_count() == capacity
+
+        reservation = Reservation.query.filter_by(session_id=session_id).first()
+        reservation.is_cancelled = True
+        db.session.commit()
+        db.session.refresh(session)
+        assert session.seats_reserved == capacity - 1
@@ -0,0 +1,132 @@
+import socket
+import socketserver
+import threading
+from datetime import datetime
+from uuid import uuid4
+
+import pytest
+
+from backend.core import db
+from backend.core.models.system_models import EmailOutbox
+from backend.core.services.email_outbox_service import deliver_queued_emails
+from backend.core.services.email_templates import render_email, render_email_bulk
+from backend.core.services.utilits import send_email
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Минимальный SMTP-сервер для тестов: принимает письма и складывает их в server.messages."""
+
+    def handle(self):
+        self.server.connections += 1
+        self.wfile.write(b"220 localhost\r\n")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("utf-8", "replace").strip().upper()
+            if command.startswith("DATA"):
+                self.wfile.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+                data = []
+                while (chunk := self.rfile.readline()) not in (b".\r\n", b""):
+                    data.append(chunk)
+                self.server.messages.append(b"".join(data))
+                self.wfile.write(b"250 OK\r\n")
+            elif command.startswith("QUIT"):
+                self.wfile.write(b"221 Bye\r\n")
+                return
+            else:
+                self.wfile.write(b"250 OK\r\n")
+
+
+@pytest.fixture
+def smtp_server():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), _SMTPHandler)
+    server.daemon_threads = True
+    server.connections = 0
+    server.messages = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _use_smtp(app, monkeypatch, port):
+    state = app.extensions["mail"]
+    for name, value in {"server": "127.0.0.1", "port": port, "use_tls": False, "use_ssl": False,
+                        "username": None, "password": None, "suppress": False,
+                        "default_sender": "noreply@example.com"}.items():
+        monkeypatch.setattr(state, name, value)
+
+
+def test_queued_emails_share_one_smtp_connection(app, smtp_server, monkeypatch):
+    _use_smtp(app, monkeypatch, smtp_server.server_address[1])
+    monkeypatch.setitem(app.config, "EMAIL_WORKERS", 1)
+    monkeypatch.setitem(app.config, "EMAIL_BATCH_SIZE", 1000)
+    marker = uuid4().hex
+
+    with app.app_context():
+        for i in range(5):
+            send_email(f"Письмо {marker} {i}", f"user{i}@example.com", "Текст",
+                       attachments=[("list.csv", "id;name\n1;Тест")])
+        db.session.commit()
+
+    assert deliver_queued_emails(app) >= 5
+    assert smtp_server.connections == 1
+    assert sum(marker.encode() in message for message in smtp_server.messages) == 5
+
+    with app.app_context():
+        emails = EmailOutbox.query.filter(EmailOutbox.subject.like(f"%{marker}%")).all()
+        assert len(emails) == 5
+        assert all(email.status == EmailOutbox.SENT and email.sent_at for email in emails)
+
+
+def test_failed_delivery_is_retried_later(app, monkeypatch):
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        closed_port = probe.getsockname()[1]
+    _use_smtp(app, monkeypatch, closed_port)
+    marker = uuid4().hex
+
+    with app.app_context():
+        send_email(f"Письмо {marker}", "user@example.com", "Текст", commit=True)
+
+    assert deliver_queued_emails(app) == 0
+
+    with app.app_context():
+        email = EmailOutbox.query.filter(EmailOutbox.subject.like(f"%{marker}%")).one()
+        assert email.status == EmailOutbox.PENDING
+        assert email.attempts == 1 and email.last_error
+        assert email.next_attempt_at > datetime.now()
+        # письмо, которое так и не ушло, не должно оставаться в очереди после теста
+        db.session.delete(email)
+        db.session.commit()
+
+
+def test_email_templates_render_plain_context():
+    context = {"full_name": "Иван <script>", "title": "Крыши", "session_id": 7,
+               "session_start": datetime(2030, 5, 1, 18, 30), "refund_expected": True}
+
+    subject, text, html = render_email("session_cancellation", context)
+
+    assert subject == "Отмена экскурсионной сессии"
+    assert "Иван <script>!" in text and "01.05.2030 18:30" in text
+    assert "Средства будут возвращены" in text
+    assert "&lt;script&gt;" in html and "<script>" not in html
+
+    rendered = render_email_bulk(
+        "session_cancellation",
+        [{"full_name": f"Участник {i}", "session_id": 7, "refund_expected": i % 2 == 0} for i in range(3)],
+        shared={"title": "Крыши", "session_start": datetime(2030, 5, 1, 18, 30)}
+    )
+    assert [f"Участник {i}" in text for i, (_, text, _) in enumerate(rendered)] == [True] * 3
+    assert ["Средства будут возвращены" in text for _, text, _ in rendered] == [True, False, True]
+
+
+def test_queued_email_follows_caller_transaction(app):
+    marker = uuid4().hex
+    with app.app_context():
+        send_email(f"Письмо {marker}", "user@example.com", "Текст")
+        # постановка в очередь не коммитит незавершённую работу вызывающего кода
+        db.session.rollback()
+        assert not EmailOutbox.query.filter(EmailOutbox.subject.like(f"%{marker}%")).count()
@@ -0,0 +1,254 @@
+from datetime import datetime, timedelta
+from http import HTTPStatus
+from types import SimpleNamespace
+from uuid import uuid4
+
+import pytest
+
+from backend.core import db
+from backend.core.models.auth_models import User
+from backend.core.models.excursion_models import ExcursionSession, Reservation, Payment, PaymentOutbox
+from backend.core.models.system_models import WebhookEvent
+from backend.core.scripts.clear_unpaid import cleanup_unpaid_reservations
+from backend.core.services import payment_outbox_service, webhook_service
+from backend.core.services.payment_outbox_service import dispatch_payment_outbox
+from backend.core.services.webhook_service import process_webhook_events
+from backend.core.services.excursion_services.seat_service import reserve_seats
+from tests.conftest import TestUserData, recreate_test_user, create_excursion_session
+
+
+@pytest.fixture
+def single_seat_session(app, existing_excursion_id):
+    with app.app_context():
+        recreate_test_user(TestUserData.EMAIL, TestUserData.PASSWORD, TestUserData.FULL_NAME,
+                           TestUserData.PHONE, TestUserData.ROLE)
+        return create_excursion_session(existing_excursion_id, datetime(2029, 10, 1, 10, 0), 1, 0).session_id
+
+
+def _hold_seat(session_id, expires_at):
+    user = User.query.filter_by(email=TestUserData.EMAIL).first()
+    assert reserve_seats(session_id, 1)
+    reservation = Reservation(
+        session_id=session_id, user_id=user.user_id, full_name=TestUserData.FULL_NAME,
+        phone_number=TestUserData.PHONE, email=TestUserData.EMAIL, participants_count=1,
+        is_paid=False, is_cancelled=False, hold_expires_at=expires_at
+    )
+    db.session.add(reservation)
+    db.session.commit()
+    return reservation.reservation_id
+
+
+@pytest.fixture
+def paid_session(app, existing_excursion_id):
+    with app.app_context():
+        recreate_test_user(TestUserData.EMAIL, TestUserData.PASSWORD, TestUserData.FULL_NAME,
+                           TestUserData.PHONE, TestUserData.ROLE)
+        return create_excursion_session(existing_excursion_id, datetime(2029, 10, 2, 10, 0), 3, 500).session_id
+
+
+def _fake_payment(payment_id):
+    return SimpleNamespace(
+        id=payment_id, status="pending", payment_method=SimpleNamespace(type="bank_card"),
+        confirmation=SimpleNamespace(confirmation_url=f"https://pay.example/{payment_id}")
+    )
+
+
+def _reserve(client, access_token, session_id):
+    payload = {
+        "session_id": session_id,
+        "full_name": TestUserData.FULL_NAME,
+        "phone_number": TestUserData.PHONE,
+        "email": TestUserData.EMAIL,
+        "participants_count": 1
+    }
+    return client.post("/api/user/v2/reservations", json=payload, headers={"Authorization": f"Bearer {access_token}"})
+
+
+def test_active_hold_blocks_last_seat(client, app, access_token, single_seat_session):
+    with app.app_context():
+        _hold_seat(single_seat_session, datetime.now() + timedelta(minutes=10))
+
+    r = _reserve(client, access_token, single_seat_session)
+    assert r.status_code == HTTPStatus.BAD_REQUEST
+
+
+def test_expired_hold_is_released_on_admission(client, app, access_token, single_seat_session):
+    with app.app_context():
+        hold_id = _hold_seat(single_seat_session, datetime.now() - timedelta(minutes=1))
+
+    r = _reserve(client, access_token, single_seat_session)
+    assert r.status_code == HTTPStatus.CREATED, r.get_data(as_text=True)
+
+    with app.app_context():
+        assert db.session.get(Reservation, hold_id).is_cancelled
+        assert db.session.get(ExcursionSession, single_seat_session).seats_reserved == 1
+
+
+def test_late_payment_reinstates_expired_hold(client, app, single_seat_session):
+    with app.app_context():
+        hold_id = _hold_seat(single_seat_session, datetime.now() - timedelta(minutes=1))
+        cleanup_unpaid_reservations()
+        assert db.session.get(Reservation, hold_id).is_cancelled
+        assert db.session.get(ExcursionSession, single_seat_session).seats_reserved == 0
+
+    r = client.post("/api/webhook/yookassa", json={
+        "event": "payment.succeeded",
+        "object": {"id": f"late-{uuid4().hex}", "metadata": {"reservation_id": hold_id}}
+    })
+    assert r.status_code == HTTPStatus.OK
+
+    with app.app_context():
+        reservation = db.session.get(Reservation, hold_id)
+        assert reservation.is_paid and not reservation.is_cancelled
+        assert reservation.hold_expires_at is None
+        assert db.session.get(ExcursionSession, single_seat_session).seats_reserved == 1
+
+
+def test_paid_reservation_payment_created_by_outbox(client, app, access_token, paid_session, monkeypatch):
+    calls = []
+
+    def create_payment(**kwargs):
+        calls.append(kwargs)
+        return _fake_payment(f"outbox-{uuid4().hex}")
+
+    monkeypatch.setattr(payment_outbox_service, "create_yookassa_payment", create_payment)
+    headers = {"Authorization": f"Bearer {access_token}"}
+
+    r = _reserve(client, access_token, paid_session)
+    assert r.status_code == HTTPStatus.ACCEPTED, r.get_data(as_text=True)
+    reservation_id = r.get_json()["reservation_id"]
+    assert not calls
+
+    r = client.get(r.get_json()["status_url"], headers=headers)
+    assert r.status_code == HTTPStatus.OK
+    assert r.get_json()["status"] == "pending"
+    assert r.headers["Retry-After"] == str(r.get_json()["retry_after"])
+
+    assert dispatch_payment_outbox(app) == 1
+    assert dispatch_payment_outbox(app) == 0
+
+    r = client.get(f"/api/user/v2/reservations/{reservation_id}/payment", headers=headers)
+    body = r.get_json()
+    assert body["status"] == "ready" and "Retry-After" not in r.headers
+    assert body["payment_url"] == f"https://pay.example/{body['payment_id']}"
+    assert len(calls) == 1 and calls[0]["amount"] == 500
+
+    with app.app_context():
+        payment = db.session.get(Payment, body["payment_id"])
+        assert payment.reservation_id == reservation_id
+
+
+def test_payment_outbox_gives_up_and_releases_seats(client, app, access_token, paid_session, monkeypatch):
+    def create_payment(**kwargs):
+        raise ConnectionError("YooKassa недоступна")
+
+    monkeypatch.setattr(payment_outbox_service, "create_yookassa_payment", create_payment)
+    monkeypatch.setitem(app.config, "PAYMENT_OUTBOX_MAX_ATTEMPTS", 1)
+
+    reservation_id = _reserve(client, access_token, paid_session).get_json()["reservation_id"]
+    dispatch_payment_outbox(app)
+
+    r = client.get(f"/api/user/v2/reservations/{reservation_id}/payment",
+                   headers={"Authorization": f"Bearer {access_token}"})
+    assert r.get_json()["status"] == "failed"
+
+    with app.app_context():
+        job = PaymentOutbox.query.filter_by(reservation_id=reservation_id).one()
+        assert job.attempts == 1 and "недоступна" in job.last_error
+        assert db.session.get(Reservation, reservation_id).is_cancelled
+        assert db.session.get(ExcursionSession, paid_session).seats_reserved == 0
+
+
+def test_cleanup_expires_holds_in_batches_and_cancels_pending_payments(app, paid_session, monkeypatch):
+    monkeypatch.setitem(app.config, "CLEANUP_BATCH_SIZE", 2)
+    with app.app_context():
+        hold_ids = [_hold_seat(paid_session, datetime.now() - timedelta(minutes=1)) for _ in range(3)]
+        payment_ids = [f"expired-{uuid4().hex}" for _ in hold_ids]
+        for hold_id, payment_id in zip(hold_ids, payment_ids):
+            db.session.add(Payment(payment_id=payment_id, session_id=paid_session, reservation_id=hold_id,
+                                   participants_count=1, email=TestUserData.EMAIL, amount=500, status="pending"))
+        db.session.commit()
+
+        assert cleanup_unpaid_reservations() >= 3
+
+        assert all(db.session.get(Reservation, hold_id).is_cancelled for hold_id in hold_ids)
+        assert db.session.get(ExcursionSession, paid_session).seats_reserved == 0
+        assert {db.session.get(Payment, payment_id).status for payment_id in payment_ids} == {"canceled"}
+
+
+def _payment_succeeded(reservation_id):
+    return {
+        "event": "payment.succeeded",
+        "object": {"id": f"payment-{uuid4().hex}", "metadata": {"reservation_id": reservation_id}}
+    }
+
+
+def test_repeated_webhook_delivery_is_applied_once(client, app, single_seat_session):
+    with app.app_context():
+        hold_id = _hold_seat(single_seat_session, datetime.now() - timedelta(minutes=1))
+        cleanup_unpaid_reservations()
+
+    event = _payment_succeeded(hold_id)
+    first = client.post("/api/webhook/yookassa", json=event)
+    assert first.get_json()["message"] == "Webhook обработан"
+
+    with app.app_context():
+        # бронь снова отменяется; повторная доставка не должна восстановить её второй раз
+        db.session.get(Reservation, hold_id).is_cancelled = True
+        db.session.commit()
+
+    second = client.post("/api/webhook/yookassa", json=event)
+    assert second.status_code == HTTPStatus.OK
+    assert second.get_json()["message"] == "Событие уже обработано"
+
+    with app.app_context():
+        assert db.session.get(Reservation, hold_id).is_cancelled
+        assert db.session.get(ExcursionSession, single_seat_session).seats_reserved == 0
+
+
+def test_webhook_queue_mode_applies_events_in_batches(client, app, single_seat_session, monkeypatch):
+    monkeypatch.setitem(app.config, "WEBHOOK_QUEUE_MODE", True)
+    with app.app_context():
+        hold_id = _hold_seat(single_seat_session, datetime.now() + timedelta(minutes=10))
+
+    r = client.post("/api/webhook/yookassa", json=_payment_succeeded(hold_id))
+    assert r.status_code == HTTPStatus.OK
+    assert r.get_json()["message"] == "Событие принято"
+
+    with app.app_context():
+        assert not db.session.get(Reservation, hold_id).is_paid
+        assert process_webhook_events() >= 1
+        assert process_webhook_events() == 0
+        assert db.session.get(Reservation, hold_id).is_paid
+
+
+def test_failing_webhook_event_is_backed_off_then_failed(client, app, monkeypatch):
+    monkeypatch.setitem(app.config, "WEBHOOK_QUEUE_MODE", True)
+    monkeypatch.setitem(app.config, "WEBHOOK_MAX_ATTEMPTS", 3)
+
+    def apply_event(event_type, object_data):
+        raise RuntimeError("сбой применения")
+
+    monkeypatch.setattr(webhook_service, "apply_yookassa_event", apply_event)
+    payment_id = f"poison-{uuid4().hex}"
+    r = client.post("/api/webhook/yookassa", json={"event": "payment.canceled", "object": {"id": payment_id}})
+    assert r.status_code == HTTPStatus.OK
+
+    def poison_event():
+        return WebhookEvent.query.filter_by(object_id=payment_id).one()
+
+    with app.app_context():
+        assert process_webhook_events() == 0
+        # повтор отложен: тот же проход и следующий опрос событие не берут
+        assert process_webhook_events() == 0
+        event = poison_event()
+        assert event.status == WebhookEvent.RECEIVED and event.attempts == 1
+        assert event.next_attempt_at > datetime.now()
+
+        for day in (1, 2):
+            process_webhook_events(now=datetime.now() + timedelta(days=day))
+        event = poison_event()
+        assert event.status == WebhookEvent.FAILED and event.attempts == 3
+        assert "сбой применения" in event.last_error
+        db.session.delete(event)
+        db.session.commit()